@@ -0,0 +1,3 @@
+# This package contains the project's custom Scrapy commands
+#
+# See: https://docs.scrapy.org/en/latest/topics/commands.html#custom-project-commands
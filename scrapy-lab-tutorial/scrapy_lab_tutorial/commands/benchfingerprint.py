@@ -0,0 +1,131 @@
+import gc
+import time
+
+from scrapy import Request, Spider
+from scrapy.commands import ScrapyCommand
+from scrapy.utils.misc import build_from_crawler
+from scrapy.utils.request import RequestFingerprinter
+
+from scrapy_lab_tutorial.fingerprint import FastRequestFingerprinter
+
+# Request meta of a typical seed list. Every request gets its own copy, as
+# spiders build their meta per request.
+SEED_META = [
+    {},
+    {"zyte_api_automap": True},
+    {"zyte_api": {"browserHtml": True}},
+    {"zyte_api": {"httpResponseBody": True, "httpResponseHeaders": True}},
+    {
+        "zyte_api": {
+            "browserHtml": True,
+            "screenshot": True,
+            "actions": [
+                {"action": "waitForSelector", "selector": "div.quote", "timeout": 10}
+            ],
+        }
+    },
+]
+
+
+def _seed_requests(start, stop):
+    return [
+        Request(
+            f"https://quotes.toscrape.com/page/{i}/?tag=t{i % 97}&sort=asc",
+            meta={
+                key: dict(value) if isinstance(value, dict) else value
+                for key, value in SEED_META[i % len(SEED_META)].items()
+            },
+        )
+        for i in range(start, stop)
+    ]
+
+
+class _BenchmarkSpider(Spider):
+    # Runs the benchmark once the engine is up, as some fingerprinters (e.g.
+    # scrapy-zyte-api's) look up downloader middlewares of the crawler.
+    name = "benchfingerprint"
+
+    async def start(self):
+        self.benchmark(self.crawler)
+        return
+        yield
+
+
+class Command(ScrapyCommand):
+    requires_project = True
+    default_settings = {"LOG_ENABLED": False}
+
+    def syntax(self):
+        return "[options]"
+
+    def short_desc(self):
+        return "Benchmark request fingerprinters on a generated seed list"
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument(
+            "-n",
+            "--requests",
+            type=int,
+            default=1_000_000,
+            help="number of requests to fingerprint (default: 1000000)",
+        )
+        parser.add_argument(
+            "--lookups",
+            type=int,
+            default=3,
+            help="fingerprint lookups per request, e.g. dupefilter, HTTP cache "
+            "and scheduler (default: 3)",
+        )
+        parser.add_argument(
+            "--batch",
+            type=int,
+            default=10_000,
+            help="requests alive at the same time (default: 10000)",
+        )
+
+    def fingerprinters(self, crawler):
+        yield "scrapy", build_from_crawler(RequestFingerprinter, crawler)
+        try:
+            from scrapy_zyte_api import ScrapyZyteAPIRequestFingerprinter
+        except ImportError:
+            pass
+        else:
+            yield "scrapy-zyte-api", build_from_crawler(
+                ScrapyZyteAPIRequestFingerprinter, crawler
+            )
+        yield "fast", build_from_crawler(FastRequestFingerprinter, crawler)
+
+    def run(self, args, opts):
+        self.crawler_process.crawl(
+            _BenchmarkSpider, benchmark=lambda crawler: self.benchmark(crawler, opts)
+        )
+        self.crawler_process.start()
+
+    def benchmark(self, crawler, opts):
+        print(
+            f"{'fingerprinter':<16} {'first µs/req':>13} {'cached µs/lookup':>17} "
+            f"{'total s':>8} {'req/s':>10}"
+        )
+        for name, fingerprinter in self.fingerprinters(crawler):
+            first = cached = 0.0
+            for start in range(0, opts.requests, opts.batch):
+                requests = _seed_requests(start, min(start + opts.batch, opts.requests))
+                gc.collect()
+                t0 = time.perf_counter()
+                for request in requests:
+                    fingerprinter.fingerprint(request)
+                t1 = time.perf_counter()
+                for _ in range(opts.lookups - 1):
+                    for request in requests:
+                        fingerprinter.fingerprint(request)
+                t2 = time.perf_counter()
+                first += t1 - t0
+                cached += t2 - t1
+            total = first + cached
+            lookups = opts.requests * max(opts.lookups - 1, 1)
+            print(
+                f"{name:<16} {first / opts.requests * 1e6:>13.2f} "
+                f"{cached / lookups * 1e6:>17.2f} {total:>8.2f} "
+                f"{opts.requests / total:>10.0f}"
+            )
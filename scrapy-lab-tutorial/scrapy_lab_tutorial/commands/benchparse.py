@@ -0,0 +1,389 @@
+import asyncio
+import contextlib
+import importlib.util
+import inspect
+import io
+import json
+import random
+import time
+import tracemalloc
+from pathlib import Path
+
+from itemadapter import is_item
+from scrapy import Request, Spider
+from scrapy.commands import ScrapyCommand
+from scrapy.crawler import Crawler
+from scrapy.exceptions import UsageError
+from scrapy.http import HtmlResponse
+from scrapy.utils.conf import closest_scrapy_cfg
+
+AUTHORS = [
+    "Albert Einstein",
+    "J.K. Rowling",
+    "Jane Austen",
+    "Marilyn Monroe",
+    "André Gide",
+    "Thomas A. Edison",
+    "Eleanor Roosevelt",
+    "Steve Martin",
+]
+WORDS = (
+    "the world as we have created it is a process of our thinking it cannot be "
+    "changed without changing our thinking choices abilities truly are"
+).split()
+TAGS = ["change", "deep-thoughts", "thinking", "world", "life", "love", "humor"]
+
+
+def _quote(rng):
+    text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 40)))
+    return {
+        "text": f"“{text.capitalize()}.”",
+        "author": rng.choice(AUTHORS),
+        "tags": rng.sample(TAGS, rng.randint(0, 4)),
+    }
+
+
+def _quote_html(quote):
+    slug = quote["author"].replace(" ", "-").replace(".", "")
+    tags = "".join(
+        f'<a class="tag" href="/tag/{tag}/page/1/">{tag}</a>\n' for tag in quote["tags"]
+    )
+    return (
+        '<div class="quote" itemscope itemtype="http://schema.org/CreativeWork">\n'
+        f'<span class="text" itemprop="text">{quote["text"]}</span>\n'
+        f'<span>by <small class="author" itemprop="author">{quote["author"]}</small>\n'
+        f'<a href="/author/{slug}">(about)</a></span>\n'
+        f'<div class="tags">Tags: {tags}</div>\n'
+        "</div>\n"
+    )
+
+
+def _page(body, head=""):
+    return (
+        '<!DOCTYPE html>\n<html lang="en"><head><meta charset="UTF-8">'
+        f"<title>Quotes to Scrape</title>{head}</head>\n"
+        '<body><div class="container"><div class="row header-box">'
+        '<h1><a href="/" style="text-decoration: none">Quotes to Scrape</a></h1>'
+        f"</div>\n{body}\n"
+        '<nav><ul class="pager"><li class="next"><a href="/page/2/">Next '
+        '<span aria-hidden="true">&rarr;</span></a></li></ul></nav>'
+        "</div></body></html>"
+    )
+
+
+def static_page(rng, quotes=10):
+    """A server-rendered page like https://quotes.toscrape.com/page/1/."""
+    return _page("".join(_quote_html(_quote(rng)) for _ in range(quotes)))
+
+
+def js_page(rng, quotes=10):
+    """The raw HTML of https://quotes.toscrape.com/js/: the quotes are in a
+    script, there is no div.quote until a browser runs it."""
+    data = json.dumps([_quote(rng) for _ in range(quotes)], ensure_ascii=False)
+    return _page(
+        '<script src="/static/jquery.js"></script>\n'
+        f"<script>\n    var data = {data};\n"
+        "    for (var i in data) {\n        var d = data[i];\n"
+        '        var e = $(\'<div class="quote"></div>\');\n'
+        "        /* ... */\n    }\n</script>"
+    )
+
+
+def rendered_page(rng, quotes=10):
+    """What browserHtml returns for the JS page: the rendered quotes, plus
+    the markup a browser adds."""
+    quotes_html = "".join(
+        f'<div data-v-{i:04x}="" style="">{_quote_html(_quote(rng))}</div>'
+        for i in range(quotes)
+    )
+    return _page(
+        f'<div id="app" data-server-rendered="false">{quotes_html}</div>',
+        head='<style id="injected">.quote{margin:0}</style>' * 20,
+    )
+
+
+def large_page(rng, quotes=2000):
+    """An infinite-scroll page after many scroll actions."""
+    return static_page(rng, quotes)
+
+
+def pathological_page(rng, depth=2000):
+    """Deep nesting, unclosed tags, a huge attribute list and inline data."""
+    attrs = " ".join(f'data-a{i}="{i}"' for i in range(5000))
+    nested = "<div><span>" * depth + _quote_html(_quote(rng)) + "</span></div>" * depth
+    unclosed = "".join(
+        f"<p><b><i>{rng.choice(WORDS)}<div class=quote><span class=text>x"
+        for _ in range(2000)
+    )
+    blob = "<script>var blob = '" + "x" * 500_000 + "';</script>"
+    return _page(f"<div {attrs}>{nested}</div>{unclosed}{blob}")
+
+
+CORPUS = {
+    "static": (static_page, "https://quotes.toscrape.com/page/{}/"),
+    "js": (js_page, "https://quotes.toscrape.com/js/page/{}/"),
+    "rendered": (rendered_page, "https://quotes.toscrape.com/js/page/{}/"),
+    "large": (large_page, "https://quotes.toscrape.com/scroll?page={}"),
+    "pathological": (pathological_page, "https://quotes.toscrape.com/odd/{}/"),
+}
+
+
+def build_corpus(pages, seed=0):
+    """Return ``{kind: [(url, body), ...]}`` with *pages* pages per kind."""
+    rng = random.Random(seed)
+    return {
+        kind: [
+            (url.format(i), page(rng).encode("utf-8")) for i in range(1, pages + 1)
+        ]
+        for kind, (page, url) in CORPUS.items()
+    }
+
+
+def _response(url, body, kind):
+    headers = {"Content-Type": "text/html; charset=utf-8"}
+    if kind == "pathological":
+        # Make the response sniff its encoding, as servers that send no
+        # charset do
+        headers = {"Content-Type": "text/html"}
+    return HtmlResponse(url, body=body, headers=headers, request=Request(url))
+
+
+def load_template_spiders(path):
+    """Return the spider classes defined in the takeaway template at *path*."""
+    spec = importlib.util.spec_from_file_location("takeaway_template", path)
+    module = importlib.util.module_from_spec(spec)
+    # The template prints its instructions on import
+    with contextlib.redirect_stdout(io.StringIO()):
+        spec.loader.exec_module(module)
+    return [
+        obj
+        for obj in vars(module).values()
+        if inspect.isclass(obj)
+        and issubclass(obj, Spider)
+        and obj.__module__ == module.__name__
+    ]
+
+
+def spider_callbacks(spider):
+    """Yield ``(name, method)`` for the parse callbacks of *spider*: methods
+    named ``parse`` or ``parse_*`` that only take a response, and are not
+    inherited from :class:`~scrapy.Spider`."""
+    for name, method in inspect.getmembers(spider, inspect.ismethod):
+        if name != "parse" and not name.startswith("parse_"):
+            continue
+        if getattr(type(spider), name) is getattr(Spider, name, None):
+            # Spider.parse only raises NotImplementedError
+            continue
+        required = [
+            parameter
+            for parameter in inspect.signature(method).parameters.values()
+            if parameter.default is parameter.empty
+            and parameter.kind
+            in (parameter.POSITIONAL_ONLY, parameter.POSITIONAL_OR_KEYWORD)
+        ]
+        if len(required) == 1:
+            yield name, method
+
+
+async def _collect_async(result):
+    if inspect.isasyncgen(result):
+        return [output async for output in result]
+    return await result
+
+
+def run_callback(loop, callback, response):
+    """Run *callback* on *response* to completion and return its output."""
+    result = callback(response)
+    if inspect.isasyncgen(result) or inspect.iscoroutine(result):
+        result = loop.run_until_complete(_collect_async(result))
+    return list(result or ())
+
+
+class Command(ScrapyCommand):
+    requires_project = True
+    default_settings = {"LOG_ENABLED": False}
+
+    def syntax(self):
+        return "[options]"
+
+    def short_desc(self):
+        return "Benchmark spider callbacks on a generated corpus of quote pages"
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument(
+            "--pages",
+            type=int,
+            default=5,
+            help="pages of each kind in the corpus (default: 5)",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=5,
+            help="runs over the corpus, the fastest one is reported (default: 5)",
+        )
+        parser.add_argument(
+            "--template",
+            metavar="PATH",
+            help="takeaway template to benchmark too (default: the workshop's "
+            "Takeaway/Scrapy Workshop Takeaway Template.py, if found)",
+        )
+        parser.add_argument(
+            "--callback",
+            action="append",
+            default=[],
+            metavar="SPIDER.METHOD",
+            help="only benchmark this callback (can be repeated)",
+        )
+        parser.add_argument(
+            "--baseline",
+            metavar="FILE",
+            help="compare to the results in FILE and exit with status 1 on "
+            "regressions, or if callbacks or fixtures in FILE were not benchmarked",
+        )
+        parser.add_argument(
+            "--save-baseline",
+            metavar="FILE",
+            help="write the results to FILE",
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.25,
+            help="allowed slowdown or allocation growth over the baseline, "
+            "as a fraction (default: 0.25)",
+        )
+
+    def template_path(self, opts):
+        if opts.template:
+            return Path(opts.template)
+        cfg = closest_scrapy_cfg()
+        if not cfg:
+            return None
+        path = Path(cfg).parent.parent / "Takeaway"
+        path /= "Scrapy Workshop Takeaway Template.py"
+        return path if path.exists() else None
+
+    def spider_classes(self, opts):
+        loader = self.crawler_process.spider_loader
+        classes = [loader.load(name) for name in sorted(loader.list())]
+        path = self.template_path(opts)
+        if path is not None:
+            classes.extend(load_template_spiders(path))
+        return classes
+
+    def callbacks(self, opts):
+        for spidercls in self.spider_classes(opts):
+            crawler = Crawler(spidercls, self.settings)
+            spider = spidercls.from_crawler(crawler)
+            for name, method in spider_callbacks(spider):
+                key = f"{spidercls.name}.{name}"
+                if not opts.callback or key in opts.callback:
+                    yield key, method
+
+    def measure(self, loop, callback, kind, pages, repeat):
+        best = None
+        for _ in range(repeat):
+            elapsed = 0.0
+            for url, body in pages:
+                response = _response(url, body, kind)
+                t0 = time.perf_counter()
+                run_callback(loop, callback, response)
+                elapsed += time.perf_counter() - t0
+            best = elapsed if best is None else min(best, elapsed)
+        peak = blocks = items = 0
+        for url, body in pages:
+            response = _response(url, body, kind)
+            tracemalloc.start()
+            output = run_callback(loop, callback, response)
+            peak += tracemalloc.get_traced_memory()[1]
+            # Memory blocks allocated by the callback and still alive: its
+            # output, and what it cached
+            blocks += len(tracemalloc.take_snapshot().traces)
+            tracemalloc.stop()
+            items += sum(1 for result in output if is_item(result))
+        us_per_page = best / len(pages) * 1e6
+        return {
+            "us_per_page": round(us_per_page, 1),
+            "kib_per_page": round(peak / len(pages) / 1024, 1),
+            "blocks_per_page": round(blocks / len(pages), 1),
+            "items_per_page": items / len(pages),
+            "items_per_second": round(items / len(pages) / us_per_page * 1e6, 1),
+        }
+
+    def run(self, args, opts):
+        if opts.pages < 1 or opts.repeat < 1:
+            raise UsageError("--pages and --repeat must be at least 1")
+        baseline = {}
+        if opts.baseline:
+            with open(opts.baseline, encoding="utf-8") as f:
+                baseline = json.load(f)
+        corpus = build_corpus(opts.pages)
+        loop = asyncio.new_event_loop()
+        results = {}
+        failed = set()
+        regressions = []
+        print(
+            f"{'callback':<40} {'fixture':<13} {'µs/page':>10} {'KiB/page':>9} "
+            f"{'blocks/page':>11} {'items/page':>10} {'items/s':>10}"
+        )
+        try:
+            for key, callback in self.callbacks(opts):
+                for kind, pages in corpus.items():
+                    name = f"{key} {kind}"
+                    try:
+                        result = self.measure(loop, callback, kind, pages, opts.repeat)
+                    except Exception as e:
+                        print(f"{key:<40} {kind:<13} error: {e!r}")
+                        regressions.append(f"{name}: {e!r}")
+                        failed.add(name)
+                        continue
+                    results[name] = result
+                    print(
+                        f"{key:<40} {kind:<13} {result['us_per_page']:>10.1f} "
+                        f"{result['kib_per_page']:>9.1f} "
+                        f"{result['blocks_per_page']:>11.1f} "
+                        f"{result['items_per_page']:>10.1f} "
+                        f"{result['items_per_second']:>10.0f}"
+                    )
+                    if name in baseline:
+                        regressions.extend(
+                            self.compare(name, result, baseline[name], opts.tolerance)
+                        )
+        finally:
+            loop.close()
+        for name in baseline:
+            if name in results or name in failed:
+                continue
+            if opts.callback and name.split(" ")[0] not in opts.callback:
+                continue
+            # A renamed or removed callback or fixture, or one that no longer
+            # qualifies as a callback, would otherwise go unnoticed
+            regressions.append(f"{name}: in the baseline, but not benchmarked")
+        if opts.save_baseline:
+            with open(opts.save_baseline, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+                f.write("\n")
+        if regressions:
+            print("\nRegressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            self.exitcode = 1
+
+    def compare(self, name, result, previous, tolerance):
+        for metric in ("us_per_page", "kib_per_page", "blocks_per_page"):
+            if metric not in previous:
+                # Baselines saved before the metric was added
+                continue
+            limit = previous[metric] * (1 + tolerance)
+            if result[metric] > limit:
+                yield (
+                    f"{name}: {metric} {result[metric]} > {limit:.1f} "
+                    f"(baseline {previous[metric]})"
+                )
+        if result["items_per_page"] != previous["items_per_page"]:
+            yield (
+                f"{name}: items_per_page {result['items_per_page']} != "
+                f"{previous['items_per_page']}"
+            )
@@ -0,0 +1,72 @@
+from scrapy.commands import BaseRunSpiderCommand
+from scrapy.exceptions import UsageError
+
+from scrapy_lab_tutorial.commands.benchparse import load_template_spiders
+from scrapy_lab_tutorial.runner import MultiSpiderRunner
+
+
+class Command(BaseRunSpiderCommand):
+    requires_project = True
+
+    def syntax(self):
+        return "[options] <spider> [<spider> ...]"
+
+    def short_desc(self):
+        return "Run several spiders in one process, sharing Zyte API and concurrency"
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="run every spider of the project",
+        )
+        parser.add_argument(
+            "--template",
+            metavar="PATH",
+            help="also make the spiders of this file (e.g. the takeaway "
+            "template) available by name",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            help="requests in flight across all spiders "
+            "(default: CONCURRENT_REQUESTS)",
+        )
+        parser.add_argument(
+            "--rebalance-interval",
+            type=float,
+            default=5.0,
+            help="seconds between concurrency splits (default: 5)",
+        )
+
+    def spider_classes(self, args, opts):
+        loader = self.crawler_process.spider_loader
+        available = {name: loader.load(name) for name in loader.list()}
+        if opts.template:
+            for spidercls in load_template_spiders(opts.template):
+                available[spidercls.name] = spidercls
+        names = sorted(available) if opts.all else args
+        if not names:
+            raise UsageError("Give spider names, or use --all")
+        unknown = [name for name in names if name not in available]
+        if unknown:
+            raise UsageError(f"Spider(s) not found: {', '.join(unknown)}")
+        return [available[name] for name in dict.fromkeys(names)]
+
+    def run(self, args, opts):
+        if opts.concurrency is not None and opts.concurrency < 1:
+            raise UsageError("--concurrency must be at least 1")
+        try:
+            runner = MultiSpiderRunner(
+                self.crawler_process,
+                concurrency=opts.concurrency,
+                rebalance_interval=opts.rebalance_interval,
+            )
+        except ValueError as e:
+            raise UsageError(str(e))
+        for spidercls in self.spider_classes(args, opts):
+            runner.crawl(spidercls, **opts.spargs)
+        self.crawler_process.start()
+        if self.crawler_process.bootstrap_failed:
+            self.exitcode = 1
@@ -0,0 +1,402 @@
+# Duplicate request filters
+#
+# See: https://docs.scrapy.org/en/latest/topics/settings.html#dupefilter-class
+
+import hashlib
+import heapq
+import logging
+import math
+import mmap
+import multiprocessing
+import os
+import shutil
+import struct
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from scrapy.dupefilters import RFPDupeFilter
+from scrapy.utils.job import job_dir
+from twisted.internet import defer
+from twisted.internet.threads import deferToThread
+
+logger = logging.getLogger(__name__)
+
+_RUN_MAGIC = b"FPRUN1"
+_RUN_HEADER = struct.Struct(">6sH")
+_BLOOM_HEADER = struct.Struct(">QB")
+
+
+def _read_buffer(data):
+    # Length-prefixed fingerprints, as appended by BloomDupeFilter
+    pos = 0
+    while pos < len(data):
+        size = data[pos]
+        fp = data[pos + 1 : pos + 1 + size]
+        if len(fp) < size:
+            # Truncated by a crash
+            return
+        yield fp
+        pos += 1 + size
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over request fingerprints.
+
+    Fingerprints are already uniformly distributed hashes, so the bit
+    positions are derived from their bytes (double hashing) instead of
+    hashing them again.
+    """
+
+    def __init__(self, num_bits, num_hashes):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bytearray((num_bits + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity, error_rate):
+        num_bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+        return cls(num_bits, num_hashes)
+
+    def _positions(self, fp):
+        if len(fp) < 16:
+            fp = hashlib.blake2b(fp, digest_size=16).digest()
+        h1 = int.from_bytes(fp[:8], "big")
+        h2 = int.from_bytes(fp[8:16], "big") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, fp):
+        for position in self._positions(fp):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, fp):
+        bits = self.bits
+        return all(
+            bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(fp)
+        )
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(_BLOOM_HEADER.pack(self.num_bits, self.num_hashes))
+            f.write(self.bits)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            num_bits, num_hashes = _BLOOM_HEADER.unpack(f.read(_BLOOM_HEADER.size))
+            bloom = cls(num_bits, num_hashes)
+            f.readinto(bloom.bits)
+        return bloom
+
+
+class SortedRun:
+    """Immutable, memory-mapped file of sorted fixed-width fingerprints."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        magic, self.width = _RUN_HEADER.unpack(self._file.read(_RUN_HEADER.size))
+        if magic != _RUN_MAGIC:
+            raise ValueError(f"{path} is not a fingerprint run file")
+        size = os.fstat(self._file.fileno()).st_size
+        self.count = (size - _RUN_HEADER.size) // self.width
+        self._mmap = (
+            mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if self.count
+            else b""
+        )
+
+    @classmethod
+    def write(cls, path, width, fingerprints):
+        """Write the sorted *fingerprints* iterable to *path* and open it."""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_RUN_HEADER.pack(_RUN_MAGIC, width))
+            previous = None
+            for fp in fingerprints:
+                if fp != previous:
+                    f.write(fp)
+                    previous = fp
+        os.replace(tmp_path, path)
+        return cls(path)
+
+    def _record(self, index):
+        start = _RUN_HEADER.size + index * self.width
+        return self._mmap[start : start + self.width]
+
+    def __contains__(self, fp):
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            record = self._record(mid)
+            if record < fp:
+                lo = mid + 1
+            elif record > fp:
+                hi = mid
+            else:
+                return True
+        return False
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self._record(index)
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        if self.count:
+            self._mmap.close()
+        self._file.close()
+
+
+def _merge_runs(paths, path, width):
+    # Runs in a worker process, clear of the reactor thread and its GIL
+    runs = [SortedRun(run_path) for run_path in paths]
+    try:
+        SortedRun.write(path, width, heapq.merge(*runs)).close()
+    finally:
+        for run in runs:
+            run.close()
+
+
+class BloomDupeFilter(RFPDupeFilter):
+    """Duplicate request filter with flat memory usage for huge crawls.
+
+    Fingerprints are checked against a fixed-size Bloom filter first. Only
+    when the Bloom filter reports a possible match are they looked up
+    exactly, in a bounded in-memory buffer of recent fingerprints and then
+    in sorted, memory-mapped runs on disk. The buffer is written out as a
+    new run every ``DUPEFILTER_BUFFER_SIZE`` fingerprints, on the reactor
+    thread (sorting and writing the buffer takes about 0.2s per 250,000
+    fingerprints).
+
+    Runs are merged by size tiers: a run of up to ``DUPEFILTER_BUFFER_SIZE``
+    fingerprints is in tier 0, one of up to ``DUPEFILTER_MERGE_FACTOR``
+    times that in tier 1, and so on. Once a tier has
+    ``DUPEFILTER_MERGE_FACTOR`` runs, they are merged into one run of the
+    next tier, so each fingerprint is rewritten once per tier, and there
+    are at most ``DUPEFILTER_MERGE_FACTOR - 1`` runs per tier (a handful for
+    100M+ fingerprints). Merges run in a worker process, so they do not
+    hold the GIL of the reactor thread. If a merge fails, the error is
+    logged, the runs are kept as they are, and the merge is tried again
+    after the next flush.
+
+    The Bloom filter is sized for ``DUPEFILTER_BLOOM_CAPACITY`` fingerprints
+    at a ``DUPEFILTER_BLOOM_ERROR_RATE`` false positive rate. Past that
+    capacity, more lookups reach the runs, but results stay exact.
+
+    With ``JOBDIR``, the runs and the Bloom filter are kept in its
+    ``bloomdupefilter`` directory and reused on resume. Buffered
+    fingerprints are also appended to a ``buffer`` file there, like the
+    ``requests.seen`` file of Scrapy's dupefilter, so that they survive a
+    crash; the file is flushed with the checkpoint log of
+    :class:`~scrapy_lab_tutorial.scheduler.CheckpointScheduler`, or by the
+    OS otherwise. Without ``JOBDIR``, a temporary directory is used and
+    removed on close.
+    """
+
+    def __init__(
+        self,
+        path=None,
+        debug=False,
+        *,
+        fingerprinter=None,
+        capacity=20_000_000,
+        error_rate=0.01,
+        buffer_size=250_000,
+        merge_factor=4,
+    ):
+        super().__init__(None, debug, fingerprinter=fingerprinter)
+        self.temporary = path is None
+        self.path = path or tempfile.mkdtemp(prefix="bloomdupefilter-")
+        os.makedirs(self.path, exist_ok=True)
+        self.buffer_size = max(buffer_size, 1)
+        self.merge_factor = max(merge_factor, 2)
+        self.buffer = set()
+        self.width = None
+        self.runs = []
+        self._next_run_id = 0
+        self._compacting = None
+        self._merge_pool = None
+        for name in sorted(os.listdir(self.path)):
+            if name.endswith(".run"):
+                self._open_run(os.path.join(self.path, name))
+            elif name.endswith(".tmp"):
+                # Left by a merge or flush that did not finish
+                os.remove(os.path.join(self.path, name))
+        bloom_path = os.path.join(self.path, "bloom")
+        if os.path.exists(bloom_path):
+            self.bloom = BloomFilter.load(bloom_path)
+            # Only trust the saved filter after a clean close
+            os.remove(bloom_path)
+        else:
+            self.bloom = BloomFilter.for_capacity(capacity, error_rate)
+            for run in self.runs:
+                for fp in run:
+                    self.bloom.add(fp)
+        if not self.temporary:
+            self.file = open(os.path.join(self.path, "buffer"), "a+b")
+            self.file.seek(0)
+            for fp in _read_buffer(self.file.read()):
+                if self.width is None:
+                    self.width = len(fp)
+                self.bloom.add(fp)
+                self.buffer.add(fp)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        path = job_dir(settings)
+        return cls(
+            os.path.join(path, "bloomdupefilter") if path else None,
+            settings.getbool("DUPEFILTER_DEBUG"),
+            fingerprinter=crawler.request_fingerprinter,
+            capacity=settings.getint("DUPEFILTER_BLOOM_CAPACITY", 20_000_000),
+            error_rate=settings.getfloat("DUPEFILTER_BLOOM_ERROR_RATE", 0.01),
+            buffer_size=settings.getint("DUPEFILTER_BUFFER_SIZE", 250_000),
+            merge_factor=settings.getint("DUPEFILTER_MERGE_FACTOR", 4),
+        )
+
+    def _open_run(self, path):
+        run = SortedRun(path)
+        self.width = run.width
+        self.runs.append(run)
+        run_id = int(os.path.basename(path).split(".")[0])
+        self._next_run_id = max(self._next_run_id, run_id + 1)
+        return run
+
+    def _run_path(self):
+        path = os.path.join(self.path, f"{self._next_run_id:08d}.run")
+        self._next_run_id += 1
+        return path
+
+    def request_seen(self, request):
+        fp = self.fingerprinter.fingerprint(request)
+        if self.seen_fingerprint(fp):
+            return True
+        self.add_fingerprint(fp)
+        return False
+
+    def seen_fingerprint(self, fp):
+        """Return True if *fp* was added before."""
+        if fp not in self.bloom:
+            return False
+        if fp in self.buffer:
+            return True
+        return any(fp in run for run in reversed(self.runs))
+
+    def add_fingerprint(self, fp):
+        if self.width is None:
+            self.width = len(fp)
+        elif len(fp) != self.width:
+            raise ValueError(
+                f"Got a {len(fp)}-byte fingerprint, expected {self.width} bytes: "
+                f"the request fingerprinter changed since {self.path} was written"
+            )
+        self.bloom.add(fp)
+        self.buffer.add(fp)
+        if self.file is not None:
+            self.file.write(bytes((len(fp),)) + fp)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered fingerprints to disk as a new sorted run."""
+        if not self.buffer:
+            return
+        run = SortedRun.write(self._run_path(), self.width, sorted(self.buffer))
+        self.runs.append(run)
+        self.buffer = set()
+        if self.file is not None:
+            self.file.truncate(0)
+        self._maybe_compact()
+
+    def tier(self, run):
+        """Return the size tier of *run*."""
+        tier = 0
+        limit = self.buffer_size
+        while len(run) > limit:
+            limit *= self.merge_factor
+            tier += 1
+        return tier
+
+    def merge_candidates(self):
+        """Return the oldest ``merge_factor`` runs of the lowest tier that
+        has that many, or None."""
+        tiers = {}
+        for run in self.runs:
+            tiers.setdefault(self.tier(run), []).append(run)
+        for tier in sorted(tiers):
+            if len(tiers[tier]) >= self.merge_factor:
+                return tiers[tier][: self.merge_factor]
+        return None
+
+    def _maybe_compact(self):
+        if self._compacting is not None:
+            return
+        runs = self.merge_candidates()
+        if runs is None:
+            return
+        path = self._run_path()
+        self._compacting = self._compact(runs, path)
+        self._compacting.addErrback(self._compact_failed, path)
+        self._compacting.addBoth(self._compact_done)
+
+    @defer.inlineCallbacks
+    def _compact(self, runs, path):
+        if self._merge_pool is None:
+            self._merge_pool = ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("spawn")
+            )
+        future = self._merge_pool.submit(
+            _merge_runs, [run.path for run in runs], path, self.width
+        )
+        # Wait in a thread, whichever reactor is installed
+        yield deferToThread(future.result)
+        merged = SortedRun(path)
+        index = self.runs.index(runs[0])
+        self.runs = [run for run in self.runs if run not in runs]
+        self.runs.insert(index, merged)
+        for run in runs:
+            run.close()
+            os.remove(run.path)
+        return True
+
+    def _compact_failed(self, failure, path):
+        logger.error(
+            "Could not merge the fingerprint runs of %(path)s",
+            {"path": self.path},
+            exc_info=(failure.type, failure.value, failure.getTracebackObject()),
+        )
+        try:
+            os.remove(path + ".tmp")
+        except FileNotFoundError:
+            pass
+        return False
+
+    def _compact_done(self, merged):
+        self._compacting = None
+        if merged:
+            # The merged run may complete the next tier
+            self._maybe_compact()
+
+    @defer.inlineCallbacks
+    def close(self, reason):
+        if self._compacting is not None:
+            yield self._compacting
+        self.flush()
+        while self._compacting is not None:
+            yield self._compacting
+        if self._merge_pool is not None:
+            self._merge_pool.shutdown()
+            self._merge_pool = None
+        if self.file is not None:
+            self.file.close()
+        if not self.temporary:
+            self.bloom.save(os.path.join(self.path, "bloom"))
+        for run in self.runs:
+            run.close()
+        if self.temporary:
+            shutil.rmtree(self.path, ignore_errors=True)
@@ -0,0 +1,636 @@
+# Define here your extensions
+#
+# Don't forget to add your extension to the EXTENSIONS setting
+# See: https://docs.scrapy.org/en/latest/topics/extensions.html
+
+import asyncio
+import json
+import logging
+import os
+import resource
+import ssl
+import time
+from collections import deque
+
+import aiohttp
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.defer import deferred_from_coro
+from scrapy.utils.reactor import listen_tcp
+from twisted.internet import task
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+from scrapy_lab_tutorial.log import JsonFormatter, QueueLogging, SamplingFilter
+from scrapy_lab_tutorial.zyte import ZYTE_MODES, transparent_mode, zyte_mode
+
+logger = logging.getLogger(__name__)
+
+
+def get_rss():
+    """Return the current resident set size of this process, in bytes."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # Not Linux: fall back to the peak RSS (KiB on Linux, bytes on macOS)
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if os.uname().sysname == "Darwin" else rss * 1024
+
+
+def scheduler_depth(engine):
+    """Return the number of requests waiting in the scheduler."""
+    slot = getattr(engine, "_slot", None) or getattr(engine, "slot", None)
+    if slot is None or slot.scheduler is None:
+        return 0
+    return len(slot.scheduler)
+
+
+class RollingCounter:
+    """Count events over the last *window* seconds in one-second buckets."""
+
+    def __init__(self, window=60):
+        if window <= 0:
+            raise ValueError(f"The window must be greater than 0, got {window}")
+        self.window = window
+        self.buckets = deque()
+        self.started = time.monotonic()
+
+    def inc(self, count=1):
+        now = int(time.monotonic())
+        if self.buckets and self.buckets[-1][0] == now:
+            self.buckets[-1][1] += count
+        else:
+            self.buckets.append([now, count])
+        self._expire(now)
+
+    def rate(self):
+        """Return the average number of events per second in the window, or
+        since the counter was created if that is more recent."""
+        now = time.monotonic()
+        self._expire(int(now))
+        elapsed = min(max(now - self.started, 1.0), self.window)
+        return sum(count for _, count in self.buckets) / elapsed
+
+    def _expire(self, now):
+        while self.buckets and self.buckets[0][0] <= now - self.window:
+            self.buckets.popleft()
+
+
+def _escape_label(value):
+    # Prometheus text format escapes of label values
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _TelemetryResource(Resource):
+    isLeaf = True
+
+    def __init__(self, telemetry):
+        super().__init__()
+        self.telemetry = telemetry
+
+    def render_GET(self, request):
+        snapshot = self.telemetry.snapshot()
+        if request.path == b"/metrics":
+            request.setHeader(b"Content-Type", b"text/plain; version=0.0.4")
+            return self.telemetry.to_prometheus(snapshot).encode()
+        request.setHeader(b"Content-Type", b"application/json")
+        return json.dumps(snapshot).encode()
+
+
+class TelemetryExtension:
+    """Serve live crawl metrics over HTTP.
+
+    ``/metrics`` returns them in the Prometheus text format, any other path
+    as JSON. Rates are averaged over the last ``TELEMETRY_WINDOW`` seconds.
+
+    Settings:
+
+    - ``TELEMETRY_HOST`` (default ``"127.0.0.1"``) and ``TELEMETRY_PORT``
+      (default ``[6090, 6099]``, a port range like ``TELNETCONSOLE_PORT``)
+    - ``TELEMETRY_WINDOW``: rate window in seconds (default 60)
+    - ``TELEMETRY_LAG_INTERVAL``: how often reactor loop lag is measured,
+      in seconds (default 0.5)
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.host = settings.get("TELEMETRY_HOST", "127.0.0.1")
+        self.portrange = [
+            int(x) for x in settings.getlist("TELEMETRY_PORT", [6090, 6099])
+        ]
+        self.lag_interval = settings.getfloat("TELEMETRY_LAG_INTERVAL", 0.5)
+        if self.lag_interval <= 0:
+            raise NotConfigured("TELEMETRY_LAG_INTERVAL must be greater than 0")
+        window = settings.getint("TELEMETRY_WINDOW", 60)
+        if window <= 0:
+            raise NotConfigured("TELEMETRY_WINDOW must be greater than 0")
+        self.transparent = transparent_mode(settings)
+        self.pages = RollingCounter(window)
+        self.items = RollingCounter(window)
+        self.in_flight = dict.fromkeys(ZYTE_MODES + ("plain",), 0)
+        self.loop_lag = 0.0
+        self.port = None
+        self._lag_task = None
+        self._lag_expected = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        ext = cls(crawler)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.response_received, signal=signals.response_received)
+        crawler.signals.connect(ext.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(
+            ext.request_reached_downloader, signal=signals.request_reached_downloader
+        )
+        crawler.signals.connect(
+            ext.request_left_downloader, signal=signals.request_left_downloader
+        )
+        return ext
+
+    def spider_opened(self, spider):
+        self.spider = spider
+        site = Site(_TelemetryResource(self))
+        self.port = listen_tcp(self.portrange, self.host, site)
+        address = self.port.getHost()
+        spider.logger.info(
+            "Telemetry endpoint listening on http://%s:%d/", address.host, address.port
+        )
+        self._lag_task = task.LoopingCall(self._measure_lag)
+        self._lag_expected = time.monotonic()
+        self._lag_task.start(self.lag_interval, now=True)
+
+    def spider_closed(self, spider):
+        if self._lag_task is not None and self._lag_task.running:
+            self._lag_task.stop()
+        if self.port is not None:
+            self.port.stopListening()
+            self.port = None
+
+    def _measure_lag(self):
+        now = time.monotonic()
+        self.loop_lag = max(now - self._lag_expected, 0.0)
+        self._lag_expected = now + self.lag_interval
+
+    def _mode(self, request):
+        return zyte_mode(request, self.transparent) or "plain"
+
+    def response_received(self, response, request, spider):
+        self.pages.inc()
+
+    def item_scraped(self, item, spider):
+        self.items.inc()
+
+    def request_reached_downloader(self, request, spider):
+        self.in_flight[self._mode(request)] += 1
+
+    def request_left_downloader(self, request, spider):
+        mode = self._mode(request)
+        self.in_flight[mode] = max(self.in_flight[mode] - 1, 0)
+
+    def snapshot(self):
+        return {
+            "spider": self.spider.name,
+            "pages_per_second": round(self.pages.rate(), 3),
+            "items_per_second": round(self.items.rate(), 3),
+            "scheduler_queue_depth": scheduler_depth(self.crawler.engine),
+            "in_flight": dict(self.in_flight),
+            "reactor_lag_seconds": round(self.loop_lag, 6),
+            "memory_rss_bytes": get_rss(),
+        }
+
+    def to_prometheus(self, snapshot):
+        spider = snapshot["spider"]
+        lines = []
+
+        def add(name, help, value, **labels):
+            if f"# HELP scrapy_{name} {help}" not in lines:
+                lines.append(f"# HELP scrapy_{name} {help}")
+                lines.append(f"# TYPE scrapy_{name} gauge")
+            labels = ",".join(
+                f'{key}="{_escape_label(label)}"'
+                for key, label in {"spider": spider, **labels}.items()
+            )
+            lines.append(f"scrapy_{name}{{{labels}}} {value}")
+
+        add(
+            "pages_per_second",
+            "Responses received per second.",
+            snapshot["pages_per_second"],
+        )
+        add(
+            "items_per_second",
+            "Items scraped per second.",
+            snapshot["items_per_second"],
+        )
+        add(
+            "scheduler_queue_depth",
+            "Requests waiting in the scheduler.",
+            snapshot["scheduler_queue_depth"],
+        )
+        for mode, count in snapshot["in_flight"].items():
+            add(
+                "in_flight_requests",
+                "Requests in the downloader, by Zyte API mode.",
+                count,
+                mode=mode,
+            )
+        add(
+            "reactor_lag_seconds",
+            "Delay of the last reactor loop tick.",
+            snapshot["reactor_lag_seconds"],
+        )
+        add(
+            "memory_rss_bytes",
+            "Resident set size of the crawler process.",
+            snapshot["memory_rss_bytes"],
+        )
+        return "\n".join(lines) + "\n"
+
+
+# Shared by the crawlers of a process, set up with the settings of the first
+_queue_logging = None
+
+
+class StructuredLoggingExtension:
+    """Write logs from a background thread, optionally as sampled JSON.
+
+    Once the engine starts, log records are queued as they are and
+    formatted and written by a thread (see
+    :class:`~scrapy_lab_tutorial.log.QueueLogging`), so the reactor thread
+    no longer waits on the terminal or the ``LOG_FILE``. Log with
+    ``%``-style arguments rather than f-strings: their formatting is then
+    left to that thread, and skipped for disabled levels.
+
+    Settings:
+
+    - ``LOG_JSON``: write one JSON object per record (default ``False``)
+    - ``LOG_SAMPLING_RATE``: records per second let through for each
+      message below ``WARNING`` (default 0, no sampling); see
+      :class:`~scrapy_lab_tutorial.log.SamplingFilter`
+    - ``LOG_SAMPLING_BURST``: records of a message let through at once
+      before sampling starts (default: ``LOG_SAMPLING_RATE``)
+    - ``LOG_QUEUE_SIZE``: records waiting to be written before new ones
+      are dropped (default 10000)
+
+    Dropped records are counted, for the whole process, in the
+    ``log/sampled_dropped`` and ``log/queue_dropped`` stats.
+    """
+
+    def __init__(self, crawler):
+        global _queue_logging
+        settings = crawler.settings
+        if not settings.getbool("LOG_ENABLED"):
+            raise NotConfigured
+        if _queue_logging is None:
+            rate = settings.getfloat("LOG_SAMPLING_RATE", 0)
+            sampling_filter = None
+            if rate > 0:
+                sampling_filter = SamplingFilter(
+                    rate, settings.getint("LOG_SAMPLING_BURST") or None
+                )
+            _queue_logging = QueueLogging(
+                queue_size=settings.getint("LOG_QUEUE_SIZE", 10000),
+                formatter=JsonFormatter() if settings.getbool("LOG_JSON") else None,
+                sampling_filter=sampling_filter,
+            )
+        self.logging = _queue_logging
+        self.stats = crawler.stats
+        self.started = False
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        ext = cls(crawler)
+        crawler.signals.connect(ext.engine_started, signal=signals.engine_started)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.engine_stopped, signal=signals.engine_stopped)
+        return ext
+
+    def engine_started(self):
+        self.started = True
+        self.logging.start()
+
+    def spider_closed(self, spider):
+        sampling_filter = self.logging.sampling_filter
+        if sampling_filter is not None:
+            self.stats.set_value("log/sampled_dropped", sampling_filter.dropped)
+        self.stats.set_value("log/queue_dropped", self.logging.handler.dropped)
+
+    def engine_stopped(self):
+        if self.started:
+            self.started = False
+            self.logging.stop()
+
+
+class ZyteConnectionPoolExtension:
+    """Keep a warm pool of keep-alive connections to Zyte API.
+
+    The Zyte API client closes its connections after every request, so
+    each request pays for a new TCP connection and TLS handshake. When the
+    engine starts, this extension gives the session of the scrapy-zyte-api
+    download handler a keep-alive connection pool instead, and opens
+    ``ZYTE_POOL_WARM_CONNECTIONS`` connections before the first request is
+    sent.
+
+    Settings:
+
+    - ``ZYTE_POOL_SIZE``: maximum connections (default, and maximum: the
+      Zyte API requests the client allows in flight, i.e.
+      ``CONCURRENT_REQUESTS``)
+    - ``ZYTE_POOL_WARM_CONNECTIONS``: connections opened on start (default:
+      ``CONCURRENT_REQUESTS_PER_DOMAIN``, the requests a crawl that starts
+      on one website can send at once), capped at the pool size
+    - ``ZYTE_POOL_KEEPALIVE``: seconds an idle connection is kept (default
+      60)
+    - ``ZYTE_POOL_WARMUP_TIMEOUT``: seconds to wait for the warm-up before
+      starting the crawl anyway (default 10)
+    - ``ZYTE_POOL_CA_FILE``: CA bundle to verify the endpoint with, e.g. to
+      test against a local stand-in of Zyte API with a self-signed
+      certificate
+
+    Crawlers of a :class:`~scrapy_lab_tutorial.runner.MultiSpiderRunner`
+    share one client and session, so this extension leaves them alone.
+
+    Stats: ``zyte_pool/warmed``, ``zyte_pool/connections_created`` (warm-up
+    connections included), ``zyte_pool/connections_reused``,
+    ``zyte_pool/reuse_ratio``, and the time requests waited for a free
+    connection, in ``zyte_pool/wait_count``, ``zyte_pool/wait_time`` and
+    ``zyte_pool/wait_time_max`` (seconds).
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool("ZYTE_API_ENABLED", True):
+            raise NotConfigured
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.pool_size = settings.getint("ZYTE_POOL_SIZE", 0)
+        self.warm = settings.getint(
+            "ZYTE_POOL_WARM_CONNECTIONS",
+            settings.getint("CONCURRENT_REQUESTS_PER_DOMAIN"),
+        )
+        self.keepalive = settings.getfloat("ZYTE_POOL_KEEPALIVE", 60)
+        self.warmup_timeout = settings.getfloat("ZYTE_POOL_WARMUP_TIMEOUT", 10)
+        self.ca_file = settings.get("ZYTE_POOL_CA_FILE")
+        self.connector = None
+        self.trace_config = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        ext = cls(crawler)
+        # Connected before the download handler is built, so that the pool
+        # is in place when the handler opens its session on engine_started
+        crawler.signals.connect(ext.engine_started, signal=signals.engine_started)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def engine_started(self):
+        client = getattr(self.crawler, "zyte_api_client", None)
+        if client is None:
+            # No Zyte API download handler
+            return None
+        if getattr(client, "shared", False):
+            logger.info(
+                "The Zyte API client is shared with other crawlers, not"
+                " replacing its connection pool"
+            )
+            return None
+        pool_size = min(self.pool_size or client.n_conn, client.n_conn)
+        self.connector = aiohttp.TCPConnector(
+            limit=pool_size,
+            keepalive_timeout=self.keepalive,
+            ssl=ssl.create_default_context(cafile=self.ca_file)
+            if self.ca_file
+            else True,
+        )
+        self.trace_config = self._trace_config()
+        session = client.session
+
+        def pooled_session(**kwargs):
+            kwargs.setdefault("connector", self.connector)
+            kwargs.setdefault("trace_configs", [self.trace_config])
+            return session(**kwargs)
+
+        client.session = pooled_session
+        warm = min(self.warm, pool_size)
+        if warm <= 0:
+            return None
+        return deferred_from_coro(self._warm_up(client.api_url, warm))
+
+    async def _warm_up(self, url, count):
+        # Any response over a kept-alive connection leaves it in the pool
+        async def connect(session):
+            async with session.get(url) as response:
+                await response.read()
+
+        t0 = time.monotonic()
+        async with aiohttp.ClientSession(
+            connector=self.connector,
+            connector_owner=False,
+            trace_configs=[self.trace_config],
+        ) as session:
+            results = await asyncio.gather(
+                *(
+                    asyncio.wait_for(connect(session), self.warmup_timeout)
+                    for _ in range(count)
+                ),
+                return_exceptions=True,
+            )
+        errors = [result for result in results if isinstance(result, Exception)]
+        self.stats.set_value("zyte_pool/warmed", count - len(errors))
+        if errors:
+            logger.warning(
+                "Could not open %(errors)d of %(count)d Zyte API connections:"
+                " %(error)r",
+                {"errors": len(errors), "count": count, "error": errors[0]},
+            )
+        else:
+            logger.info(
+                "Opened %(count)d Zyte API connections in %(seconds).3fs",
+                {"count": count, "seconds": time.monotonic() - t0},
+            )
+
+    def _trace_config(self):
+        trace_config = aiohttp.TraceConfig()
+
+        async def queued_start(session, context, params):
+            context.queued = time.monotonic()
+
+        async def queued_end(session, context, params):
+            wait = time.monotonic() - context.queued
+            self.stats.inc_value("zyte_pool/wait_count")
+            self.stats.inc_value("zyte_pool/wait_time", wait)
+            self.stats.max_value("zyte_pool/wait_time_max", wait)
+
+        async def created(session, context, params):
+            self.stats.inc_value("zyte_pool/connections_created")
+
+        async def reused(session, context, params):
+            self.stats.inc_value("zyte_pool/connections_reused")
+
+        trace_config.on_connection_queued_start.append(queued_start)
+        trace_config.on_connection_queued_end.append(queued_end)
+        trace_config.on_connection_create_end.append(created)
+        trace_config.on_connection_reuseconn.append(reused)
+        return trace_config
+
+    def spider_closed(self, spider):
+        created = self.stats.get_value("zyte_pool/connections_created", 0)
+        reused = self.stats.get_value("zyte_pool/connections_reused", 0)
+        if created + reused:
+            self.stats.set_value(
+                "zyte_pool/reuse_ratio", round(reused / (created + reused), 3)
+            )
+
+
+class MemoryGovernorExtension:
+    """Throttle the crawl as memory nears its limit, instead of dying.
+
+    ``MEMUSAGE_LIMIT_MB`` closes the spider once the limit is crossed.
+    This extension samples the RSS every ``MEMORY_GOVERNOR_INTERVAL``
+    seconds, and once it is above ``MEMORY_GOVERNOR_SOFT_RATIO`` of
+    ``MEMORY_GOVERNOR_LIMIT_MB``, lowers the downloader concurrency and the
+    size of responses the scraper may hold, proportionally to how close to
+    the limit it is. The engine then stops taking new requests (start
+    requests included) until in-flight responses and items are done with.
+    As memory drops, they are raised back a step at a time.
+
+    Settings:
+
+    - ``MEMORY_GOVERNOR_LIMIT_MB``: memory limit (default:
+      ``MEMUSAGE_LIMIT_MB``; one of them must be set). Keep it below
+      ``MEMUSAGE_LIMIT_MB`` if the latter is enabled.
+    - ``MEMORY_GOVERNOR_SOFT_RATIO``: fraction of the limit where
+      throttling starts (default 0.8)
+    - ``MEMORY_GOVERNOR_BASE_CONCURRENCY``: concurrency without memory
+      pressure (default: ``CONCURRENT_REQUESTS``)
+    - ``MEMORY_GOVERNOR_MIN_CONCURRENCY``: lowest concurrency (default 1)
+    - ``MEMORY_GOVERNOR_INTERVAL``: seconds between samples (default 1)
+
+    A base concurrency of 0 means no limit: the downloader concurrency is
+    then left alone, and only the size of responses the scraper may hold
+    is lowered, in steps of a hundredth.
+
+    Under a MultiSpiderRunner (see runner.py), the base concurrency is the
+    share of the crawler, which the runner hands to
+    :meth:`set_base_concurrency` instead of setting the downloader
+    concurrency itself: the governor is then the only one to set it.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        limit_mb = settings.getint("MEMORY_GOVERNOR_LIMIT_MB") or settings.getint(
+            "MEMUSAGE_LIMIT_MB"
+        )
+        if not limit_mb:
+            raise NotConfigured(
+                "Set MEMORY_GOVERNOR_LIMIT_MB or MEMUSAGE_LIMIT_MB to use the"
+                " memory governor"
+            )
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.limit = limit_mb * 1024 * 1024
+        self.soft_limit = self.limit * settings.getfloat(
+            "MEMORY_GOVERNOR_SOFT_RATIO", 0.8
+        )
+        self.min_concurrency = max(
+            settings.getint("MEMORY_GOVERNOR_MIN_CONCURRENCY", 1), 1
+        )
+        self.interval = settings.getfloat("MEMORY_GOVERNOR_INTERVAL", 1.0)
+        self.base_concurrency = settings.getint(
+            "MEMORY_GOVERNOR_BASE_CONCURRENCY", settings.getint("CONCURRENT_REQUESTS")
+        )
+        self.adjust_concurrency = self.base_concurrency > 0
+        if not self.adjust_concurrency:
+            # Steps of the scraper size, in hundredths
+            self.base_concurrency = 100
+        self.base_active_size = None
+        self.concurrency = None
+        self._task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        ext = cls(crawler)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_opened(self, spider):
+        self._task = task.LoopingCall(self.check)
+        self._task.start(self.interval, now=False)
+
+    def spider_closed(self, spider):
+        if self._task is not None and self._task.running:
+            self._task.stop()
+
+    def pressure(self, rss):
+        """Return 0 below the soft limit, up to 1 at the limit."""
+        if rss <= self.soft_limit:
+            return 0.0
+        return min((rss - self.soft_limit) / (self.limit - self.soft_limit), 1.0)
+
+    def _start(self):
+        engine = self.crawler.engine
+        if self.adjust_concurrency and engine.downloader.total_concurrency:
+            self.base_concurrency = engine.downloader.total_concurrency
+        self.base_active_size = engine.scraper.slot.max_active_size
+        self.concurrency = self.base_concurrency
+
+    def _min_concurrency(self):
+        return min(self.min_concurrency, self.base_concurrency)
+
+    def set_base_concurrency(self, concurrency):
+        """Change the concurrency without memory pressure to *concurrency*,
+        and scale the downloader concurrency to it, keeping the current
+        throttling ratio."""
+        if self.concurrency is None:
+            self._start()
+        ratio = self.concurrency / self.base_concurrency
+        self.base_concurrency = concurrency
+        self.concurrency = max(round(concurrency * ratio), self._min_concurrency())
+        self.crawler.engine.downloader.total_concurrency = self.concurrency
+
+    def check(self):
+        engine = self.crawler.engine
+        downloader = engine.downloader
+        scraper_slot = engine.scraper.slot
+        if self.concurrency is None:
+            self._start()
+        rss = get_rss()
+        self.stats.max_value("memory_governor/rss_max", rss)
+        pressure = self.pressure(rss)
+        target = max(
+            round(self.base_concurrency * (1 - pressure)), self._min_concurrency()
+        )
+        if target > self.concurrency:
+            # Ramp up slowly, memory only drops once responses are done with
+            target = min(target, self.concurrency + max(self.base_concurrency // 10, 1))
+        if target == self.concurrency:
+            return
+        if target < self.concurrency and self.concurrency == self.base_concurrency:
+            self.stats.inc_value("memory_governor/throttled")
+        logger.info(
+            "Memory at %(rss)dMiB of %(limit)dMiB: %(what)s %(old)d -> %(new)d"
+            " (%(active)d requests in the downloader, %(queued)d scheduled,"
+            " %(scraping)d bytes in the scraper)",
+            {
+                "rss": rss // 1024 // 1024,
+                "limit": self.limit // 1024 // 1024,
+                "what": "concurrency" if self.adjust_concurrency else "scraper size %",
+                "old": self.concurrency,
+                "new": target,
+                "active": len(downloader.active),
+                "queued": scheduler_depth(engine),
+                "scraping": scraper_slot.active_size,
+            },
+            extra={"spider": self.crawler.spider},
+        )
+        self.concurrency = target
+        if self.adjust_concurrency:
+            self.stats.min_value("memory_governor/concurrency_min", target)
+            downloader.total_concurrency = target
+        scraper_slot.max_active_size = max(
+            int(self.base_active_size * target / self.base_concurrency), 1
+        )
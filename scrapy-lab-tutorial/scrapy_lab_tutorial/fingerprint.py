@@ -0,0 +1,198 @@
+# Fast request fingerprinting that takes Zyte API parameters into account
+#
+# The Zyte API addon replaces REQUEST_FINGERPRINTER_CLASS with its own
+# fingerprinter, so enable this one with an addon that runs after it:
+#
+#     ADDONS = {
+#         "scrapy_zyte_api.Addon": 500,
+#         "scrapy_lab_tutorial.fingerprint.FastFingerprintAddon": 600,
+#     }
+#
+# Fingerprints are not compatible with the ones of Scrapy or scrapy-zyte-api,
+# so do not switch fingerprinters in the middle of a JOBDIR crawl or with an
+# existing HTTP cache.
+
+import hashlib
+import re
+from collections.abc import Mapping
+from functools import lru_cache
+from types import SimpleNamespace
+from weakref import WeakKeyDictionary
+
+from w3lib.url import canonicalize_url
+
+from scrapy_lab_tutorial.zyte import transparent_mode, zyte_mode, zyte_params
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# Zyte API parameters that do not change the response
+DEFAULT_IGNORED_PARAMS = ("echoData", "jobId")
+
+# Zyte API parameters that make Zyte API use a browser, in which case the
+# URL fragment matters
+BROWSER_PARAMS = ("browserHtml", "screenshot", "actions")
+
+# Canonical parameter sets shared by every crawler in the process, mapping
+# a frozen (hashable) copy of the parameters to their digest
+_param_digests = {}
+_PARAM_DIGESTS_MAX_SIZE = 100_000
+
+
+def _hash(data):
+    # Fingerprints only need to be unique in practice (dupefilter, cache
+    # keys), not resistant to crafted collisions: 128 bits of xxh3 when the
+    # xxhash package is installed, BLAKE2b otherwise.
+    if xxhash is not None:
+        return xxhash.xxh3_128_digest(data)
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def _freeze(value):
+    # Values are tagged with their type: 1, 1.0 and True are equal (and hash
+    # the same) as dictionary keys, but are different parameter values
+    if isinstance(value, Mapping):
+        items = tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+        return dict, items
+    if isinstance(value, (list, tuple)):
+        return list, tuple(_freeze(item) for item in value)
+    return type(value), value
+
+
+# URLs that canonicalize_url() would leave as they are, except for the
+# order of their query parameters: lowercase scheme and host, no fragment,
+# no dot segments and only unreserved characters in the path and query.
+_SIMPLE_URL = re.compile(
+    r"([a-z][a-z0-9+.-]*://[a-z0-9.-]+(?::[0-9]+)?/[A-Za-z0-9\-._~/]*)"
+    r"(?:\?([A-Za-z0-9\-._~=&]*))?"
+)
+_SIMPLE_QUERY_PAIR = re.compile(r"[A-Za-z0-9\-._~]+=[A-Za-z0-9\-._~]*")
+
+
+def _query_pair_key(pair):
+    return pair.split("=", 1)
+
+
+def _simple_canonical_url(url):
+    """Return canonicalize_url(url) for simple URLs, None for the rest."""
+    match = _SIMPLE_URL.fullmatch(url)
+    if match is None:
+        return None
+    base, query = match.groups()
+    if "/." in base:
+        return None
+    if query is None:
+        return base
+    pairs = query.split("&")
+    for pair in pairs:
+        if _SIMPLE_QUERY_PAIR.fullmatch(pair) is None:
+            return None
+    return base + "?" + "&".join(sorted(pairs, key=_query_pair_key))
+
+
+@lru_cache(maxsize=65536)
+def _canonical_url(url, keep_fragments):
+    canonical = _simple_canonical_url(url)
+    if canonical is None:
+        canonical = canonicalize_url(url, keep_fragments=keep_fragments)
+    return canonical.encode()
+
+
+class FastRequestFingerprinter:
+    """Request fingerprinter that includes the Zyte API parameters.
+
+    The fingerprint covers the request method, canonical URL, body and, for
+    requests sent through Zyte API, the explicit Zyte API parameters (minus
+    ``FAST_FINGERPRINT_IGNORED_PARAMS``). Requests with the same method,
+    URL and body are duplicates if they use the same Zyte API parameters,
+    so a browser render and a plain download of a URL are not.
+
+    Fingerprints are memoized per request object, so the dupefilter, the
+    HTTP cache and the scheduler queues share one computation. Parameter
+    sets are canonicalized once and their digest is shared by all requests
+    that use the same parameters.
+    """
+
+    def __init__(self, crawler=None):
+        self._transparent = False
+        self._ignored = frozenset(DEFAULT_IGNORED_PARAMS)
+        if crawler is not None:
+            settings = crawler.settings
+            self._transparent = transparent_mode(settings)
+            self._ignored = frozenset(
+                settings.getlist(
+                    "FAST_FINGERPRINT_IGNORED_PARAMS", DEFAULT_IGNORED_PARAMS
+                )
+            )
+        self._cache = WeakKeyDictionary()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def fingerprint(self, request):
+        try:
+            return self._cache[request]
+        except KeyError:
+            pass
+        fp = self._fingerprint(request, request.method, request.url, request.body)
+        self._cache[request] = fp
+        return fp
+
+    def fingerprint_url(self, url, meta=None, method="GET", body=b""):
+        """Return the fingerprint a request for *url* would get, without
+        building the request."""
+        request = SimpleNamespace(meta=meta or {})
+        return self._fingerprint(request, method, url, body)
+
+    def _fingerprint(self, request, method, url, body):
+        if zyte_mode(request, self._transparent) is None:
+            params_key = b"\x00"
+            keep_fragments = False
+        else:
+            params = zyte_params(request)
+            params_key = b"\x01" + self._params_digest(params)
+            keep_fragments = any(params.get(key) for key in BROWSER_PARAMS)
+        return _hash(
+            b"".join(
+                (
+                    method.encode(),
+                    b"\x00",
+                    _canonical_url(url, keep_fragments),
+                    b"\x00",
+                    params_key,
+                    body,
+                )
+            )
+        )
+
+    def _params_digest(self, params):
+        frozen = tuple(
+            sorted(
+                (key, _freeze(value))
+                for key, value in params.items()
+                if key not in self._ignored
+            )
+        )
+        try:
+            return _param_digests[frozen]
+        except KeyError:
+            pass
+        if len(_param_digests) >= _PARAM_DIGESTS_MAX_SIZE:
+            _param_digests.clear()
+        digest = _param_digests[frozen] = _hash(repr(frozen).encode())
+        return digest
+
+
+class FastFingerprintAddon:
+    """Addon that sets REQUEST_FINGERPRINTER_CLASS to
+    :class:`FastRequestFingerprinter`."""
+
+    def update_settings(self, settings):
+        settings.set(
+            "REQUEST_FINGERPRINTER_CLASS",
+            "scrapy_lab_tutorial.fingerprint.FastRequestFingerprinter",
+            "addon",
+        )
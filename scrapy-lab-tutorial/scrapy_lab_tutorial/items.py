@@ -13,7 +13,11 @@ class ScrapyLabTutorialItem(scrapy.Item):
 
 
 class QuoteItem(scrapy.Item):
-    text = scrapy.Field()
-    author = scrapy.Field()
-    tags = scrapy.Field()
-    url = scrapy.Field()
+    # Field metadata is the schema of ValidationPipeline (see pipelines.py)
+    text = scrapy.Field(type=str, required=True, normalize=True, strip_quotes=True)
+    author = scrapy.Field(type=str, required=True, normalize=True)
+    tags = scrapy.Field(type=list, default=list, normalize=True)
+    url = scrapy.Field(type=str)
+    # How the page was fetched, and whether it had quotes (tutorial spiders)
+    method = scrapy.Field(type=str)
+    success = scrapy.Field()
@@ -0,0 +1,219 @@
+# Follow the links of listing pages in batches
+#
+# response.follow() builds a Request for every link, joining and escaping
+# its URL, and the dupefilter drops the ones already seen only once they
+# reach the scheduler. Listing pages repeat the same links (pagination,
+# tags, authors) on every page, so most of that work is thrown away.
+# Spiders that mix in BatchFollowMixin get the links of a page with one
+# XPath call, resolve them through a per-host cache of absolute URLs, and
+# check their fingerprints against the dupefilter in bulk, so that
+# requests are only returned for new links.
+#
+# The dupefilter check needs a dupefilter with seen_fingerprint(), such as
+# scrapy_lab_tutorial.dupefilters.BloomDupeFilter. Scrapy's RFPDupeFilter
+# has no way to look a fingerprint up without adding it, so with it (the
+# default) links are only deduplicated within each page, the scheduler
+# drops the rest as usual, and follow_links() logs that once.
+#
+# Any request fingerprinter works. With one that has fingerprint_url()
+# (see scrapy_lab_tutorial.fingerprint.FastRequestFingerprinter), GET
+# requests are only built for new links; otherwise every request is built
+# and fingerprinted, and only new ones are returned.
+
+import logging
+import re
+from collections import OrderedDict
+from functools import lru_cache
+from urllib.parse import urljoin, urlsplit
+
+from lxml import etree
+from parsel.csstranslator import HTMLTranslator
+from scrapy import Request
+from scrapy.statscollectors import DummyStatsCollector
+from scrapy.utils.response import get_base_url
+from w3lib.html import strip_html5_whitespace
+from w3lib.url import safe_url_string
+
+logger = logging.getLogger(__name__)
+
+# Links that do not depend on the path of the page they are on
+_HOST_RELATIVE = re.compile(r"/|[A-Za-z][A-Za-z0-9+.-]*:")
+
+
+@lru_cache(maxsize=256)
+def _href_xpath(xpath, css):
+    if css is not None:
+        xpath = HTMLTranslator().css_to_xpath(css) + "/@href"
+    return etree.XPath(xpath)
+
+
+class LinkResolver:
+    """Turn the hrefs of pages into the URLs their requests would get.
+
+    Resolved URLs are cached per host (and page encoding). Absolute and
+    root-relative hrefs are cached for all pages of the host, other
+    relative ones for the page path they were found on. Only http and
+    https URLs are returned.
+
+    At most *max_hosts* hosts are cached, the least recently used are
+    dropped first, and the cache of a host is cleared once it holds
+    *max_urls_per_host* URLs.
+    """
+
+    def __init__(self, max_hosts=1024, max_urls_per_host=10_000):
+        self.max_hosts = max_hosts
+        self.max_urls_per_host = max_urls_per_host
+        self.hosts = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def resolve(self, base_url, hrefs, encoding="utf-8"):
+        """Return the absolute URLs of *hrefs*, relative to *base_url*."""
+        parts = urlsplit(base_url)
+        key = (parts.scheme, parts.netloc, encoding)
+        try:
+            cache = self.hosts[key]
+            self.hosts.move_to_end(key)
+        except KeyError:
+            cache = self.hosts[key] = {}
+            if len(self.hosts) > self.max_hosts:
+                self.hosts.popitem(last=False)
+        page = parts.path + "?" + parts.query
+        urls = []
+        for href in hrefs:
+            href = strip_html5_whitespace(href)
+            cache_key = href if _HOST_RELATIVE.match(href) else (page, href)
+            try:
+                url = cache[cache_key]
+                self.hits += 1
+            except KeyError:
+                self.misses += 1
+                if len(cache) >= self.max_urls_per_host:
+                    cache.clear()
+                url = safe_url_string(urljoin(base_url, href), encoding)
+                if not url.startswith(("http://", "https://")):
+                    url = None
+                cache[cache_key] = url
+            if url is not None:
+                urls.append(url)
+        return urls
+
+
+class BatchFollowMixin:
+    """Spider mixin that turns the links of a page into requests in bulk.
+
+    Use :meth:`follow_links` instead of calling ``response.follow()`` for
+    each link.
+
+    Stats: ``links/extracted`` (hrefs found), ``links/seen`` (links dropped
+    as already seen by the dupefilter) and ``links/followed``.
+    """
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        spider._link_resolver = LinkResolver()
+        spider._link_dupefilter_checked = False
+        return spider
+
+    # Callbacks may run outside a crawl (see the benchparse command), where
+    # the crawler has neither stats nor an engine yet
+
+    def _link_stats(self):
+        try:
+            return self.crawler.stats
+        except RuntimeError:
+            return DummyStatsCollector(self.crawler)
+
+    def _link_dupefilter(self):
+        try:
+            engine = self.crawler.engine
+        except RuntimeError:
+            return None
+        slot = getattr(engine, "_slot", None) or getattr(engine, "slot", None)
+        if slot is None or slot.scheduler is None:
+            return None
+        dupefilter = getattr(slot.scheduler, "df", None)
+        if not hasattr(dupefilter, "seen_fingerprint"):
+            if not self._link_dupefilter_checked:
+                logger.info(
+                    "%(dupefilter)s cannot look up fingerprints, so"
+                    " follow_links() only drops duplicate links within each"
+                    " page; use scrapy_lab_tutorial.dupefilters.BloomDupeFilter"
+                    " to drop links seen on other pages too",
+                    {"dupefilter": type(dupefilter).__name__},
+                    extra={"spider": self},
+                )
+                self._link_dupefilter_checked = True
+            return None
+        return dupefilter
+
+    def follow_links(
+        self,
+        response,
+        xpath="//a/@href",
+        css=None,
+        callback=None,
+        meta=None,
+        dont_filter=False,
+        **kwargs,
+    ):
+        """Return requests for the new links of *response*, as a list.
+
+        Links are the ``href`` attributes of the elements matched by *css*,
+        if given, or the attribute values matched by *xpath*. Other
+        arguments are passed to :class:`~scrapy.Request`, which gets a copy
+        of *meta*. Requests are returned for each distinct link of the
+        page that the dupefilter has not seen yet, or for every distinct
+        link if *dont_filter* is true.
+        """
+        hrefs = _href_xpath(xpath, css)(response.selector.root)
+        stats = self._link_stats()
+        stats.inc_value("links/extracted", len(hrefs))
+        hrefs = dict.fromkeys(hrefs)
+        urls = dict.fromkeys(
+            self._link_resolver.resolve(
+                get_base_url(response), hrefs, response.encoding
+            )
+        )
+
+        def build(url):
+            return Request(
+                url,
+                callback=callback,
+                meta=dict(meta) if meta else None,
+                encoding=response.encoding,
+                dont_filter=dont_filter,
+                **kwargs,
+            )
+
+        dupefilter = None if dont_filter else self._link_dupefilter()
+        if dupefilter is None:
+            requests = [build(url) for url in urls]
+        else:
+            requests = self._new_link_requests(dupefilter, urls, build, meta, kwargs)
+            stats.inc_value("links/seen", len(urls) - len(requests))
+        stats.inc_value("links/followed", len(requests))
+        return requests
+
+    def _new_link_requests(self, dupefilter, urls, build, meta, kwargs):
+        seen = dupefilter.seen_fingerprint
+        fingerprinter = dupefilter.fingerprinter
+        fingerprint_url = getattr(fingerprinter, "fingerprint_url", None)
+        if "method" in kwargs or "body" in kwargs:
+            # fingerprint_url() is for GET requests without a body
+            fingerprint_url = None
+        requests = []
+        fingerprints = set()
+        for url in urls:
+            if fingerprint_url is not None:
+                request = None
+                fp = fingerprint_url(url, meta)
+            else:
+                request = build(url)
+                fp = fingerprinter.fingerprint(request)
+            if fp in fingerprints or seen(fp):
+                continue
+            fingerprints.add(fp)
+            requests.append(build(url) if request is None else request)
+        return requests
@@ -0,0 +1,196 @@
+# Logging helpers: JSON records, per-message sampling and a queue handler
+# that leaves formatting to a background thread
+#
+# See StructuredLoggingExtension in extensions.py for how they are wired up.
+
+import json
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from logging.handlers import QueueHandler, QueueListener
+
+from scrapy.utils.log import LogCounterHandler, get_scrapy_root_handler
+
+# LogRecord attributes that are not "extra" fields
+_RECORD_ATTRS = frozenset(
+    logging.LogRecord("", 0, "", 0, "", (), None).__dict__
+) | {"message", "asctime", "spider", "sampled_dropped"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line.
+
+    Fields passed with ``extra`` are included as they are (or as their
+    ``repr()`` if they are not JSON serializable), as is the name of the
+    spider of Scrapy records.
+    """
+
+    def format(self, record):
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        spider = getattr(record, "spider", None)
+        if spider is not None:
+            data["spider"] = getattr(spider, "name", str(spider))
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                data[key] = value
+        dropped = getattr(record, "sampled_dropped", 0)
+        if dropped:
+            data["sampled_dropped"] = dropped
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data["exc_info"] = record.exc_text
+        if record.stack_info:
+            data["stack_info"] = self.formatStack(record.stack_info)
+        return json.dumps(data, ensure_ascii=False, default=repr)
+
+
+class SamplingFilter(logging.Filter):
+    """Let through at most *rate* records per second of each message.
+
+    Messages are told apart by logger, level and the source line that logs
+    them, so ``"Found %d quotes"`` (or an f-string) is one message whatever
+    its arguments. Each one gets a token bucket of *burst* records refilled
+    at *rate* per second. Records of *min_level* and above are never
+    dropped. The next record let through after drops carries their count in
+    its ``sampled_dropped`` attribute.
+
+    Buckets of at most *max_messages* messages are kept, those of the least
+    recently logged messages are dropped first.
+    """
+
+    def __init__(
+        self, rate, burst=None, min_level=logging.WARNING, max_messages=10000
+    ):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self.min_level = min_level
+        self.max_messages = max_messages
+        self.buckets = OrderedDict()
+        self.dropped = 0
+
+    def filter(self, record):
+        if record.levelno >= self.min_level:
+            return True
+        key = (record.name, record.levelno, record.pathname, record.lineno)
+        now = time.monotonic()
+        try:
+            tokens, updated, dropped = self.buckets[key]
+            self.buckets.move_to_end(key)
+        except KeyError:
+            tokens, updated, dropped = self.burst, now, 0
+            if len(self.buckets) >= self.max_messages:
+                self.buckets.popitem(last=False)
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens < 1:
+            self.buckets[key] = (tokens, now, dropped + 1)
+            self.dropped += 1
+            return False
+        if dropped:
+            record.sampled_dropped = dropped
+        self.buckets[key] = (tokens - 1, now, 0)
+        return True
+
+
+class DeferredQueueHandler(QueueHandler):
+    """Queue handler that does not format records in the logging thread.
+
+    :class:`logging.handlers.QueueHandler` merges the message arguments
+    before queueing the record. This one queues the record as it is, so the
+    handlers of the :class:`~logging.handlers.QueueListener` thread do all
+    the formatting. Arguments should thus not be changed after logging
+    them, which holds for the strings and numbers logged in practice.
+
+    When the queue is full, records are dropped and counted in
+    :attr:`dropped` instead of blocking.
+    """
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+        self._lock_dropped = threading.Lock()
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock_dropped:
+                self.dropped += 1
+
+
+class QueueLogging:
+    """Send the records of the root logger through a background thread.
+
+    :meth:`start` puts a :class:`DeferredQueueHandler` on the root logger
+    in place of its output handlers (Scrapy's root handler, a ``LOG_FILE``
+    handler...), which a :class:`~logging.handlers.QueueListener` thread
+    then feeds. ``log_count/*`` stats handlers stay on the root logger.
+
+    Scrapy replaces its root handler when a crawler starts, so
+    :meth:`adopt` must be called again once it has. Calls to :meth:`start`
+    and :meth:`stop` nest, so several crawlers can share one instance:
+    the output handlers get back on the root logger, and the queue is
+    drained, once :meth:`stop` has been called as many times as
+    :meth:`start`.
+    """
+
+    def __init__(self, queue_size=10000, formatter=None, sampling_filter=None):
+        self.queue = queue.Queue(queue_size)
+        self.handler = DeferredQueueHandler(self.queue)
+        self.sampling_filter = sampling_filter
+        if sampling_filter is not None:
+            self.handler.addFilter(sampling_filter)
+        self.formatter = formatter
+        self.listener = QueueListener(self.queue, respect_handler_level=True)
+        self.handlers = []
+        self.users = 0
+        self._scrapy_handlers = set()
+
+    def start(self):
+        if self.users == 0:
+            logging.root.addHandler(self.handler)
+            self.listener.start()
+        self.users += 1
+        self.adopt()
+
+    def adopt(self):
+        """Move the output handlers of the root logger behind the queue."""
+        # Scrapy closes the root handlers it replaces
+        scrapy_handler = get_scrapy_root_handler()
+        handlers = [
+            handler
+            for handler in self.handlers
+            if handler is scrapy_handler or handler not in self._scrapy_handlers
+        ]
+        for handler in list(logging.root.handlers):
+            if handler is self.handler or isinstance(handler, LogCounterHandler):
+                continue
+            logging.root.removeHandler(handler)
+            if self.formatter is not None:
+                handler.setFormatter(self.formatter)
+            handlers.append(handler)
+        if scrapy_handler is not None:
+            self._scrapy_handlers.add(scrapy_handler)
+        self.handlers = handlers
+        self.listener.handlers = tuple(handlers)
+
+    def stop(self):
+        self.users -= 1
+        if self.users > 0:
+            return
+        logging.root.removeHandler(self.handler)
+        self.listener.stop()
+        for handler in self.handlers:
+            logging.root.addHandler(handler)
+        self.handlers = []
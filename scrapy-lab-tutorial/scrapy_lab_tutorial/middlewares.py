@@ -3,11 +3,21 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import time
+
 from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http import TextResponse
+from scrapy.utils.asyncio import call_later
+from scrapy.utils.defer import deferred_from_coro, maybe_deferred_to_future
+from scrapy.utils.httpobj import urlparse_cached
+from twisted.internet.threads import deferToThread
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
 
+from scrapy_lab_tutorial.zyte import transparent_mode, zyte_mode, zyte_params
+
 
 class ScrapyLabTutorialSpiderMiddleware:
     # Not all methods need to be defined. If a method is not defined,
@@ -101,3 +111,402 @@ class ScrapyLabTutorialDownloaderMiddleware:
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+
+
+def _decode(response):
+    # TextResponse caches the detected encoding and the decoded text, so
+    # touching them here means the callback gets them for free.
+    response.text
+    return response
+
+
+class ThreadedDecodingMiddleware:
+    """Decode large text responses in the reactor thread pool.
+
+    Charset detection and decoding of multi-megabyte bodies (e.g. Zyte API
+    ``browserHtml`` or ``httpResponseBody``) otherwise run on the reactor
+    thread and stall every other in-flight request. Responses whose body is
+    at least ``THREADED_DECODING_MIN_SIZE`` bytes are decoded in the thread
+    pool (sized by ``REACTOR_THREADPOOL_MAXSIZE``) and only handed on once
+    ``response.text`` is ready.
+    """
+
+    def __init__(self, min_size, stats):
+        self.min_size = min_size
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        min_size = crawler.settings.getint("THREADED_DECODING_MIN_SIZE", 512 * 1024)
+        if min_size < 0:
+            raise NotConfigured("THREADED_DECODING_MIN_SIZE must be 0 or greater")
+        return cls(min_size, crawler.stats)
+
+    async def process_response(self, request, response, spider=None):
+        if not isinstance(response, TextResponse) or len(response.body) < self.min_size:
+            return response
+        self.stats.inc_value("threaded_decoding/count")
+        self.stats.inc_value("threaded_decoding/bytes", len(response.body))
+        return await maybe_deferred_to_future(deferToThread(_decode, response))
+
+
+class _Circuit:
+    def __init__(self):
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.probe_timer = None
+
+
+class BlockCircuitBreakerMiddleware:
+    """Send requests for a domain through Zyte API once it starts blocking.
+
+    A plain (non Zyte API) response counts as blocked if its status is in
+    ``CIRCUIT_BREAKER_BLOCK_CODES``, or if it matches nothing for the
+    ``circuit_breaker_expect_css`` spider attribute (default:
+    ``CIRCUIT_BREAKER_EXPECT_CSS``), e.g. ``"div.quote"``. Spiders whose
+    legitimate pages are never tiny can also count bodies shorter than
+    their ``circuit_breaker_min_body_size`` attribute (default:
+    ``CIRCUIT_BREAKER_MIN_BODY_SIZE``, 0: off) as blocked.
+
+    After ``CIRCUIT_BREAKER_THRESHOLD`` blocked responses in a row, the
+    circuit of that domain opens: blocked requests are retried and new
+    requests are sent through Zyte API (``zyte_api_automap``). Every
+    ``CIRCUIT_BREAKER_COOLDOWN`` seconds, one request is let through the
+    plain path again to probe the domain; if it is not blocked, the circuit
+    closes. If it fails, or gets no response within
+    ``CIRCUIT_BREAKER_PROBE_TIMEOUT`` seconds (default: ``DOWNLOAD_TIMEOUT``,
+    checked with a timer, so even if no other request comes), the circuit
+    opens again.
+
+    Set the ``circuit_breaker`` request meta key to False to leave a request
+    alone. Requires the Zyte API addon, with transparent mode disabled: the
+    addon enables it, so set ``ZYTE_API_TRANSPARENT_MODE = False`` in the
+    project settings. The middleware is disabled otherwise.
+    """
+
+    def __init__(self, settings, stats):
+        self.threshold = settings.getint("CIRCUIT_BREAKER_THRESHOLD", 5)
+        self.cooldown = settings.getfloat("CIRCUIT_BREAKER_COOLDOWN", 300)
+        self.probe_timeout = settings.getfloat(
+            "CIRCUIT_BREAKER_PROBE_TIMEOUT", settings.getfloat("DOWNLOAD_TIMEOUT")
+        )
+        self.block_codes = {
+            int(code)
+            for code in settings.getlist("CIRCUIT_BREAKER_BLOCK_CODES", [403, 429, 503])
+        }
+        self.min_body_size = settings.getint("CIRCUIT_BREAKER_MIN_BODY_SIZE", 0)
+        self.expect_css = settings.get("CIRCUIT_BREAKER_EXPECT_CSS")
+        self.transparent = transparent_mode(settings)
+        self.stats = stats
+        self.circuits = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if crawler.settings.getint("CIRCUIT_BREAKER_THRESHOLD", 5) < 1:
+            raise NotConfigured("CIRCUIT_BREAKER_THRESHOLD must be 1 or greater")
+        if transparent_mode(crawler.settings):
+            # Every request would already go through Zyte API
+            raise NotConfigured(
+                "BlockCircuitBreakerMiddleware requires "
+                "ZYTE_API_TRANSPARENT_MODE = False"
+            )
+        mw = cls(crawler.settings, crawler.stats)
+        crawler.signals.connect(mw.spider_closed, signal=signals.spider_closed)
+        return mw
+
+    def spider_closed(self, spider):
+        for circuit in self.circuits.values():
+            self._end_probe(circuit)
+
+    def _skip(self, request):
+        return (
+            request.meta.get("circuit_breaker") is False
+            or zyte_mode(request, self.transparent) is not None
+        )
+
+    def process_request(self, request, spider):
+        if self._skip(request):
+            return None
+        if request.meta.get("circuit_breaker_probe"):
+            # A redirect or retry of the probe, which is still the probe
+            return None
+        domain = urlparse_cached(request).hostname
+        circuit = self.circuits.get(domain)
+        if circuit is None or circuit.state == "closed":
+            return None
+        if (
+            not circuit.probing
+            and time.monotonic() - circuit.opened_at >= self.cooldown
+        ):
+            circuit.state = "half-open"
+            circuit.probing = True
+            circuit.probe_timer = call_later(
+                self.probe_timeout, self._probe_lost, circuit, domain, spider
+            )
+            request.meta["circuit_breaker_probe"] = domain
+            self.stats.inc_value("circuit_breaker/probes")
+            return None
+        request.meta["zyte_api_automap"] = True
+        self.stats.inc_value("circuit_breaker/rerouted")
+        return None
+
+    def process_response(self, request, response, spider):
+        if self._skip(request):
+            return response
+        blocked = self._is_blocked(response, spider)
+        probe_domain = request.meta.get("circuit_breaker_probe")
+        # The probe may have been redirected to another domain
+        domain = probe_domain or urlparse_cached(request).hostname
+        circuit = self.circuits.setdefault(domain, _Circuit())
+        if probe_domain:
+            self._end_probe(circuit)
+            if blocked:
+                self._open(circuit, domain, spider)
+            else:
+                circuit.state = "closed"
+                circuit.failures = 0
+                spider.logger.info("Circuit breaker closed for %s", domain)
+        elif not blocked:
+            circuit.failures = 0
+        elif circuit.state == "closed":
+            circuit.failures += 1
+            if circuit.failures >= self.threshold:
+                self._open(circuit, domain, spider)
+        if not blocked:
+            return response
+        self.stats.inc_value("circuit_breaker/blocked")
+        if circuit.state == "closed":
+            return response
+        self.stats.inc_value("circuit_breaker/retried")
+        meta = dict(request.meta, zyte_api_automap=True)
+        meta.pop("circuit_breaker_probe", None)
+        return request.replace(meta=meta, dont_filter=True)
+
+    def process_exception(self, request, exception, spider):
+        probe_domain = request.meta.get("circuit_breaker_probe")
+        circuit = self.circuits.get(probe_domain)
+        if circuit is None or not circuit.probing:
+            return None
+        self._end_probe(circuit)
+        self.stats.inc_value("circuit_breaker/probes_failed")
+        self._open(circuit, probe_domain, spider)
+        return None
+
+    def _end_probe(self, circuit):
+        circuit.probing = False
+        if circuit.probe_timer is not None:
+            circuit.probe_timer.cancel()
+            circuit.probe_timer = None
+
+    def _probe_lost(self, circuit, domain, spider):
+        # No response in time: filtered, dropped by a middleware, stuck...
+        circuit.probe_timer = None
+        circuit.probing = False
+        self.stats.inc_value("circuit_breaker/probes_lost")
+        self._open(circuit, domain, spider)
+
+    def _open(self, circuit, domain, spider):
+        circuit.state = "open"
+        circuit.opened_at = time.monotonic()
+        self.stats.inc_value("circuit_breaker/opened")
+        spider.logger.warning(
+            "Circuit breaker opened for %s: sending its requests through "
+            "Zyte API for the next %ds",
+            domain,
+            self.cooldown,
+        )
+
+    def _is_blocked(self, response, spider):
+        if response.status in self.block_codes:
+            return True
+        min_body_size = getattr(
+            spider, "circuit_breaker_min_body_size", self.min_body_size
+        )
+        if min_body_size and len(response.body) < min_body_size:
+            return True
+        expect_css = getattr(spider, "circuit_breaker_expect_css", self.expect_css)
+        if expect_css and isinstance(response, TextResponse):
+            return not response.css(expect_css)
+        return False
+
+
+ZYTE_BUDGETS = ("calls", "browser", "screenshots")
+
+# Zyte API parameters that only work with browser rendering, dropped when a
+# request falls back to httpResponseBody
+BROWSER_ONLY_PARAMS = (
+    "browserHtml",
+    "screenshot",
+    "screenshotOptions",
+    "actions",
+    "javascript",
+    "viewport",
+    "networkCapture",
+    "requestHeaders",
+)
+
+
+def _zyte_cost(params):
+    screenshot = bool(params.get("screenshot"))
+    browser = screenshot or bool(params.get("browserHtml") or params.get("actions"))
+    return {"calls": 1, "browser": int(browser), "screenshots": int(screenshot)}
+
+
+def _http_params(params):
+    http_params = {
+        key: value for key, value in params.items() if key not in BROWSER_ONLY_PARAMS
+    }
+    http_params["httpResponseBody"] = True
+    http_params["httpResponseHeaders"] = True
+    headers = params.get("requestHeaders")
+    if headers and "customHttpRequestHeaders" not in http_params:
+        http_params["customHttpRequestHeaders"] = [
+            {"name": name, "value": value} for name, value in headers.items()
+        ]
+    return http_params
+
+
+class ZyteBudgetMiddleware:
+    """Cap the Zyte API calls, browser renders and screenshots of a crawl.
+
+    Budgets are set per crawl (``ZYTE_BUDGET_CALLS``,
+    ``ZYTE_BUDGET_BROWSER``, ``ZYTE_BUDGET_SCREENSHOTS``) and per domain
+    (``ZYTE_BUDGET_DOMAIN_CALLS``, ``ZYTE_BUDGET_DOMAIN_BROWSER``,
+    ``ZYTE_BUDGET_DOMAIN_SCREENSHOTS``); 0 means no limit.
+
+    Once ``ZYTE_BUDGET_DEGRADE_AT`` (a fraction, default 0.8) of a budget
+    is used, requests are downgraded instead of being sent as they are:
+
+    - screenshots are dropped from requests that also ask for
+      ``browserHtml`` or ``httpResponseBody``;
+    - ``browserHtml`` (with actions and other browser-only parameters) is
+      replaced by ``httpResponseBody``, for spiders whose
+      ``zyte_budget_http_fallback`` attribute is True (or a callable that
+      returns True for the request), or requests whose
+      ``zyte_budget_http_fallback`` meta key is True.
+
+    The rest of the budget is left to requests that cannot be downgraded.
+    When a budget is used up, requests that need it are dropped
+    (``ZYTE_BUDGET_ON_EXHAUSTED = "ignore"``, the default) or the spider is
+    closed (``"close"``).
+
+    Place it before the scrapy-zyte-api middlewares, and after
+    BlockCircuitBreakerMiddleware so that rerouted requests count.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.limits = {
+            budget: settings.getint(f"ZYTE_BUDGET_{budget.upper()}", 0)
+            for budget in ZYTE_BUDGETS
+        }
+        self.domain_limits = {
+            budget: settings.getint(f"ZYTE_BUDGET_DOMAIN_{budget.upper()}", 0)
+            for budget in ZYTE_BUDGETS
+        }
+        self.degrade_at = settings.getfloat("ZYTE_BUDGET_DEGRADE_AT", 0.8)
+        self.on_exhausted = settings.get("ZYTE_BUDGET_ON_EXHAUSTED", "ignore")
+        if self.on_exhausted not in ("ignore", "close"):
+            raise NotConfigured(
+                'ZYTE_BUDGET_ON_EXHAUSTED must be "ignore" or "close", '
+                f"got {self.on_exhausted!r}"
+            )
+        self.transparent = transparent_mode(settings)
+        self.used = dict.fromkeys(ZYTE_BUDGETS, 0)
+        self.domain_used = {}
+        self.closing = False
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not any(
+            settings.getint(f"ZYTE_BUDGET_{scope}{budget.upper()}", 0)
+            for scope in ("", "DOMAIN_")
+            for budget in ZYTE_BUDGETS
+        ):
+            raise NotConfigured("No Zyte API budget is set")
+        return cls(crawler)
+
+    def _scopes(self, domain_used):
+        yield "crawl", self.limits, self.used
+        yield "domain", self.domain_limits, domain_used
+
+    def _low(self, budget, domain_used):
+        return any(
+            limits[budget] and used[budget] >= limits[budget] * self.degrade_at
+            for _, limits, used in self._scopes(domain_used)
+        )
+
+    def _http_fallback(self, request, spider):
+        fallback = request.meta.get("zyte_budget_http_fallback")
+        if fallback is None:
+            fallback = getattr(spider, "zyte_budget_http_fallback", False)
+        if callable(fallback):
+            return fallback(request)
+        return fallback
+
+    def process_request(self, request, spider):
+        mode = zyte_mode(request, self.transparent)
+        if mode is None:
+            return None
+        domain = urlparse_cached(request).hostname
+        domain_used = self.domain_used.setdefault(
+            domain, dict.fromkeys(ZYTE_BUDGETS, 0)
+        )
+        params = original = zyte_params(request)
+        # Build new parameter dicts: the original one may be shared with
+        # other requests.
+        if (
+            params.get("screenshot")
+            and (params.get("browserHtml") or params.get("httpResponseBody"))
+            and self._low("screenshots", domain_used)
+        ):
+            params = {
+                key: value
+                for key, value in params.items()
+                if key not in ("screenshot", "screenshotOptions")
+            }
+            self.stats.inc_value("zyte_budget/degraded/screenshot")
+        if (
+            _zyte_cost(params)["browser"]
+            and self._low("browser", domain_used)
+            and self._http_fallback(request, spider)
+        ):
+            params = _http_params(params)
+            self.stats.inc_value("zyte_budget/degraded/browser")
+        if params is not original:
+            key = "zyte_api" if mode == "manual" else "zyte_api_automap"
+            request.meta[key] = params
+        cost = _zyte_cost(params)
+        for scope, limits, used in self._scopes(domain_used):
+            for budget in ZYTE_BUDGETS:
+                if cost[budget] and limits[budget] and used[budget] >= limits[budget]:
+                    self._exhausted(spider, scope, budget, domain)
+        for budget in ZYTE_BUDGETS:
+            self.used[budget] += cost[budget]
+            domain_used[budget] += cost[budget]
+            if cost[budget]:
+                self.stats.inc_value(f"zyte_budget/{budget}")
+        return None
+
+    def _exhausted(self, spider, scope, budget, domain):
+        self.stats.inc_value(f"zyte_budget/exhausted/{budget}")
+        if self.on_exhausted == "close" and not self.closing:
+            self.closing = True
+            spider.logger.warning(
+                "Zyte API %s budget exhausted for %s, closing the spider",
+                budget,
+                domain if scope == "domain" else "the crawl",
+            )
+            engine = self.crawler.engine
+            if hasattr(engine, "close_spider_async"):
+                deferred_from_coro(
+                    engine.close_spider_async(reason="zyte_budget_exhausted")
+                )
+            else:
+                engine.close_spider(spider, "zyte_budget_exhausted")
+        raise IgnoreRequest(f"Zyte API {budget} budget exhausted for this {scope}")
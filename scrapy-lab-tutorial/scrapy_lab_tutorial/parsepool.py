@@ -0,0 +1,98 @@
+# Run CPU-heavy extraction in a process pool
+#
+# Spider callbacks run on the reactor thread, so heavy extraction on large
+# rendered pages blocks I/O for every other request. Spiders that mix in
+# ProcessPoolParseMixin can ship the response body to a pool of worker
+# processes instead and get the results back asynchronously.
+#
+# Requires the asyncio reactor (see TWISTED_REACTOR in settings.py).
+
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from scrapy import signals
+from scrapy.http import HtmlResponse
+from scrapy.link import Link
+
+
+def _run_extract(extract, url, body, encoding):
+    # Runs in a worker process: rebuild a response from the raw body so the
+    # extract function can use the usual selector API.
+    response = HtmlResponse(url=url, body=body, encoding=encoding)
+    return list(extract(response))
+
+
+class ProcessPoolParseMixin:
+    """Spider mixin that runs extraction functions in a process pool.
+
+    ``extract`` functions passed to :meth:`parse_in_pool` must be defined at
+    module level (so they can be pickled) and take a response. They yield
+    items, and :class:`~scrapy.link.Link` objects for pages to follow.
+
+    Settings:
+
+    - ``PARSE_POOL_WORKERS``: number of worker processes. ``0`` (default)
+      runs extraction inline on the reactor thread.
+    - ``PARSE_POOL_MAX_PENDING``: maximum responses queued for, or being
+      processed by, the pool at any time (default: 4 per worker). Callbacks
+      wait for a free slot, which in turn backs up the scraper slot.
+    """
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        workers = crawler.settings.getint("PARSE_POOL_WORKERS", 0)
+        spider._parse_pool_workers = workers
+        spider._parse_pool_max_pending = crawler.settings.getint(
+            "PARSE_POOL_MAX_PENDING", 4 * workers
+        )
+        spider._parse_pool = None
+        spider._parse_pool_slots = None
+        crawler.signals.connect(spider._close_parse_pool, signal=signals.spider_closed)
+        return spider
+
+    def _open_parse_pool(self):
+        # "spawn" keeps the workers clear of the reactor's threads and sockets.
+        self._parse_pool = ProcessPoolExecutor(
+            max_workers=self._parse_pool_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        self._parse_pool_slots = asyncio.Semaphore(
+            max(self._parse_pool_max_pending, 1)
+        )
+        self.logger.info(
+            "Parse pool started with %d workers", self._parse_pool_workers
+        )
+
+    def _close_parse_pool(self, spider):
+        if self._parse_pool is not None:
+            self._parse_pool.shutdown(wait=False, cancel_futures=True)
+            self._parse_pool = None
+
+    async def parse_in_pool(self, response, extract, callback=None):
+        """Return the results of ``extract(response)`` as a list.
+
+        Links yielded by ``extract`` are turned into follow-up requests with
+        ``callback`` (the spider's ``parse`` method by default).
+        """
+        if not self._parse_pool_workers:
+            results = list(extract(response))
+        else:
+            if self._parse_pool is None:
+                self._open_parse_pool()
+            async with self._parse_pool_slots:
+                future = self._parse_pool.submit(
+                    _run_extract,
+                    extract,
+                    response.url,
+                    response.body,
+                    response.encoding,
+                )
+                results = await asyncio.wrap_future(future)
+        return [
+            response.follow(result, callback=callback)
+            if isinstance(result, Link)
+            else result
+            for result in results
+        ]
@@ -4,10 +4,169 @@
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
 
+import json
+import re
+import string
+import unicodedata
+
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
+from scrapy.exceptions import DropItem
+from scrapy.utils.misc import load_object
 
 
 class ScrapyLabTutorialPipeline:
     def process_item(self, item, spider):
         return item
+
+
+# Characters stripped from both ends of fields with strip_quotes
+_QUOTES = "\"'“”‘’«»„"
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _normalize(value, form, strip_chars):
+    value = _WHITESPACE.sub(" ", unicodedata.normalize(form, value))
+    return value.strip(strip_chars)
+
+
+class _Schema:
+    # Field rules compiled from the metadata of the fields of an Item class:
+    #
+    # - type: str or list; other values are converted (a list becomes its
+    #   first element for str fields, a single value a one-element list)
+    # - default: value, or callable returning it, for missing values
+    # - normalize: Unicode normalization form of strings ("NFC" if True);
+    #   whitespace is collapsed and stripped too
+    # - strip_quotes: strip quotation marks from both ends of strings
+    # - required: reject items where the value is missing or empty
+
+    def __init__(self, item_cls):
+        self.fields = []
+        for name, meta in getattr(item_cls, "fields", {}).items():
+            normalize = meta.get("normalize")
+            if normalize is True:
+                normalize = "NFC"
+            strip_chars = None
+            if meta.get("strip_quotes"):
+                strip_chars = string.whitespace + _QUOTES
+            self.fields.append(
+                (
+                    name,
+                    meta.get("type"),
+                    meta.get("default"),
+                    normalize,
+                    strip_chars,
+                    meta.get("required", False),
+                )
+            )
+
+    def validate(self, adapter):
+        """Normalize the item of *adapter* in place, and return the reason
+        to reject it, or None if it is valid."""
+        reason = None
+        for name, type_, default, normalize, strip_chars, required in self.fields:
+            value = adapter.get(name)
+            if value is None and default is not None:
+                value = default() if callable(default) else default
+            if type_ is str:
+                value = self._to_str(value)
+            elif type_ is list:
+                value = self._to_list(value)
+            if normalize:
+                if isinstance(value, str):
+                    value = _normalize(value, normalize, strip_chars)
+                elif isinstance(value, list):
+                    value = [
+                        _normalize(member, normalize, strip_chars)
+                        if isinstance(member, str)
+                        else member
+                        for member in value
+                    ]
+            if value is None or value == "" or value == []:
+                if required and reason is None:
+                    reason = f"missing {name}"
+                if value is None and name not in adapter:
+                    continue
+            adapter[name] = value
+        return reason
+
+    def _to_str(self, value):
+        if isinstance(value, (list, tuple)):
+            value = value[0] if value else None
+        if value is None or isinstance(value, str):
+            return value
+        return str(value)
+
+    def _to_list(self, value):
+        if value is None or isinstance(value, list):
+            return value
+        if isinstance(value, tuple):
+            return list(value)
+        return [value]
+
+
+class ValidationPipeline:
+    """Validate and normalize items.
+
+    Each item class is checked against the schema given by the metadata of
+    its fields (see :class:`~scrapy_lab_tutorial.items.QuoteItem`, which
+    the spiders of this project yield). Dict items are let through as they
+    are, unless ``ITEM_VALIDATION_DICT_ITEM`` names an item class to check
+    them against. Items missing required fields are dropped, and written to
+    ``ITEM_VALIDATION_REJECTS_FILE`` (JSON lines) if set.
+
+    ``spider`` arguments are optional, recent Scrapy versions do not pass
+    them.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.stats = crawler.stats
+        self.rejects_path = settings.get("ITEM_VALIDATION_REJECTS_FILE")
+        dict_item = settings.get("ITEM_VALIDATION_DICT_ITEM")
+        self.dict_schema = _Schema(load_object(dict_item)) if dict_item else None
+        self.schemas = {}
+        self.rejects = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def open_spider(self, spider=None):
+        if self.rejects_path:
+            self.rejects = open(self.rejects_path, "a", encoding="utf-8")
+
+    def close_spider(self, spider=None):
+        if self.rejects is not None:
+            self.rejects.close()
+
+    def process_item(self, item, spider=None):
+        schema = self._schema(item)
+        if schema is None:
+            return item
+        adapter = ItemAdapter(item)
+        reason = schema.validate(adapter)
+        if reason is None:
+            return item
+        self.stats.inc_value("item_validation/rejected")
+        if self.rejects is not None:
+            self.rejects.write(
+                json.dumps(
+                    {"reason": reason, "item": adapter.asdict()},
+                    ensure_ascii=False,
+                    default=str,
+                )
+                + "\n"
+            )
+        raise DropItem(f"Invalid item: {reason}")
+
+    def _schema(self, item):
+        if isinstance(item, dict):
+            return self.dict_schema
+        cls = type(item)
+        try:
+            return self.schemas[cls]
+        except KeyError:
+            schema = self.schemas[cls] = _Schema(cls)
+            return schema
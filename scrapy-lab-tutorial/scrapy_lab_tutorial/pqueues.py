@@ -0,0 +1,140 @@
+# Scheduler priority queues
+#
+# See: https://docs.scrapy.org/en/latest/topics/settings.html#scheduler-priority-queue
+
+import time
+
+from scrapy import signals
+from scrapy.pqueues import ScrapyPriorityQueue
+
+from scrapy_lab_tutorial.zyte import request_profile, transparent_mode
+
+# Starting guesses for the download latency (seconds) and cost (rough Zyte
+# API credit units) of each part of a request profile, until real latencies
+# have been observed.
+PRIOR_LATENCY = {
+    "plain": 0.5,
+    "http": 1.0,
+    "browser": 6.0,
+    "screenshot": 2.0,
+    "actions": 2.0,
+}
+COST_UNITS = {"plain": 0, "http": 1, "browser": 5, "screenshot": 1, "actions": 1}
+
+
+class CostAwarePriorityQueue(ScrapyPriorityQueue):
+    """Priority queue that sends cheap, fast requests ahead of slow renders.
+
+    Each request is classified with
+    :func:`~scrapy_lab_tutorial.zyte.request_profile` (plain, Zyte API
+    HTTP, browser with screenshot/actions, ...). Its
+    priority is lowered by::
+
+        expected_latency * COST_PRIORITY_PER_SECOND
+        + cost_units * COST_PRIORITY_PER_COST_UNIT
+
+    capped at ``COST_PRIORITY_MAX_ADJUST``, so that explicit
+    ``Request.priority`` values larger than the cap still win. The expected
+    latency of each profile is an exponential moving average of the
+    ``download_latency`` of its responses (``COST_PRIORITY_SMOOTHING``).
+
+    Cheap requests thus keep the downloader and the callbacks busy while
+    slow browser renders are in flight, instead of queueing up behind them.
+    So that a steady flow of cheap requests does not starve expensive ones,
+    the penalty of each internal queue shrinks by ``COST_PRIORITY_AGING``
+    for every second since it was last popped from: expensive requests are
+    interleaved with cheap ones, about one every ``penalty / aging``
+    seconds.
+
+    Internal queues are keyed by ``-priority * (COST_PRIORITY_MAX_ADJUST +
+    1) + penalty``, so do not change ``COST_PRIORITY_MAX_ADJUST`` in the
+    middle of a JOBDIR crawl.
+    """
+
+    def __init__(self, crawler, *args, **kwargs):
+        settings = crawler.settings
+        self.per_second = settings.getfloat("COST_PRIORITY_PER_SECOND", 1.0)
+        self.per_cost_unit = settings.getfloat("COST_PRIORITY_PER_COST_UNIT", 0.5)
+        self.max_adjust = settings.getint("COST_PRIORITY_MAX_ADJUST", 10)
+        self.smoothing = settings.getfloat("COST_PRIORITY_SMOOTHING", 0.2)
+        self.aging = settings.getfloat("COST_PRIORITY_AGING", 1.0)
+        self.transparent = transparent_mode(settings)
+        self.latency = {}
+        self._slots = max(self.max_adjust, 0) + 1
+        # Internal queue key: when it was last popped from (or filled)
+        self._since = {}
+        super().__init__(crawler, *args, **kwargs)
+        now = time.monotonic()
+        for key in (*self.queues, *self._start_queues):
+            self._since[key] = now
+        crawler.signals.connect(
+            self.response_received, signal=signals.response_received
+        )
+
+    def expected_latency(self, profile):
+        try:
+            return self.latency[profile]
+        except KeyError:
+            return sum(PRIOR_LATENCY[part] for part in profile.split("+"))
+
+    def response_received(self, response, request, spider):
+        latency = request.meta.get("download_latency")
+        if latency is None:
+            return
+        profile = request_profile(request, self.transparent)
+        previous = self.latency.get(profile)
+        if previous is None:
+            self.latency[profile] = latency
+        else:
+            self.latency[profile] = previous + self.smoothing * (latency - previous)
+
+    def adjustment(self, request):
+        profile = request_profile(request, self.transparent)
+        cost = sum(COST_UNITS[part] for part in profile.split("+"))
+        penalty = (
+            self.expected_latency(profile) * self.per_second
+            + cost * self.per_cost_unit
+        )
+        return max(min(round(penalty), self.max_adjust), 0)
+
+    def priority(self, request):
+        return super().priority(request) * self._slots + self.adjustment(request)
+
+    def push(self, request):
+        super().push(request)
+        self._since.setdefault(self.priority(request), time.monotonic())
+
+    def _next_key(self):
+        keys = [key for key, q in self.queues.items() if q]
+        keys += [key for key, q in self._start_queues.items() if q]
+        if not keys:
+            return None
+        now = time.monotonic()
+
+        def rank(key):
+            level, adjustment = divmod(key, self._slots)
+            waited = now - self._since.get(key, now)
+            aged = max(adjustment - self.aging * waited, 0)
+            # On ties, the queue that waited longest goes first
+            return (level + aged, -waited, key)
+
+        return min(keys, key=rank)
+
+    def pop(self):
+        key = self._next_key()
+        if key is None:
+            return None
+        self.curprio = key
+        request = super().pop()
+        if key in self.queues or key in self._start_queues:
+            self._since[key] = time.monotonic()
+        else:
+            self._since.pop(key, None)
+        return request
+
+    def peek(self):
+        key = self._next_key()
+        if key is None:
+            return None
+        self.curprio = key
+        return super().peek()
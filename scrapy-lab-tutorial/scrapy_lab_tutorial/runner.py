@@ -0,0 +1,198 @@
+# Run several spiders in one process
+#
+# Each crawler of a CrawlerProcess normally gets its own Zyte API client,
+# with its own connection pool, and its own CONCURRENT_REQUESTS. The
+# MultiSpiderRunner shares one Zyte API client and connection pool between
+# its crawlers, and splits one in-flight request budget between them.
+#
+# Process-wide caches, such as the canonical URL and Zyte API parameter
+# caches of scrapy_lab_tutorial.fingerprint, are shared by all crawlers
+# too.
+#
+# See also the crawlmany command.
+
+import logging
+
+from scrapy import signals
+from scrapy_zyte_api.utils import USER_AGENT
+from twisted.internet import task
+from zyte_api import AsyncZyteAPI
+from zyte_api.apikey import NoApiKey
+
+from scrapy_lab_tutorial.extensions import MemoryGovernorExtension, scheduler_depth
+
+logger = logging.getLogger(__name__)
+
+
+def fair_shares(total, demands):
+    """Split *total* between the keys of *demands* (max-min fairness).
+
+    Keys asking for less than an even split get what they ask for, the
+    rest is split evenly between the others. Every key gets at least 1, even
+    if that adds up to more than *total*. What is left once every demand is
+    met is spread evenly, so that crawlers whose queues grow can ramp up
+    before the next split.
+    """
+    shares = {}
+    budget = total
+    keys = sorted(demands, key=demands.get)
+    for index, key in enumerate(keys):
+        fair = budget // (len(keys) - index)
+        shares[key] = max(min(demands[key], fair), 1)
+        budget -= shares[key]
+    if budget > 0 and keys:
+        extra, remainder = divmod(budget, len(keys))
+        for index, key in enumerate(reversed(keys)):
+            shares[key] += extra + (index < remainder)
+    return shares
+
+
+class _SharedSession:
+    # What each crawler's download handler gets from
+    # SharedZyteAPIClient.session(): all of them use the same aiohttp
+    # session, which is closed with the last handle.
+
+    def __init__(self, client):
+        self._client = client
+        self._closed = False
+
+    def __getattr__(self, name):
+        return getattr(self._client._shared_session, name)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        if not self._closed:
+            self._closed = True
+            await self._client._release_session()
+
+
+class SharedZyteAPIClient(AsyncZyteAPI):
+    """Zyte API client whose sessions share one connection pool.
+
+    Its ``n_conn`` caps the Zyte API requests in flight across all the
+    crawlers that use it.
+    """
+
+    # Sessions are not per crawler, so crawler extensions must leave them
+    # alone (see ZyteConnectionPoolExtension)
+    shared = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._shared_session = None
+        self._session_users = 0
+
+    def session(self, **kwargs):
+        if self._shared_session is None:
+            self._shared_session = super().session(**kwargs)
+        self._session_users += 1
+        return _SharedSession(self)
+
+    async def _release_session(self):
+        self._session_users -= 1
+        if self._session_users == 0 and self._shared_session is not None:
+            session, self._shared_session = self._shared_session, None
+            await session.close()
+
+
+def build_shared_client(settings, n_conn):
+    """Return a :class:`SharedZyteAPIClient` for *settings*, or None if no
+    Zyte API key is configured."""
+    kwargs = {}
+    if settings.get("ZYTE_API_KEY"):
+        kwargs["api_key"] = settings.get("ZYTE_API_KEY")
+    if settings.get("ZYTE_API_URL"):
+        kwargs["api_url"] = settings.get("ZYTE_API_URL")
+    try:
+        return SharedZyteAPIClient(n_conn=n_conn, user_agent=USER_AGENT, **kwargs)
+    except NoApiKey:
+        return None
+
+
+class MultiSpiderRunner:
+    """Run several spiders in a CrawlerProcess with shared resources.
+
+    - All crawlers use one :class:`SharedZyteAPIClient`, with one
+      connection pool of *concurrency* connections.
+    - *concurrency* requests may be in flight at any time across all
+      crawlers. Every *rebalance_interval* seconds, and whenever a spider
+      opens or closes, it is split between the open crawlers with
+      :func:`fair_shares`, by demand (scheduled plus in-flight requests),
+      through the ``total_concurrency`` of their downloaders, or through
+      the :class:`~scrapy_lab_tutorial.extensions.MemoryGovernorExtension`
+      of crawlers that have it, which scales the share down under memory
+      pressure.
+
+    *concurrency* defaults to ``CONCURRENT_REQUESTS``, and must be at least
+    1: a budget of 0 (no limit) cannot be split, and a ``total_concurrency``
+    of 0 would lift the limit of a downloader instead of pausing it.
+
+    The ``zyte_api/*`` stats of each crawler come from the shared client,
+    so they cover all crawlers.
+    """
+
+    def __init__(self, process, concurrency=None, rebalance_interval=5.0):
+        self.process = process
+        if concurrency is None:
+            concurrency = process.settings.getint("CONCURRENT_REQUESTS")
+        if concurrency < 1:
+            raise ValueError(
+                "MultiSpiderRunner needs a concurrency of at least 1, got"
+                f" {concurrency} (set CONCURRENT_REQUESTS or pass concurrency)"
+            )
+        self.concurrency = concurrency
+        self.rebalance_interval = rebalance_interval
+        self.zyte_api_client = build_shared_client(process.settings, self.concurrency)
+        if self.zyte_api_client is None:
+            logger.warning("No Zyte API key found, crawlers will not share a client")
+        self.crawlers = []
+        self.open_crawlers = []
+        self._task = None
+
+    def create_crawler(self, spidercls):
+        crawler = self.process.create_crawler(spidercls)
+        if self.zyte_api_client is not None:
+            # scrapy-zyte-api only builds a client for crawlers without one
+            crawler.zyte_api_client = self.zyte_api_client
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+        self.crawlers.append(crawler)
+        return crawler
+
+    def crawl(self, spidercls, *args, **kwargs):
+        return self.process.crawl(self.create_crawler(spidercls), *args, **kwargs)
+
+    def spider_opened(self, spider):
+        self.open_crawlers.append(spider.crawler)
+        self.rebalance()
+        if self._task is None:
+            self._task = task.LoopingCall(self.rebalance)
+            self._task.start(self.rebalance_interval, now=False)
+
+    def spider_closed(self, spider):
+        self.open_crawlers.remove(spider.crawler)
+        if self.open_crawlers:
+            self.rebalance()
+        elif self._task is not None and self._task.running:
+            self._task.stop()
+            self._task = None
+
+    def rebalance(self):
+        demands = {}
+        for crawler in self.open_crawlers:
+            downloader = crawler.engine.downloader
+            demands[crawler] = scheduler_depth(crawler.engine) + len(
+                downloader.active
+            )
+        for crawler, share in fair_shares(self.concurrency, demands).items():
+            governor = crawler.get_extension(MemoryGovernorExtension)
+            if governor is not None and governor.adjust_concurrency:
+                # Throttled for memory from its share
+                governor.set_base_concurrency(share)
+            else:
+                crawler.engine.downloader.total_concurrency = share
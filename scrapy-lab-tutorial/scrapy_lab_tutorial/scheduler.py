@@ -0,0 +1,370 @@
+# Schedulers
+#
+# See: https://docs.scrapy.org/en/latest/topics/scheduler.html
+
+import logging
+import os
+import pickle
+import struct
+import time
+
+from scrapy import Request
+from scrapy.core.scheduler import Scheduler
+from scrapy.utils.job import job_dir
+from scrapy.utils.request import request_from_dict
+from twisted.internet import task
+from twisted.internet.threads import deferToThread
+
+logger = logging.getLogger(__name__)
+
+_SNAPSHOT_MAGIC = b"CKPT1\n"
+# kind (b"+" push, b"-" done, b"=" snapshot entry), request id,
+# fingerprint size, request data size
+_RECORD_HEADER = struct.Struct(">cQHI")
+_PUSH = b"+"
+_DONE = b"-"
+_ENTRY = b"="
+
+
+def _write_record(f, kind, request_id, fp=b"", data=b""):
+    f.write(_RECORD_HEADER.pack(kind, request_id, len(fp), len(data)) + fp + data)
+
+
+def _read_records(data):
+    """Yield ``(kind, request_id, fp, data)`` records, stopping at a
+    truncated one (the process died while writing it)."""
+    offset = 0
+    end = len(data)
+    while offset + _RECORD_HEADER.size <= end:
+        kind, request_id, fp_size, data_size = _RECORD_HEADER.unpack_from(
+            data, offset
+        )
+        offset += _RECORD_HEADER.size
+        if offset + fp_size + data_size > end:
+            return
+        fp = data[offset : offset + fp_size]
+        offset += fp_size
+        yield kind, request_id, fp, data[offset : offset + data_size]
+        offset += data_size
+
+
+def _write_snapshot(path, generation, pending):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_SNAPSHOT_MAGIC)
+        f.write(generation.to_bytes(8, "big"))
+        for request_id, data in pending:
+            _write_record(f, _ENTRY, request_id, data=data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class CheckpointScheduler(Scheduler):
+    """Scheduler that checkpoints pending requests incrementally.
+
+    Instead of the ``JOBDIR`` disk queues, requests are kept in memory and
+    every scheduled request is appended to a write-ahead log in
+    ``JOBDIR/checkpoint``, together with its fingerprint. A request is
+    logged as done once the engine is finished with it: it left the
+    downloader (middlewares included) and the scraper (its callback or
+    errback ran, and the requests it returned were scheduled). Requests that
+    were in the downloader or in a callback when the process died are thus
+    scheduled again on resume, and no others. Requests carry their log id
+    in ``meta["checkpoint_id"]``. Every ``CHECKPOINT_INTERVAL`` seconds, the
+    pending requests are written to a compact snapshot in a thread and
+    older log segments are removed. The log is flushed to the OS every
+    ``CHECKPOINT_FLUSH_INTERVAL`` seconds, so a killed process redoes at
+    most that much work.
+
+    On resume, the last snapshot is loaded and the log written after it is
+    replayed. The whole request is saved, meta included, so pending Zyte
+    API requests resume with their ``zyte_api`` parameters. Fingerprints
+    from the log are added back to dupefilters that support it (see
+    :class:`~scrapy_lab_tutorial.dupefilters.BloomDupeFilter`); the stock
+    dupefilter persists its own ``JOBDIR`` state, flushed at the same
+    interval.
+
+    As with ``JOBDIR`` disk queues, callbacks and errbacks must be spider
+    methods; other requests are only kept in memory.
+
+    Without ``JOBDIR``, this scheduler behaves like the default one.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        settings = self.crawler.settings
+        jobdir = job_dir(settings)
+        self.path = os.path.join(jobdir, "checkpoint") if jobdir else None
+        self.interval = settings.getfloat("CHECKPOINT_INTERVAL", 300)
+        self.flush_interval = settings.getfloat("CHECKPOINT_FLUSH_INTERVAL", 1.0)
+        self.pending = {}
+        self.generation = 0
+        self.wal = None
+        # Requests handed to the engine: request id
+        self._in_progress = {}
+        self._method_names = {}
+        self._next_id = 0
+        self._dirty = False
+        self._last_snapshot = time.monotonic()
+        self._snapshotting = None
+        self._task = None
+
+    def _dqdir(self, jobdir):
+        # Pending requests are persisted by the checkpoint instead
+        return None
+
+    def _wal_path(self, generation):
+        return os.path.join(self.path, f"{generation:08d}.wal")
+
+    def _snapshot_path(self):
+        return os.path.join(self.path, "snapshot")
+
+    def open(self, spider):
+        result = super().open(spider)
+        if self.path is None:
+            return result
+        os.makedirs(self.path, exist_ok=True)
+        t0 = time.monotonic()
+        self._restore()
+        if self.pending:
+            logger.info(
+                "Resuming crawl from checkpoint (%(queuesize)d requests scheduled,"
+                " restored in %(seconds).2fs)",
+                {"queuesize": len(self.pending), "seconds": time.monotonic() - t0},
+                extra={"spider": spider},
+            )
+        self.wal = open(self._wal_path(self.generation), "ab", buffering=1 << 20)
+        self._task = task.LoopingCall(self._tick)
+        self._task.start(self.flush_interval, now=False)
+        return result
+
+    def _restore(self):
+        snapshot_path = self._snapshot_path()
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, "rb") as f:
+                data = f.read()
+            if data[: len(_SNAPSHOT_MAGIC)] != _SNAPSHOT_MAGIC:
+                raise ValueError(f"{snapshot_path} is not a checkpoint snapshot")
+            offset = len(_SNAPSHOT_MAGIC)
+            self.generation = int.from_bytes(data[offset : offset + 8], "big")
+            records = memoryview(data)[offset + 8 :]
+            for _, request_id, _, request_data in _read_records(records):
+                self.pending[request_id] = bytes(request_data)
+        fingerprints = []
+        last_id = max(self.pending, default=-1)
+        for name in sorted(os.listdir(self.path)):
+            if not name.endswith(".wal"):
+                continue
+            generation = int(name.split(".")[0])
+            wal_path = os.path.join(self.path, name)
+            if generation < self.generation:
+                os.remove(wal_path)
+                continue
+            self.generation = max(self.generation, generation)
+            with open(wal_path, "rb") as f:
+                data = f.read()
+            for kind, request_id, fp, request_data in _read_records(data):
+                last_id = max(last_id, request_id)
+                if kind == _PUSH:
+                    self.pending[request_id] = request_data
+                    if fp:
+                        fingerprints.append(fp)
+                else:
+                    self.pending.pop(request_id, None)
+        self._seed_dupefilter(fingerprints)
+        for request_id, request_data in self.pending.items():
+            request = request_from_dict(pickle.loads(request_data), spider=self.spider)
+            self._mqpush(request)
+        self._next_id = last_id + 1
+        self.stats.set_value("checkpoint/restored", len(self.pending))
+        # Start a new log segment, so that a truncated record at the end of
+        # the previous one is never followed by new records
+        self.generation += 1
+        self._dirty = bool(self.pending)
+
+    def _seed_dupefilter(self, fingerprints):
+        seen = getattr(self.df, "seen_fingerprint", None)
+        add = getattr(self.df, "add_fingerprint", None)
+        if seen is None or add is None:
+            return
+        for fp in fingerprints:
+            if not seen(fp):
+                add(fp)
+
+    def enqueue_request(self, request):
+        if not super().enqueue_request(request):
+            return False
+        if self.wal is not None:
+            self._log_push(request)
+        return True
+
+    def _method_name(self, func):
+        if not callable(func):
+            return func
+        try:
+            return self._method_names[func]
+        except KeyError:
+            pass
+        method = getattr(self.spider, getattr(func, "__name__", ""), None)
+        if method is None or method != func:
+            raise ValueError(
+                f"Function {func} is not an instance method in: {self.spider}"
+            )
+        self._method_names[func] = func.__name__
+        return func.__name__
+
+    def _request_to_dict(self, request):
+        # Request.to_dict(spider=...) looks callbacks up with
+        # inspect.getmembers() on every call, which is slower than the rest
+        # of the checkpointing put together.
+        d = {
+            "url": request.url,
+            "callback": self._method_name(request.callback),
+            "errback": self._method_name(request.errback),
+            "headers": dict(request.headers),
+        }
+        for attr in request.attributes:
+            d.setdefault(attr, getattr(request, attr))
+        if type(request) is not Request:
+            d["_class"] = request.__module__ + "." + request.__class__.__name__
+        return d
+
+    def _log_push(self, request):
+        request_id = self._next_id
+        request.meta["checkpoint_id"] = request_id
+        try:
+            data = pickle.dumps(
+                self._request_to_dict(request), protocol=pickle.HIGHEST_PROTOCOL
+            )
+        except (ValueError, TypeError, AttributeError, pickle.PicklingError) as e:
+            # Not the id of a child request's parent either
+            del request.meta["checkpoint_id"]
+            if self.logunser:
+                logger.warning(
+                    "Unable to serialize request: %(request)s - reason: %(reason)s"
+                    " - no more unserializable requests will be logged"
+                    " (stats being collected)",
+                    {"request": request, "reason": e},
+                    extra={"spider": self.spider},
+                )
+                self.logunser = False
+            self.stats.inc_value("scheduler/unserializable")
+            return
+        fp = b""
+        if not request.dont_filter and hasattr(self.df, "add_fingerprint"):
+            fp = self.df.fingerprinter.fingerprint(request)
+        self._next_id += 1
+        self.pending[request_id] = data
+        _write_record(self.wal, _PUSH, request_id, fp, data)
+        self._dirty = True
+
+    def next_request(self):
+        request = super().next_request()
+        if request is not None and self.wal is not None:
+            request_id = request.meta.get("checkpoint_id")
+            if request_id in self.pending:
+                self._in_progress[request] = request_id
+        return request
+
+    def _engine_busy_with(self):
+        # Scrapy sends no signal once a callback is done, and
+        # request_left_downloader is sent before downloader middlewares
+        # process the response. A request handed to the engine is instead
+        # in the downloader until its middlewares are done with it, and then
+        # in the scraper until its callback output is handled, without a gap.
+        engine = self.crawler.engine
+        busy = set(engine.downloader.active)
+        slot = engine.scraper.slot
+        if slot is not None:
+            busy.update(slot.active)
+            busy.update(request for _, request, _ in slot.queue)
+        return busy
+
+    def _log_finished(self):
+        if not self._in_progress:
+            return
+        busy = self._engine_busy_with()
+        for request in [r for r in self._in_progress if r not in busy]:
+            request_id = self._in_progress.pop(request)
+            if self.pending.pop(request_id, None) is not None:
+                _write_record(self.wal, _DONE, request_id)
+                self._dirty = True
+
+    def _tick(self):
+        self._log_finished()
+        self.wal.flush()
+        df_file = getattr(self.df, "file", None)
+        if df_file is not None and not df_file.closed:
+            df_file.flush()
+        if (
+            self._dirty
+            and self._snapshotting is None
+            and time.monotonic() - self._last_snapshot >= self.interval
+        ):
+            self._snapshotting = self.snapshot()
+
+    def snapshot(self):
+        """Write the pending requests to a new snapshot in a thread.
+
+        Returns a Deferred that fires once the snapshot is written and the
+        log segments it replaces are removed.
+        """
+        self._log_finished()
+        # Fingerprints logged before the snapshot are not replayed anymore
+        flush = getattr(self.df, "flush", None)
+        if flush is not None:
+            flush()
+        self.wal.close()
+        old_generation = self.generation
+        self.generation += 1
+        self.wal = open(self._wal_path(self.generation), "ab", buffering=1 << 20)
+        self._dirty = False
+        self._last_snapshot = time.monotonic()
+        d = deferToThread(
+            _write_snapshot,
+            self._snapshot_path(),
+            self.generation,
+            list(self.pending.items()),
+        )
+
+        def written(_):
+            self._snapshotting = None
+            self.stats.inc_value("checkpoint/snapshots")
+            for generation in range(old_generation, -1, -1):
+                path = self._wal_path(generation)
+                if not os.path.exists(path):
+                    break
+                os.remove(path)
+
+        def failed(failure):
+            self._snapshotting = None
+            self._dirty = True
+            logger.error(
+                "Could not write checkpoint snapshot: %(error)s",
+                {"error": failure.value},
+                extra={"spider": self.spider},
+            )
+
+        d.addCallbacks(written, failed)
+        return d
+
+    def close(self, reason):
+        if self.wal is None:
+            return super().close(reason)
+        self._log_finished()
+        if self._task is not None and self._task.running:
+            self._task.stop()
+        d = self._snapshotting
+        self.wal.close()
+        self.wal = None
+        if d is None:
+            return self._close_checkpoint(None, reason)
+        d.addBoth(self._close_checkpoint, reason)
+        return d
+
+    def _close_checkpoint(self, _, reason):
+        if reason == "finished":
+            for name in os.listdir(self.path):
+                os.remove(os.path.join(self.path, name))
+        return super().close(reason)
@@ -11,6 +11,7 @@ BOT_NAME = "scrapy_lab_tutorial"
 
 SPIDER_MODULES = ["scrapy_lab_tutorial.spiders"]
 NEWSPIDER_MODULE = "scrapy_lab_tutorial.spiders"
+COMMANDS_MODULE = "scrapy_lab_tutorial.commands"
 
 
 # Crawl responsibly by identifying yourself (and your website) on the user-agent
@@ -52,20 +53,95 @@ ROBOTSTXT_OBEY = False
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
 #DOWNLOADER_MIDDLEWARES = {
 #    "scrapy_lab_tutorial.middlewares.ScrapyLabTutorialDownloaderMiddleware": 543,
+#    "scrapy_lab_tutorial.middlewares.ThreadedDecodingMiddleware": 80,
+#    "scrapy_lab_tutorial.middlewares.BlockCircuitBreakerMiddleware": 560,
+#    "scrapy_lab_tutorial.middlewares.ZyteBudgetMiddleware": 600,
 #}
 
+# Decode text responses of at least this many bytes in the thread pool
+# (see ThreadedDecodingMiddleware)
+#THREADED_DECODING_MIN_SIZE = 524288
+
+# Route a domain through Zyte API once its plain responses look blocked
+# (see BlockCircuitBreakerMiddleware). The Zyte API addon below enables
+# transparent mode, which sends every request through Zyte API, so the
+# middleware also needs ZYTE_API_TRANSPARENT_MODE = False, or it disables
+# itself.
+#ZYTE_API_TRANSPARENT_MODE = False
+#CIRCUIT_BREAKER_THRESHOLD = 5
+#CIRCUIT_BREAKER_COOLDOWN = 300
+#CIRCUIT_BREAKER_PROBE_TIMEOUT = 180
+#CIRCUIT_BREAKER_BLOCK_CODES = [403, 429, 503]
+# Responses smaller than this count as blocked too (0, the default, or the
+# circuit_breaker_min_body_size spider attribute, turns this off)
+#CIRCUIT_BREAKER_MIN_BODY_SIZE = 512
+
+# Cap Zyte API usage per crawl and per domain, downgrading requests (no
+# screenshot, httpResponseBody instead of browserHtml) as budgets run low
+# (see ZyteBudgetMiddleware; 0 means no limit)
+#ZYTE_BUDGET_CALLS = 100000
+#ZYTE_BUDGET_BROWSER = 10000
+#ZYTE_BUDGET_SCREENSHOTS = 1000
+#ZYTE_BUDGET_DOMAIN_BROWSER = 2000
+#ZYTE_BUDGET_DEGRADE_AT = 0.8
+#ZYTE_BUDGET_ON_EXHAUSTED = "ignore"
+
+# Run extraction for spiders using ProcessPoolParseMixin in worker processes
+# (0 runs it inline on the reactor thread)
+#PARSE_POOL_WORKERS = 4
+#PARSE_POOL_MAX_PENDING = 16
+
+# Extract quotes with plans cached per page template
+# (see scrapy_lab_tutorial.templates.TemplateExtractor)
+#TEMPLATE_EXTRACTION = True
+
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
 #EXTENSIONS = {
 #    "scrapy.extensions.telnet.TelnetConsole": None,
+#    "scrapy_lab_tutorial.extensions.TelemetryExtension": 500,
+#    "scrapy_lab_tutorial.extensions.StructuredLoggingExtension": 0,
+#    "scrapy_lab_tutorial.extensions.ZyteConnectionPoolExtension": 500,
+#    "scrapy_lab_tutorial.extensions.MemoryGovernorExtension": 500,
 #}
 
+# Live metrics (JSON, or Prometheus at /metrics) served by TelemetryExtension
+#TELEMETRY_HOST = "127.0.0.1"
+#TELEMETRY_PORT = [6090, 6099]
+#TELEMETRY_WINDOW = 60
+
+# Write logs from a background thread (see StructuredLoggingExtension), as
+# JSON lines, with at most LOG_SAMPLING_RATE records per second of each
+# message below WARNING
+#LOG_JSON = True
+#LOG_SAMPLING_RATE = 5
+#LOG_QUEUE_SIZE = 10000
+
+# Reuse keep-alive connections to Zyte API, opening some before the crawl
+# starts (see ZyteConnectionPoolExtension)
+#ZYTE_POOL_WARM_CONNECTIONS = 8
+#ZYTE_POOL_KEEPALIVE = 60
+
+# Lower concurrency as memory nears the limit, and raise it back as memory
+# drops (see MemoryGovernorExtension)
+#MEMORY_GOVERNOR_LIMIT_MB = 3072
+#MEMORY_GOVERNOR_SOFT_RATIO = 0.8
+# Concurrency to throttle from, if CONCURRENT_REQUESTS is 0 (no limit)
+#MEMORY_GOVERNOR_BASE_CONCURRENCY = 32
+
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 #ITEM_PIPELINES = {
 #    "scrapy_lab_tutorial.pipelines.ScrapyLabTutorialPipeline": 300,
+#    "scrapy_lab_tutorial.pipelines.ValidationPipeline": 100,
 #}
 
+# Validate and normalize items against the field metadata of items.py,
+# writing rejected items to a JSON lines file (see ValidationPipeline)
+#ITEM_VALIDATION_REJECTS_FILE = "rejects.jsonl"
+# Dict items are not validated, unless checked against an item class:
+#ITEM_VALIDATION_DICT_ITEM = "scrapy_lab_tutorial.items.QuoteItem"
+
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
 #AUTOTHROTTLE_ENABLED = True
@@ -87,6 +163,33 @@ ROBOTSTXT_OBEY = False
 #HTTPCACHE_IGNORE_HTTP_CODES = []
 #HTTPCACHE_STORAGE = "scrapy.extensions.httpcache.FilesystemCacheStorage"
 
+# Keep duplicate filtering memory flat on very large crawls
+# (see scrapy_lab_tutorial.dupefilters.BloomDupeFilter)
+#DUPEFILTER_CLASS = "scrapy_lab_tutorial.dupefilters.BloomDupeFilter"
+#DUPEFILTER_BLOOM_CAPACITY = 20000000
+#DUPEFILTER_BLOOM_ERROR_RATE = 0.01
+#DUPEFILTER_BUFFER_SIZE = 250000
+#DUPEFILTER_MERGE_FACTOR = 4
+
+# Checkpoint the JOBDIR crawl state to a write-ahead log and periodic
+# snapshots instead of disk queues (see scrapy_lab_tutorial.scheduler)
+#SCHEDULER = "scrapy_lab_tutorial.scheduler.CheckpointScheduler"
+#CHECKPOINT_INTERVAL = 300
+#CHECKPOINT_FLUSH_INTERVAL = 1.0
+
+# Schedule cheap, fast requests ahead of slow browser renders
+# (see scrapy_lab_tutorial.pqueues.CostAwarePriorityQueue)
+#SCHEDULER_PRIORITY_QUEUE = "scrapy_lab_tutorial.pqueues.CostAwarePriorityQueue"
+#COST_PRIORITY_PER_SECOND = 1.0
+#COST_PRIORITY_PER_COST_UNIT = 0.5
+#COST_PRIORITY_MAX_ADJUST = 10
+#COST_PRIORITY_AGING = 1.0
+
+# Keep scheduled requests in a compact encoding, with Zyte API parameters
+# stored as profile ids (see scrapy_lab_tutorial.squeues)
+#SCHEDULER_MEMORY_QUEUE = "scrapy_lab_tutorial.squeues.CompactLifoMemoryQueue"
+#SCHEDULER_DISK_QUEUE = "scrapy_lab_tutorial.squeues.CompactLifoDiskQueue"
+
 # Set settings whose default value is deprecated to a future-proof value
 REQUEST_FINGERPRINTER_IMPLEMENTATION = "2.7"
 TWISTED_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
@@ -108,6 +211,8 @@ FEED_EXPORT_ENCODING = "utf-8"
 # 🌐 ENABLE ZYTE API (Uncomment these lines for Zyte API demo)
 ADDONS = {
     "scrapy_zyte_api.Addon": 500,
+    # Faster, memoized request fingerprints (see scrapy_lab_tutorial.fingerprint)
+    # "scrapy_lab_tutorial.fingerprint.FastFingerprintAddon": 600,
 }
 
 # 🔑 ADD YOUR ZYTE API KEY HERE
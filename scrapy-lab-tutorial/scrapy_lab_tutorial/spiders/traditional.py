@@ -13,6 +13,9 @@ import scrapy
 
 import scrapy
 
+from scrapy_lab_tutorial.items import QuoteItem
+from scrapy_lab_tutorial.templates import QUOTE_EXTRACTOR
+
 class TraditionalSpider(scrapy.Spider):
     """
     🚫 PROBLEM: Traditional spider that often gets blocked
@@ -22,22 +25,35 @@ class TraditionalSpider(scrapy.Spider):
     start_urls = [
         "https://quotes.toscrape.com/js/",  # JavaScript-rendered page
     ]
+    # 🔌 With BlockCircuitBreakerMiddleware enabled, pages without quotes
+    # count as blocked and the site gets rerouted through Zyte API
+    circuit_breaker_expect_css = 'div.quote'
 
     def parse(self, response):
-        self.logger.info(f"📄 Response length: {len(response.text)}")
+        self.logger.info("📄 Response length: %d", len(response.body))
         
         # Try to extract quotes
         quotes = response.css('div.quote')
-        self.logger.info(f"📊 Quotes found: {len(quotes)}")
+        self.logger.info("📊 Quotes found: %d", len(quotes))
         
         if len(quotes) == 0:
             self.logger.warning("⚠️  NO QUOTES FOUND - Page might be JavaScript-rendered!")
             self.logger.warning("⚠️  Or we might be getting blocked...")
         
+        if self.settings.getbool("TEMPLATE_EXTRACTION"):
+            # 🧩 Extraction plans cached per page template (see templates.py)
+            for item in QUOTE_EXTRACTOR.extract(response):
+                item['method'] = 'traditional_scrapy'
+                item['success'] = True
+                yield item
+            return
+
         for quote in quotes:
-            yield {
-                'text': quote.css('span.text::text').get(),
-                'author': quote.css('small.author::text').get(),
-                'method': 'traditional_scrapy',
-                'success': len(quotes) > 0,
-            }
+            yield QuoteItem(
+                text=quote.css('span.text::text').get(),
+                author=quote.css('small.author::text').get(),
+                tags=quote.css('a.tag::text').getall(),
+                url=response.url,
+                method='traditional_scrapy',
+                success=len(quotes) > 0,
+            )
@@ -1,7 +1,30 @@
 import scrapy
 
+from scrapy_lab_tutorial.items import QuoteItem
+from scrapy_lab_tutorial.parsepool import ProcessPoolParseMixin
+from scrapy_lab_tutorial.templates import QUOTE_EXTRACTOR
 
-class ZyteapiSolutionSpider(scrapy.Spider):
+
+def extract_quotes(response):
+    # Module-level so it can run in the parse pool (PARSE_POOL_WORKERS)
+    for quote in response.css('div.quote'):
+        yield QuoteItem(
+            text=quote.css('span.text::text').get(),
+            author=quote.css('small.author::text').get(),
+            tags=quote.css('a.tag::text').getall(),
+            url=response.url,
+            method='zyte_api_browser',
+        )
+
+
+def extract_template_quotes(response):
+    # Same, with plans cached per page template (TEMPLATE_EXTRACTION)
+    for item in QUOTE_EXTRACTOR.extract(response):
+        item['method'] = 'zyte_api_browser'
+        yield item
+
+
+class ZyteapiSolutionSpider(ProcessPoolParseMixin, scrapy.Spider):
     """
     ✅ SOLUTION: Same spider + 3 lines = works everywhere!
     Handles JavaScript, avoids blocks, more reliable
@@ -21,11 +44,14 @@ class ZyteapiSolutionSpider(scrapy.Spider):
                 }
             )
 
-    def parse(self, response):
-        self.logger.info(f"🌐 Response length: {len(response.text)}")
+    async def parse(self, response):
+        self.logger.info("🌐 Response length: %d", len(response.body))
         
-        quotes = response.css('div.quote')
-        self.logger.info(f"✅ Quotes found: {len(quotes)}")
+        extract = extract_quotes
+        if self.settings.getbool("TEMPLATE_EXTRACTION"):
+            extract = extract_template_quotes
+        quotes = await self.parse_in_pool(response, extract)
+        self.logger.info("✅ Quotes found: %d", len(quotes))
         
         if len(quotes) > 0:
             self.logger.info("🎉 SUCCESS! JavaScript rendered with browserHtml!")
@@ -33,9 +59,5 @@ class ZyteapiSolutionSpider(scrapy.Spider):
             self.logger.warning("❌ No quotes found - browserHtml might not be working")
         
         for quote in quotes:
-            yield {
-                'text': quote.css('span.text::text').get(),
-                'author': quote.css('small.author::text').get(),
-                'method': 'zyte_api_browser',
-            }
+            yield quote
 
@@ -0,0 +1,294 @@
+# Compact scheduler queues
+#
+# Scrapy's memory queues keep whole Request objects, and its disk queues
+# pickle request.to_dict() for every request, meta (and Zyte API
+# parameters) included. The queues here store common requests (GET, no
+# body, headers, cookies or callback keyword arguments, callbacks that are
+# spider methods, meta of plain Python values) as a marshal-ed tuple of URL,
+# callback and errback names, priority, dont_filter and meta, with their
+# Zyte API parameters replaced by the id of their interned ZyteProfile (see
+# scrapy_lab_tutorial.zyte). Other requests are kept as they are in memory
+# queues, and pickled in disk queues.
+#
+# Compact memory queues hold about a third of the memory of Scrapy's, but
+# rebuild each request when it is popped, so they pay off for queues of
+# hundreds of thousands of requests rather than small ones.
+#
+# Enable them with:
+#
+#     SCHEDULER_MEMORY_QUEUE = "scrapy_lab_tutorial.squeues.CompactLifoMemoryQueue"
+#     SCHEDULER_DISK_QUEUE = "scrapy_lab_tutorial.squeues.CompactLifoDiskQueue"
+#
+# (or their Fifo variants, for breadth-first crawls). The parameters of the
+# profiles in disk queues are saved to JOBDIR/zyte_profiles.jsonl.
+#
+# Queues keep the profiles of their requests alive, and let them go once
+# their last request is popped. Parameters that differ for every request
+# (echoData, jobId) are stored with the request instead of as a profile.
+
+import json
+import marshal
+import os
+import pickle
+from collections.abc import Mapping
+from pathlib import Path
+from weakref import WeakKeyDictionary
+
+from queuelib import queue
+from scrapy import Request, signals
+from scrapy.utils.job import job_dir
+from scrapy.utils.request import request_from_dict
+
+from scrapy_lab_tutorial.zyte import zyte_profile
+
+_COMPACT = b"C"
+_PICKLED = b"P"
+_ZYTE_META_KEYS = (None, "zyte_api", "zyte_api_automap")
+
+# Zyte API parameters set per request, not worth interning
+_PER_REQUEST_PARAMS = ("echoData", "jobId")
+
+_codecs = WeakKeyDictionary()
+
+
+def request_codec(crawler):
+    """Return the :class:`RequestCodec` shared by the queues of *crawler*."""
+    try:
+        return _codecs[crawler]
+    except KeyError:
+        codec = _codecs[crawler] = RequestCodec(crawler)
+        return codec
+
+
+class RequestCodec:
+    """Encode requests to, and decode them from, compact bytes.
+
+    :meth:`encode` returns None for requests that do not fit the compact
+    encoding, unless *persistent* is true, in which case they are pickled
+    (or ValueError is raised if they cannot be).
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self._method_names = {}
+        # Profile id: [profile, requests encoded with it, saved to disk]
+        self._profile_refs = {}
+        # Profiles of a previous run of the crawl, kept until it ends
+        self._loaded_profiles = {}
+        self._profiles_file = None
+        jobdir = job_dir(crawler.settings)
+        self.profiles_path = (
+            os.path.join(jobdir, "zyte_profiles.jsonl") if jobdir else None
+        )
+        if self.profiles_path and os.path.exists(self.profiles_path):
+            with open(self.profiles_path, encoding="utf-8") as f:
+                for line in f:
+                    profile = zyte_profile(json.loads(line))
+                    self._loaded_profiles[profile.id] = profile
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+
+    def spider_closed(self, spider):
+        if self._profiles_file is not None:
+            self._profiles_file.close()
+            self._profiles_file = None
+
+    def _method_name(self, func):
+        if func is None:
+            return None
+        try:
+            return self._method_names[func]
+        except KeyError:
+            pass
+        name = getattr(func, "__name__", "")
+        if getattr(self.crawler.spider, name, None) != func:
+            return False
+        self._method_names[func] = name
+        return name
+
+    def _compact(self, request, persistent):
+        if (
+            type(request) is not Request
+            or request.method != "GET"
+            or request.body
+            or request.headers
+            or request.cookies
+            or request.cb_kwargs
+            or request.flags
+            or request.encoding != "utf-8"
+        ):
+            return None
+        callback = self._method_name(request.callback)
+        errback = self._method_name(request.errback)
+        if callback is False or errback is False:
+            return None
+        meta = request.meta
+        zyte_key = 0
+        profile_id = 0
+        for index in (1, 2):
+            params = meta.get(_ZYTE_META_KEYS[index])
+            if not isinstance(params, Mapping):
+                continue
+            meta = dict(meta)
+            if any(key in params for key in _PER_REQUEST_PARAMS):
+                # Stored as part of meta
+                meta[_ZYTE_META_KEYS[index]] = dict(params)
+                break
+            try:
+                profile = zyte_profile(params)
+            except (TypeError, ValueError):
+                return None
+            del meta[_ZYTE_META_KEYS[index]]
+            zyte_key, profile_id = index, profile.id
+            break
+        try:
+            data = _COMPACT + marshal.dumps(
+                (
+                    request.url,
+                    callback,
+                    errback,
+                    request.priority,
+                    request.dont_filter,
+                    meta,
+                    zyte_key,
+                    profile_id,
+                )
+            )
+        except ValueError:
+            # Meta values that marshal does not support
+            return None
+        if zyte_key:
+            self._ref_profile(profile, persistent)
+        return data
+
+    def _ref_profile(self, profile, persistent):
+        refs = self._profile_refs.get(profile.id)
+        if refs is None:
+            refs = self._profile_refs[profile.id] = [profile, 0, False]
+        refs[1] += 1
+        if persistent and not refs[2] and profile.id not in self._loaded_profiles:
+            self._save_profile(profile)
+            refs[2] = True
+
+    def _unref_profile(self, profile_id, release):
+        refs = self._profile_refs.get(profile_id)
+        if refs is None:
+            return self._loaded_profiles.get(profile_id)
+        if not release:
+            return refs[0]
+        refs[1] -= 1
+        if refs[1] == 0:
+            del self._profile_refs[profile_id]
+        return refs[0]
+
+    def _save_profile(self, profile):
+        if self._profiles_file is None:
+            Path(self.profiles_path).parent.mkdir(parents=True, exist_ok=True)
+            self._profiles_file = open(self.profiles_path, "a", encoding="utf-8")
+        self._profiles_file.write(json.dumps(dict(profile)) + "\n")
+        self._profiles_file.flush()
+
+    def encode(self, request, persistent=False):
+        data = self._compact(request, persistent)
+        if data is not None or not persistent:
+            return data
+        try:
+            return _PICKLED + pickle.dumps(
+                request.to_dict(spider=self.crawler.spider),
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        except (pickle.PicklingError, AttributeError, TypeError) as e:
+            raise ValueError(str(e)) from e
+
+    def decode(self, data, release=True):
+        """Return the request encoded in *data*. Unless *release* is false
+        (for peeks), the request is no longer counted as queued."""
+        spider = self.crawler.spider
+        if data[:1] == _PICKLED:
+            return request_from_dict(pickle.loads(data[1:]), spider=spider)
+        (
+            url,
+            callback,
+            errback,
+            priority,
+            dont_filter,
+            meta,
+            zyte_key,
+            profile_id,
+        ) = marshal.loads(data[1:])
+        if zyte_key:
+            profile = self._unref_profile(profile_id, release)
+            if profile is None:
+                raise ValueError(f"Unknown Zyte API profile {profile_id}")
+            meta[_ZYTE_META_KEYS[zyte_key]] = profile
+        return Request(
+            url,
+            callback=getattr(spider, callback) if callback else None,
+            errback=getattr(spider, errback) if errback else None,
+            priority=priority,
+            dont_filter=dont_filter,
+            meta=meta,
+        )
+
+
+def _memory_queue(queue_class):
+    class CompactMemoryQueue(queue_class):
+        def __init__(self, crawler, *args):
+            super().__init__()
+            self.codec = request_codec(crawler)
+
+        @classmethod
+        def from_crawler(cls, crawler, *args, **kwargs):
+            return cls(crawler)
+
+        def push(self, request):
+            data = self.codec.encode(request)
+            super().push(request if data is None else data)
+
+        def pop(self):
+            obj = super().pop()
+            if isinstance(obj, bytes):
+                return self.codec.decode(obj)
+            return obj
+
+        def peek(self):
+            obj = super().peek()
+            if isinstance(obj, bytes):
+                return self.codec.decode(obj, release=False)
+            return obj
+
+    return CompactMemoryQueue
+
+
+def _disk_queue(queue_class):
+    class CompactDiskQueue(queue_class):
+        def __init__(self, crawler, key):
+            Path(key).parent.mkdir(parents=True, exist_ok=True)
+            super().__init__(key)
+            self.codec = request_codec(crawler)
+
+        @classmethod
+        def from_crawler(cls, crawler, key, *args, **kwargs):
+            return cls(crawler, key)
+
+        def push(self, request):
+            super().push(self.codec.encode(request, persistent=True))
+
+        def pop(self):
+            data = super().pop()
+            if not data:
+                return None
+            return self.codec.decode(data)
+
+        def peek(self):
+            data = super().peek()
+            if not data:
+                return None
+            return self.codec.decode(data, release=False)
+
+    return CompactDiskQueue
+
+
+CompactLifoMemoryQueue = _memory_queue(queue.LifoMemoryQueue)
+CompactFifoMemoryQueue = _memory_queue(queue.FifoMemoryQueue)
+CompactLifoDiskQueue = _disk_queue(queue.LifoDiskQueue)
+CompactFifoDiskQueue = _disk_queue(queue.FifoDiskQueue)
@@ -0,0 +1,226 @@
+# Extract quotes while the response body is being downloaded
+#
+# Normally extraction starts once the whole body is downloaded, and builds
+# the DOM of the whole page. Spiders that mix in StreamingParseMixin can
+# feed the body of plain HTTP responses, chunk by chunk as it arrives, to
+# an incremental lxml parser instead: each div.quote is turned into a
+# QuoteItem as soon as it is closed and then dropped from the tree, and the
+# download can stop once the spider has what it needs.
+#
+# Scrapy only hands items to the pipelines from callbacks, so the items
+# extracted during the download are yielded by the callback.
+#
+# Bodies arrive as sent, before HttpCompressionMiddleware decompresses them,
+# so gzip and deflate bodies (and br ones, if the brotli package is
+# installed) are decompressed as they are fed. Responses with other content
+# encodings are parsed from the callback instead.
+
+import weakref
+import zlib
+
+from lxml import etree
+from scrapy import signals
+from scrapy.exceptions import StopDownload
+from w3lib.encoding import http_content_type_encoding
+
+from scrapy_lab_tutorial.items import QuoteItem
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+    _DECOMPRESSION_ERRORS = (zlib.error,)
+else:
+    _DECOMPRESSION_ERRORS = (zlib.error, brotli.error)
+
+
+def _has_class(name):
+    return f'contains(concat(" ", normalize-space(@class), " "), " {name} ")'
+
+
+_QUOTE_TEXT = etree.XPath(f".//span[{_has_class('text')}]/text()")
+_QUOTE_AUTHOR = etree.XPath(f".//small[{_has_class('author')}]/text()")
+_QUOTE_TAGS = etree.XPath(f".//a[{_has_class('tag')}]/text()")
+
+
+class _Inflater:
+    # Incremental gzip or deflate decompression. Deflate bodies are
+    # supposed to be zlib streams, but some servers send raw deflate.
+
+    def __init__(self, wbits):
+        self.wbits = wbits
+        self.decompressor = zlib.decompressobj(wbits)
+        self.started = False
+
+    def __call__(self, data):
+        try:
+            output = self.decompressor.decompress(data)
+        except zlib.error:
+            if self.started or self.wbits != zlib.MAX_WBITS:
+                raise
+            self.wbits = -zlib.MAX_WBITS
+            self.decompressor = zlib.decompressobj(self.wbits)
+            output = self.decompressor.decompress(data)
+        self.started = True
+        return output
+
+
+def decompressor(content_encoding):
+    """Return a function that decompresses chunks of a body with
+    *content_encoding* (a Content-Encoding header value, or None), or None
+    if it is not supported."""
+    encoding = (content_encoding or "identity").strip().lower()
+    if encoding == "identity":
+        return lambda data: data
+    if encoding in ("gzip", "x-gzip"):
+        return _Inflater(16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        return _Inflater(zlib.MAX_WBITS)
+    if encoding == "br" and brotli is not None:
+        return brotli.Decompressor().process
+    return None
+
+
+class StreamingQuoteParser:
+    """Incremental parser that turns ``div.quote`` elements into items.
+
+    Feed it the body with :meth:`feed`, as many times as needed, and call
+    :meth:`close` at the end. *decompress*, if given, is applied to each
+    chunk first (see :func:`decompressor`). Items are appended to :attr:`items` as their
+    element closes. Only the elements that are still open, plus the quote
+    being parsed, are kept in memory.
+    """
+
+    def __init__(
+        self, url=None, encoding=None, required=("text", "author"), decompress=None
+    ):
+        self.url = url
+        self.decompress = decompress
+        self.required = required
+        self.items = []
+        self.complete = 0
+        self.stopped = False
+        self.parser = etree.HTMLPullParser(
+            events=("end",), tag="div", encoding=encoding
+        )
+
+    def feed(self, data):
+        if self.decompress is not None:
+            data = self.decompress(data)
+        self.parser.feed(data)
+        self._read_events()
+
+    def close(self):
+        try:
+            self.parser.close()
+        except etree.XMLSyntaxError:
+            # Nothing parsable was fed
+            return
+        self._read_events()
+
+    def _read_events(self):
+        for _, element in self.parser.read_events():
+            if "quote" not in (element.get("class") or "").split():
+                continue
+            item = self.extract(element)
+            self.items.append(item)
+            if all(item.get(field) for field in self.required):
+                self.complete += 1
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+    def extract(self, element):
+        text = _QUOTE_TEXT(element)
+        author = _QUOTE_AUTHOR(element)
+        return QuoteItem(
+            text=text[0] if text else None,
+            author=author[0] if author else None,
+            tags=_QUOTE_TAGS(element),
+            url=self.url,
+        )
+
+
+class StreamingParseMixin:
+    """Spider mixin that extracts quotes as response bodies arrive.
+
+    Enable it for all requests with the ``stream_parse`` spider attribute,
+    or for some with the ``stream_parse`` request meta key. Callbacks get
+    the items with :meth:`streamed_quotes` (or use :meth:`parse_streamed`
+    as callback). Responses that are not downloaded in chunks, such as
+    Zyte API responses or cached ones, are parsed the same way in one go
+    from the callback, without building their whole DOM.
+
+    If ``stream_parse_stop_after`` (spider attribute or request meta key)
+    is set, the download stops, and the callback gets the truncated
+    response, once that many quotes have all the ``stream_parse_required``
+    fields. Only the quotes parsed by then are returned.
+    """
+
+    stream_parse = False
+    stream_parse_required = ("text", "author")
+    stream_parse_stop_after = None
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        spider._stream_parsers = weakref.WeakKeyDictionary()
+        crawler.signals.connect(
+            spider._stream_headers_received, signal=signals.headers_received
+        )
+        crawler.signals.connect(
+            spider._stream_bytes_received, signal=signals.bytes_received
+        )
+        return spider
+
+    def _stream_headers_received(self, headers, body_length, request, spider):
+        if not request.meta.get("stream_parse", self.stream_parse):
+            return
+        content_encoding = headers.get(b"Content-Encoding")
+        decompress = decompressor(
+            content_encoding.decode("latin-1") if content_encoding else None
+        )
+        if decompress is None:
+            # Parsed from the callback, once decompressed
+            return
+        content_type = headers.get(b"Content-Type")
+        encoding = None
+        if content_type:
+            encoding = http_content_type_encoding(content_type.decode("latin-1"))
+        self._stream_parsers[request] = StreamingQuoteParser(
+            request.url, encoding, self.stream_parse_required, decompress
+        )
+
+    def _stream_bytes_received(self, data, request, spider):
+        parser = self._stream_parsers.get(request)
+        if parser is None:
+            return
+        try:
+            parser.feed(data)
+        except _DECOMPRESSION_ERRORS:
+            # Parsed from the callback instead, if decompression works there
+            del self._stream_parsers[request]
+            return
+        stop_after = request.meta.get(
+            "stream_parse_stop_after", self.stream_parse_stop_after
+        )
+        if stop_after and parser.complete >= stop_after:
+            parser.stopped = True
+            self.crawler.stats.inc_value("stream_parse/stopped_early")
+            raise StopDownload(fail=False)
+
+    def streamed_quotes(self, response):
+        """Return the quotes of *response* as a list of QuoteItems."""
+        parser = self._stream_parsers.pop(response.request, None)
+        if parser is None:
+            parser = StreamingQuoteParser(
+                response.url, response.encoding, self.stream_parse_required
+            )
+            parser.feed(response.body)
+        if not parser.stopped:
+            parser.close()
+        self.crawler.stats.inc_value("stream_parse/items", len(parser.items))
+        return parser.items
+
+    def parse_streamed(self, response):
+        yield from self.streamed_quotes(response)
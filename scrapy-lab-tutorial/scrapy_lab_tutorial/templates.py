@@ -0,0 +1,275 @@
+# Reuse extraction plans across pages that share a layout
+#
+# Large crawls fetch thousands of pages per site built from the same
+# template. TemplateExtractor runs the generic CSS selectors on the first
+# page of each template, resolves them to the positional paths of the
+# nodes they matched, and caches those paths as compiled XPath expressions.
+# Later pages of the same template are extracted with the cached plan,
+# which skips the class matching of the generic selectors and reads each
+# field of all items with a single XPath call.
+#
+# A page's template is recognized by a structural fingerprint: its host
+# and the set of tag and class pairs of its first elements, which does not
+# depend on the number of items on the page.
+#
+# Use one extractor per process (or parse pool worker), e.g.
+# QUOTE_EXTRACTOR below:
+#
+#     def parse(self, response):
+#         yield from QUOTE_EXTRACTOR.extract(response)
+#
+# The quote spiders of this project use it when TEMPLATE_EXTRACTION is
+# True.
+
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+from cssselect import HTMLTranslator
+from lxml import etree
+
+from scrapy_lab_tutorial.items import QuoteItem
+
+# Field name: (CSS selector, relative to the container; multiple values)
+QUOTE_FIELDS = {
+    "text": ("span.text", False),
+    "author": ("small.author", False),
+    "tags": ("a.tag", True),
+}
+
+
+def template_fingerprint(root, max_elements=300):
+    """Return a hash of the tag and class pairs of the first *max_elements*
+    elements of *root*."""
+    signature = set()
+    for count, element in enumerate(root.iter()):
+        if count == max_elements:
+            break
+        if isinstance(element.tag, str):
+            signature.add((element.tag, element.get("class")))
+    return hash(frozenset(signature))
+
+
+def _plain(value):
+    # lxml's "smart" strings keep their whole document alive
+    if isinstance(value, list):
+        return [str(text) for text in value]
+    return None if value is None else str(value)
+
+
+def _strip_position(step):
+    return step.rsplit("[", 1)[0] if step.endswith("]") else step
+
+
+def _class_predicate(element):
+    cls = element.get("class")
+    if cls is None:
+        return "[not(@class)]"
+    if '"' in cls:
+        return ""
+    return f'[@class="{cls}"]'
+
+
+class _Plan:
+    # Positional paths, checked against the class of the matched elements,
+    # resolved from the generic selectors on one page. Each field is
+    # extracted from all containers with one XPath call, and its text nodes
+    # are matched back to their container by walking up the (known) number
+    # of steps between them.
+
+    def __init__(self, containers, fields):
+        self.containers = etree.XPath(containers)
+        self.fields = {
+            name: (etree.XPath(f"{containers}/{path}/text()"), depth, multiple)
+            for name, (path, depth, multiple) in fields.items()
+        }
+
+    def extract(self, root):
+        containers = self.containers(root)
+        values = {container: {} for container in containers}
+        for name, (xpath, depth, multiple) in self.fields.items():
+            for container in containers:
+                values[container][name] = [] if multiple else None
+            for text in xpath(root):
+                element = text.getparent()
+                if text.is_tail:
+                    element = element.getparent()
+                for _ in range(depth):
+                    element = element.getparent()
+                container_values = values[element]
+                if multiple:
+                    container_values[name].append(text)
+                elif container_values[name] is None:
+                    container_values[name] = text
+        return list(values.values())
+
+
+class TemplateExtractor:
+    """Extract items with per-template cached plans.
+
+    *container* is the CSS selector of the element holding each item, and
+    *fields* maps item fields to ``(css, multiple)``, where *css* selects,
+    within the container, the elements whose text is the field value.
+
+    Pages of a new template are extracted with the generic selectors.
+    If the paths of the item containers differ only by position, and each
+    field has the same position (and class) within its container, a plan
+    is built, checked against the generic output and cached for the
+    template. Pages of templates without a plan, and pages on which a plan
+    finds no item or items without some *required* fields (by default, the
+    fields of *item_cls* with ``required=True`` metadata), fall back to the
+    generic selectors. If those find complete items, the plan is rebuilt.
+
+    At most *max_templates* plans are kept, the least recently used are
+    dropped first.
+    """
+
+    def __init__(
+        self,
+        container="div.quote",
+        fields=QUOTE_FIELDS,
+        item_cls=QuoteItem,
+        max_templates=1024,
+        max_elements=300,
+        required=None,
+    ):
+        translator = HTMLTranslator()
+        self.container = etree.XPath(translator.css_to_xpath(container))
+        self.fields = {}
+        for name, (css, multiple) in fields.items():
+            xpath = translator.css_to_xpath(css)
+            self.fields[name] = (
+                etree.XPath(xpath),
+                etree.XPath(xpath + "/text()"),
+                multiple,
+            )
+        self.item_cls = item_cls
+        if required is None:
+            item_fields = getattr(item_cls, "fields", {})
+            required = [
+                name
+                for name in self.fields
+                if item_fields.get(name, {}).get("required")
+            ]
+        self.required = tuple(required)
+        self.max_templates = max_templates
+        self.max_elements = max_elements
+        self.plans = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def extract(self, response):
+        """Return the items of *response* as a list."""
+        root = response.selector.root
+        key = (
+            urlsplit(response.url).hostname,
+            template_fingerprint(root, self.max_elements),
+        )
+        known = key in self.plans
+        plan = self.plans.get(key)
+        if known:
+            self.plans.move_to_end(key)
+        plan_values = None
+        if plan is not None:
+            plan_values = plan.extract(root)
+            if plan_values and self._complete(plan_values):
+                self.hits += 1
+                return self._items(response.url, plan_values)
+            if plan_values:
+                self.stale += 1
+        self.misses += 1
+        values = self.extract_generic(root)
+        # Build a plan for new templates, and rebuild it when the layout of
+        # a known template changed: the plan found nothing, or incomplete
+        # items where the generic selectors find complete ones
+        if not known or (
+            plan is not None
+            and values
+            and (not plan_values or self._complete(values))
+        ):
+            self.plans[key] = self.build_plan(root, values)
+            if len(self.plans) > self.max_templates:
+                self.plans.popitem(last=False)
+        return self._items(response.url, values)
+
+    def _items(self, url, values):
+        return [
+            self.item_cls(url=url, **{name: _plain(value) for name, value in v.items()})
+            for v in values
+        ]
+
+    def _complete(self, values):
+        return all(v[name] for v in values for name in self.required)
+
+    def extract_generic(self, root):
+        return [self._values(container) for container in self.container(root)]
+
+    def _values(self, container):
+        values = {}
+        for name, (_, xpath, multiple) in self.fields.items():
+            texts = xpath(container)
+            values[name] = texts if multiple else (texts[0] if texts else None)
+        return values
+
+    def build_plan(self, root, values):
+        """Return a plan for the template of *root*, or None (which is
+        cached too) if its items are not laid out regularly.
+
+        *values* is the generic output for *root*, to check the plan
+        against.
+        """
+        tree = root.getroottree()
+        containers = self.container(root)
+        if not containers:
+            return None
+        classes = {container.get("class") for container in containers}
+        containers_path = self._common_path(
+            [tree.getpath(container) for container in containers]
+        )
+        if containers_path is None or len(classes) != 1:
+            return None
+        containers_path += _class_predicate(containers[0])
+        fields = {}
+        for name, (xpath, _, multiple) in self.fields.items():
+            paths = set()
+            for container in containers:
+                prefix = len(tree.getpath(container)) + 1
+                for element in xpath(container):
+                    path = tree.getpath(element)[prefix:]
+                    if multiple:
+                        path = _strip_position(path)
+                    paths.add((path, _class_predicate(element)))
+            if len(paths) > 1:
+                return None
+            if paths:
+                path, predicate = paths.pop()
+                fields[name] = (path + predicate, path.count("/") + 1, multiple)
+            else:
+                # A field found in no container is never found by the plan
+                fields[name] = ("*[false()]", 1, multiple)
+        plan = _Plan(containers_path, fields)
+        if plan.extract(root) != values:
+            return None
+        return plan
+
+    def _common_path(self, paths):
+        # Generalize the container paths into one that matches them all, by
+        # dropping the positions of the steps where they differ, and of the
+        # container step itself so that pages with more items match too.
+        steps = [path.split("/") for path in paths]
+        if len({len(path_steps) for path_steps in steps}) != 1:
+            return None
+        common = []
+        for index, step in enumerate(zip(*steps)):
+            if len(set(step)) == 1 and index < len(steps[0]) - 1:
+                common.append(step[0])
+                continue
+            step = {_strip_position(s) for s in step}
+            if len(step) != 1:
+                return None
+            common.append(step.pop())
+        return "/".join(common)
+
+
+# Shared by the quote spiders of a process (see TEMPLATE_EXTRACTION)
+QUOTE_EXTRACTOR = TemplateExtractor()
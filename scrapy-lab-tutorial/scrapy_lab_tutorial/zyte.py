@@ -0,0 +1,145 @@
+# Helpers to tell how a request will be sent through Zyte API
+#
+# scrapy-zyte-api decides this from the request meta:
+#
+# - meta["zyte_api"]          → manual mode, parameters given explicitly
+# - meta["zyte_api_automap"]  → automap mode (True or extra parameters)
+# - neither, with ZYTE_API_TRANSPARENT_MODE → transparent mode
+#
+# Setting meta["zyte_api_automap"] to False sends the request without
+# Zyte API, even in transparent mode.
+
+import hashlib
+import json
+from collections.abc import Mapping
+from weakref import WeakValueDictionary
+
+ZYTE_MODES = ("manual", "automap", "transparent")
+
+
+def transparent_mode(settings):
+    """Return True if requests without Zyte API meta still go through it."""
+    return settings.getbool("ZYTE_API_ENABLED", True) and settings.getbool(
+        "ZYTE_API_TRANSPARENT_MODE"
+    )
+
+
+def zyte_mode(request, transparent=False):
+    """Return ``"manual"``, ``"automap"``, ``"transparent"`` or ``None``
+    (plain Scrapy download) for *request*."""
+    if request.meta.get("zyte_api"):
+        return "manual"
+    automap = request.meta.get("zyte_api_automap")
+    if automap:
+        return "automap"
+    if transparent and automap is None:
+        return "transparent"
+    return None
+
+
+def zyte_params(request):
+    """Return the Zyte API parameters set explicitly on *request*.
+
+    Automap and transparent requests get the rest of their parameters from
+    the request itself, so only the explicit overrides are returned.
+    """
+    params = request.meta.get("zyte_api")
+    if isinstance(params, Mapping):
+        return params
+    params = request.meta.get("zyte_api_automap")
+    if isinstance(params, Mapping):
+        return params
+    return {}
+
+
+def request_profile(request, transparent=False):
+    """Return a short name for the kind of download *request* triggers.
+
+    ``"plain"`` (no Zyte API), ``"http"`` (HTTP-only Zyte API request) or
+    ``"browser"``, followed by ``"+screenshot"`` and ``"+actions"`` when
+    those are requested.
+    """
+    if zyte_mode(request, transparent) is None:
+        return "plain"
+    params = zyte_params(request)
+    if not (
+        params.get("browserHtml") or params.get("screenshot") or params.get("actions")
+    ):
+        return "http"
+    parts = ["browser"]
+    if params.get("screenshot"):
+        parts.append("screenshot")
+    if params.get("actions"):
+        parts.append("actions")
+    return "+".join(parts)
+
+
+# Interned profiles, by their canonical JSON, for as long as something else
+# (requests, scheduler queues) references them
+_profiles = WeakValueDictionary()
+
+
+class ZyteProfile(Mapping):
+    """Immutable, interned set of Zyte API parameters.
+
+    Build them with :func:`zyte_profile`, and use them as
+    ``meta["zyte_api"]`` or ``meta["zyte_api_automap"]``: requests with the
+    same parameters then share one object, and scheduler queues (see
+    :mod:`scrapy_lab_tutorial.squeues`) store its :attr:`id` instead of the
+    parameters. Copies (which scrapy-zyte-api makes before merging default
+    parameters) are plain dicts.
+
+    Nested values are not copied, so do not change them either.
+    """
+
+    __slots__ = ("_params", "id", "_hash", "__weakref__")
+
+    def __init__(self, params, canonical):
+        self._params = params
+        # Stable across processes, so it can be stored in JOBDIR queues
+        self.id = int.from_bytes(
+            hashlib.blake2b(canonical.encode(), digest_size=8).digest(), "big"
+        )
+        self._hash = hash(canonical)
+
+    def __getitem__(self, key):
+        return self._params[key]
+
+    def __iter__(self):
+        return iter(self._params)
+
+    def __len__(self):
+        return len(self._params)
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if isinstance(other, ZyteProfile):
+            return self is other
+        return super().__eq__(other)
+
+    def __repr__(self):
+        return f"ZyteProfile({self._params!r})"
+
+    def __copy__(self):
+        return dict(self._params)
+
+    def __reduce__(self):
+        return zyte_profile, (self._params,)
+
+
+def zyte_profile(params):
+    """Return the interned :class:`ZyteProfile` of *params* (a mapping of
+    JSON-serializable Zyte API parameters).
+
+    Profiles are forgotten once nothing references them, so parameters that
+    differ for every request do not pile up.
+    """
+    if isinstance(params, ZyteProfile):
+        return params
+    canonical = json.dumps(params, sort_keys=True, separators=(",", ":"))
+    profile = _profiles.get(canonical)
+    if profile is None:
+        profile = _profiles[canonical] = ZyteProfile(dict(params), canonical)
+    return profile
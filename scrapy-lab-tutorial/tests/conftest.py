@@ -0,0 +1,142 @@
+import multiprocessing
+import threading
+import traceback
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+# Settings of the crawls run by the crawl fixture, instead of the project's
+CRAWL_SETTINGS = {
+    "TWISTED_REACTOR": "twisted.internet.asyncioreactor.AsyncioSelectorReactor",
+    "LOG_LEVEL": "WARNING",
+    "TELNETCONSOLE_ENABLED": False,
+    "ROBOTSTXT_OBEY": False,
+}
+
+
+def _crawl(queue, spidercls, settings, kwargs):
+    # Runs in a child process: a Twisted reactor can only run once per
+    # process.
+    try:
+        from itemadapter import ItemAdapter
+        from scrapy import signals
+        from scrapy.crawler import CrawlerProcess
+
+        items = []
+
+        def item_scraped(item, response, spider):
+            items.append(ItemAdapter(item).asdict())
+
+        process = CrawlerProcess({**CRAWL_SETTINGS, **settings})
+        crawler = process.create_crawler(spidercls)
+        crawler.signals.connect(item_scraped, signal=signals.item_scraped)
+        process.crawl(crawler, **kwargs)
+        process.start()
+        queue.put((items, crawler.stats.get_stats(), None))
+    except BaseException:
+        queue.put(([], {}, traceback.format_exc()))
+
+
+@pytest.fixture
+def crawl():
+    """Return a function that runs a crawl of a spider class (defined at
+    module level) in a child process, and returns its items and stats."""
+
+    def run(spidercls, settings=None, timeout=120, **kwargs):
+        context = multiprocessing.get_context("spawn")
+        queue = context.Queue()
+        process = context.Process(
+            target=_crawl, args=(queue, spidercls, settings or {}, kwargs)
+        )
+        process.start()
+        try:
+            items, stats, error = queue.get(timeout=timeout)
+        finally:
+            process.join(timeout)
+            if process.is_alive():
+                process.kill()
+        if error is not None:
+            pytest.fail(f"Crawl of {spidercls.__name__} failed:\n{error}")
+        return items, stats
+
+    return run
+
+
+class Site:
+    """Local HTTP server serving ``pages`` (path: (status, headers, body)),
+    counting the requests of each path in ``hits``, and the connections
+    opened to it in ``connections``.
+
+    Pages can also be callables, which get the request handler (with the
+    request body in its ``body`` attribute) and return a page. With
+    *ssl_context*, the server speaks HTTPS.
+    """
+
+    def __init__(self, pages, ssl_context=None):
+        self.pages = pages
+        self.hits = Counter()
+        self.connections = 0
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive connections
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                site.connections += 1
+                super().setup()
+
+            def do_GET(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                self.body = self.rfile.read(length)
+                path = self.path
+                site.hits[path] += 1
+                page = site.pages.get(path)
+                if callable(page):
+                    page = page(self)
+                status, headers, body = page or (404, {}, b"Not found")
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_POST = do_GET
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        scheme = "http"
+        if ssl_context is not None:
+            self.server.socket = ssl_context.wrap_socket(
+                self.server.socket, server_side=True
+            )
+            scheme = "https"
+        self.url = f"{scheme}://127.0.0.1:{self.server.server_port}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def site():
+    """Return a function that starts a :class:`Site` for the given pages."""
+    sites = []
+
+    def start(pages, ssl_context=None):
+        server = Site(pages, ssl_context).__enter__()
+        sites.append(server)
+        return server
+
+    yield start
+    for server in sites:
+        server.__exit__(None, None, None)
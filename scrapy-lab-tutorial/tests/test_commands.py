@@ -0,0 +1,111 @@
+import asyncio
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+from scrapy.utils.test import get_crawler
+
+from scrapy_lab_tutorial.commands.benchparse import (
+    Command,
+    _response,
+    build_corpus,
+    run_callback,
+    spider_callbacks,
+)
+from scrapy_lab_tutorial.spiders.traditional import TraditionalSpider
+from scrapy_lab_tutorial.spiders.zyteapi_solution import ZyteapiSolutionSpider
+
+PROJECT_DIR = Path(__file__).parent.parent
+
+
+def _spider(spidercls):
+    return spidercls.from_crawler(get_crawler(spidercls))
+
+
+def test_corpus():
+    corpus = build_corpus(2)
+    assert corpus == build_corpus(2)
+    assert set(corpus) == {"static", "js", "rendered", "large", "pathological"}
+    assert all(len(pages) == 2 for pages in corpus.values())
+    spider = _spider(TraditionalSpider)
+    loop = asyncio.new_event_loop()
+    try:
+        counts = {
+            kind: len(run_callback(loop, spider.parse, _response(url, body, kind)))
+            for kind, [(url, body), _] in corpus.items()
+        }
+    finally:
+        loop.close()
+    # No quotes in the raw HTML of JS pages
+    assert counts == {
+        "static": 10,
+        "js": 0,
+        "rendered": 10,
+        "large": 2000,
+        "pathological": 0,
+    }
+
+
+def test_spider_callbacks():
+    spider = _spider(ZyteapiSolutionSpider)
+    assert [name for name, _ in spider_callbacks(spider)] == ["parse"]
+
+
+def test_compare():
+    previous = {
+        "us_per_page": 100.0,
+        "kib_per_page": 10.0,
+        "blocks_per_page": 50.0,
+        "items_per_page": 10.0,
+    }
+    result = {**previous, "us_per_page": 120.0, "items_per_second": 1.0}
+    assert list(Command().compare("a.parse static", result, previous, 0.25)) == []
+    result = {**result, "us_per_page": 130.0, "items_per_page": 9.0}
+    assert list(Command().compare("a.parse static", result, previous, 0.25)) == [
+        "a.parse static: us_per_page 130.0 > 125.0 (baseline 100.0)",
+        "a.parse static: items_per_page 9.0 != 10.0",
+    ]
+
+
+def _benchparse(*args):
+    return subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "scrapy",
+            "benchparse",
+            "--pages=1",
+            "--repeat=1",
+            "--callback=traditional.parse",
+            *args,
+        ],
+        cwd=PROJECT_DIR,
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+
+
+def test_benchparse_baseline(tmp_path):
+    path = tmp_path / "baseline.json"
+    result = _benchparse(f"--save-baseline={path}")
+    assert result.returncode == 0, result.stderr
+    baseline = json.loads(path.read_text())
+    assert sorted(baseline) == [
+        f"traditional.parse {kind}"
+        for kind in ("js", "large", "pathological", "rendered", "static")
+    ]
+    assert baseline["traditional.parse static"]["items_per_page"] == 10
+    # Generous enough not to fail on a busy machine
+    assert _benchparse(f"--baseline={path}", "--tolerance=100").returncode == 0
+    baseline["traditional.parse static"]["us_per_page"] /= 1000
+    baseline["traditional.parse gone"] = baseline["traditional.parse js"]
+    path.write_text(json.dumps(baseline))
+    result = _benchparse(f"--baseline={path}", "--tolerance=100")
+    assert result.returncode == 1
+    regressions = result.stdout.split("Regressions:")[1]
+    assert "traditional.parse static: us_per_page" in regressions
+    assert "traditional.parse gone: in the baseline, but not benchmarked" in (
+        regressions
+    )
@@ -0,0 +1,169 @@
+import hashlib
+import os
+
+import pytest
+import scrapy
+
+from scrapy_lab_tutorial.dupefilters import (
+    BloomDupeFilter,
+    BloomFilter,
+    SortedRun,
+    _merge_runs,
+)
+
+
+def _fp(i):
+    return hashlib.sha1(str(i).encode()).digest()
+
+
+def test_bloom_filter_has_no_false_negatives(tmp_path):
+    bloom = BloomFilter.for_capacity(10_000, 0.01)
+    for i in range(10_000):
+        bloom.add(_fp(i))
+    assert all(_fp(i) in bloom for i in range(10_000))
+    false_positives = sum(_fp(i) in bloom for i in range(10_000, 20_000))
+    assert false_positives < 300
+
+    bloom.save(tmp_path / "bloom")
+    loaded = BloomFilter.load(tmp_path / "bloom")
+    assert loaded.bits == bloom.bits
+    assert all(_fp(i) in loaded for i in range(10_000))
+
+
+def test_bloom_filter_short_fingerprints():
+    bloom = BloomFilter.for_capacity(100, 0.01)
+    bloom.add(b"abc")
+    assert b"abc" in bloom
+    assert b"abd" not in bloom
+
+
+def test_sorted_run(tmp_path):
+    fps = sorted(_fp(i) for i in range(1000))
+    run = SortedRun.write(str(tmp_path / "0.run"), 20, sorted(fps + fps[:10]))
+    assert len(run) == 1000
+    assert list(run) == fps
+    assert all(fp in run for fp in fps)
+    assert _fp(1000) not in run
+    assert not os.path.exists(tmp_path / "0.run.tmp")
+    run.close()
+
+
+def test_sorted_run_empty(tmp_path):
+    run = SortedRun.write(str(tmp_path / "0.run"), 20, [])
+    assert len(run) == 0
+    assert _fp(0) not in run
+    assert list(run) == []
+    run.close()
+
+
+def test_merge_runs(tmp_path):
+    paths = []
+    for i in range(3):
+        path = str(tmp_path / f"{i}.run")
+        SortedRun.write(path, 20, sorted(_fp(j) for j in range(i * 50, i * 50 + 100)))
+        paths.append(path)
+    _merge_runs(paths, str(tmp_path / "3.run"), 20)
+    merged = SortedRun(str(tmp_path / "3.run"))
+    assert list(merged) == sorted(_fp(j) for j in range(200))
+    merged.close()
+
+
+def _filter(path, **kwargs):
+    return BloomDupeFilter(
+        str(path), capacity=10_000, buffer_size=10, merge_factor=2, **kwargs
+    )
+
+
+def test_merge_candidates_are_runs_of_one_tier(tmp_path):
+    df = _filter(tmp_path)
+    # Keep flushes from merging, to check the candidates directly
+    df._maybe_compact = lambda: None
+    for i in range(30):
+        df.add_fingerprint(_fp(i))
+    assert [len(run) for run in df.runs] == [10, 10, 10]
+    assert df.merge_candidates() == df.runs[:2]
+
+    big = SortedRun.write(df._run_path(), 20, sorted(_fp(i) for i in range(100, 130)))
+    df.runs.insert(0, big)
+    assert df.tier(big) == 2
+    assert df.merge_candidates() == df.runs[1:3]
+    df.runs = [big, df.runs[-1]]
+    assert df.merge_candidates() is None
+    df.close("finished")
+
+
+def test_buffered_fingerprints_survive_a_crash(tmp_path):
+    df = _filter(tmp_path)
+    df._maybe_compact = lambda: None
+    for i in range(15):
+        df.add_fingerprint(_fp(i))
+    assert len(df.runs) == 1
+    assert len(df.buffer) == 5
+    # Crash: the buffer file is flushed, the filter is not closed
+    df.file.flush()
+
+    resumed = _filter(tmp_path)
+    assert all(resumed.seen_fingerprint(_fp(i)) for i in range(15))
+    assert not resumed.seen_fingerprint(_fp(15))
+    resumed.close("finished")
+
+
+def test_filter_without_jobdir(tmp_path):
+    df = BloomDupeFilter(capacity=1000, buffer_size=10)
+    request = scrapy.Request("https://example.com")
+    assert not df.request_seen(request)
+    assert df.request_seen(request.replace())
+    assert df.file is None
+    path = df.path
+    df.close("finished")
+    assert not os.path.exists(path)
+
+
+def _page(index):
+    links = "".join(
+        f'<a href="/{child}">{child}</a>'
+        for child in range(index * 3 + 1, index * 3 + 4)
+        if child < 300
+    )
+    return 200, {"Content-Type": "text/html"}, f"<html>{links}</html>".encode()
+
+
+class _PagesSpider(scrapy.Spider):
+    name = "dupefilter_test"
+
+    async def start(self):
+        yield scrapy.Request(self.base_url + "/0")
+
+    def parse(self, response):
+        yield {"page": int(response.url.rsplit("/", 1)[1])}
+        # Every page also links back to the start page, a dupe
+        yield from response.follow_all(css="a")
+        yield response.follow("/0")
+
+
+def test_crawl_merges_runs_by_tier(crawl, site, tmp_path):
+    server = site({f"/{i}": _page(i) for i in range(300)})
+    jobdir = tmp_path / "job"
+    items, stats = crawl(
+        _PagesSpider,
+        {
+            "JOBDIR": str(jobdir),
+            "DUPEFILTER_CLASS": "scrapy_lab_tutorial.dupefilters.BloomDupeFilter",
+            "DUPEFILTER_BUFFER_SIZE": 8,
+            "DUPEFILTER_MERGE_FACTOR": 2,
+        },
+        base_url=server.url,
+    )
+    assert stats["finish_reason"] == "finished"
+    assert sorted(item["page"] for item in items) == list(range(300))
+    assert max(server.hits.values()) == 1
+
+    path = jobdir / "bloomdupefilter"
+    names = os.listdir(path)
+    assert not [name for name in names if name.endswith(".tmp")]
+    df = BloomDupeFilter(str(path), buffer_size=8, merge_factor=2)
+    # All 300 fingerprints ended up in runs of distinct tiers
+    assert sum(len(run) for run in df.runs) == 300
+    tiers = [df.tier(run) for run in df.runs]
+    assert len(tiers) == len(set(tiers)) < 300 // 8
+    df.close("finished")
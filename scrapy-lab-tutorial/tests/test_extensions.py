@@ -0,0 +1,257 @@
+import base64
+import datetime
+import ipaddress
+import json
+import ssl
+from types import SimpleNamespace
+
+import pytest
+import scrapy
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.test import get_crawler
+
+from scrapy_lab_tutorial import extensions
+from scrapy_lab_tutorial.extensions import (
+    MemoryGovernorExtension,
+    RollingCounter,
+    TelemetryExtension,
+    ZyteConnectionPoolExtension,
+)
+from scrapy_lab_tutorial.runner import SharedZyteAPIClient
+
+
+@pytest.fixture
+def tls(tmp_path):
+    """Return a server SSL context for 127.0.0.1, and the path of the
+    self-signed certificate to trust."""
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "127.0.0.1")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    ip = x509.IPAddress(ipaddress.ip_address("127.0.0.1"))
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(hours=1))
+        .not_valid_after(now + datetime.timedelta(hours=1))
+        .add_extension(x509.SubjectAlternativeName([ip]), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), True)
+        .sign(key, hashes.SHA256())
+    )
+    cert_path = tmp_path / "cert.pem"
+    key_path = tmp_path / "key.pem"
+    cert_path.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+    key_path.write_bytes(
+        key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        )
+    )
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert_path, key_path)
+    return context, str(cert_path)
+
+
+def _extract(handler):
+    # Zyte API stand-in: echo a page with the requested URL
+    url = json.loads(handler.body)["url"]
+    body = f"<html><p>{url}</p></html>".encode()
+    response = {
+        "url": url,
+        "statusCode": 200,
+        "httpResponseBody": base64.b64encode(body).decode(),
+    }
+    return 200, {"Content-Type": "application/json"}, json.dumps(response).encode()
+
+
+class _ZyteSpider(scrapy.Spider):
+    name = "zyte_pool_test"
+
+    async def start(self):
+        for index in range(20):
+            yield scrapy.Request(
+                f"https://example.com/{index}", meta={"zyte_api_automap": True}
+            )
+
+    def parse(self, response):
+        yield {"url": response.url}
+
+
+def test_warm_up_against_tls_stand_in(crawl, site, tls):
+    context, ca_file = tls
+    server = site(
+        {"/": (200, {}, b"Zyte API"), "/extract": _extract}, ssl_context=context
+    )
+    items, stats = crawl(
+        _ZyteSpider,
+        {
+            "ADDONS": {"scrapy_zyte_api.Addon": 500},
+            "ZYTE_API_KEY": "a",
+            "ZYTE_API_URL": server.url + "/",
+            "ZYTE_API_TRANSPARENT_MODE": False,
+            "EXTENSIONS": {
+                "scrapy_lab_tutorial.extensions.ZyteConnectionPoolExtension": 500
+            },
+            "CONCURRENT_REQUESTS": 4,
+            "CONCURRENT_REQUESTS_PER_DOMAIN": 4,
+            "ZYTE_POOL_WARM_CONNECTIONS": 3,
+            "ZYTE_POOL_CA_FILE": ca_file,
+        },
+    )
+    assert len(items) == 20
+    assert stats["zyte_pool/warmed"] == 3
+    assert server.hits["/"] == 3
+    assert server.hits["/extract"] == 20
+    # Warm-up connections are counted, and reused by the crawl
+    assert stats["zyte_pool/connections_created"] == server.connections
+    assert server.connections <= 4
+    assert stats["zyte_pool/connections_reused"] >= 20 - 1
+    assert stats["zyte_pool/reuse_ratio"] > 0.8
+
+
+def test_shared_client_is_left_alone():
+    crawler = get_crawler(settings_dict={"ZYTE_API_KEY": "a"})
+    client = SharedZyteAPIClient(api_key="a", n_conn=2)
+    session = client.session
+    crawler.zyte_api_client = client
+    ext = ZyteConnectionPoolExtension.from_crawler(crawler)
+    assert ext.engine_started() is None
+    assert client.session == session
+    assert ext.connector is None
+
+
+MB = 1024 * 1024
+
+
+def _engine(total_concurrency=8, max_active_size=5_000_000):
+    return SimpleNamespace(
+        downloader=SimpleNamespace(total_concurrency=total_concurrency, active=set()),
+        scraper=SimpleNamespace(
+            slot=SimpleNamespace(max_active_size=max_active_size, active_size=0)
+        ),
+        slot=None,
+    )
+
+
+@pytest.fixture
+def rss(monkeypatch):
+    value = SimpleNamespace(mb=0)
+    monkeypatch.setattr(extensions, "get_rss", lambda: value.mb * MB)
+    return value
+
+
+def _governor(settings=None, **engine_kwargs):
+    settings = {"MEMORY_GOVERNOR_LIMIT_MB": 100, **(settings or {})}
+    crawler = get_crawler(settings_dict=settings)
+    crawler.engine = _engine(**engine_kwargs)
+    return MemoryGovernorExtension.from_crawler(crawler), crawler.engine
+
+
+def test_governor_throttles_and_ramps_up(rss):
+    governor, engine = _governor(total_concurrency=20)
+    rss.mb = 50
+    governor.check()
+    assert engine.downloader.total_concurrency == 20
+    # Halfway between the soft limit (80MiB) and the limit
+    rss.mb = 90
+    governor.check()
+    assert engine.downloader.total_concurrency == 10
+    assert engine.scraper.slot.max_active_size == 2_500_000
+    rss.mb = 100
+    governor.check()
+    assert engine.downloader.total_concurrency == 1
+    rss.mb = 50
+    # Back up in steps of a tenth of the base concurrency
+    for expected in (3, 5, 7):
+        governor.check()
+        assert engine.downloader.total_concurrency == expected
+    stats = governor.stats
+    assert stats.get_value("memory_governor/throttled") == 1
+    assert stats.get_value("memory_governor/concurrency_min") == 1
+    assert stats.get_value("memory_governor/rss_max") == 100 * MB
+
+
+def test_governor_scales_base_concurrency(rss):
+    governor, engine = _governor(total_concurrency=20)
+    rss.mb = 90
+    governor.check()
+    assert engine.downloader.total_concurrency == 10
+    governor.set_base_concurrency(6)
+    assert engine.downloader.total_concurrency == 3
+    governor.check()
+    assert engine.downloader.total_concurrency == 3
+    rss.mb = 50
+    governor.check()
+    assert engine.downloader.total_concurrency == 4
+    governor.set_base_concurrency(1)
+    assert engine.downloader.total_concurrency == 1
+
+
+def test_governor_without_concurrency_limit(rss):
+    governor, engine = _governor(
+        {"CONCURRENT_REQUESTS": 0}, total_concurrency=0, max_active_size=1000
+    )
+    assert not governor.adjust_concurrency
+    rss.mb = 95
+    governor.check()
+    assert engine.downloader.total_concurrency == 0
+    assert engine.scraper.slot.max_active_size == 250
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(
+        extensions, "time", SimpleNamespace(monotonic=lambda: clock.now)
+    )
+    return clock
+
+
+def test_rolling_counter_rate(clock):
+    counter = RollingCounter(10)
+    counter.inc(4)
+    # Less than a second in: counted over one second, not the window
+    assert counter.rate() == 4
+    clock.now += 4
+    counter.inc(4)
+    assert counter.rate() == 2
+    clock.now += 6
+    counter.inc(2)
+    # The first bucket left the window
+    assert counter.rate() == 0.6
+    clock.now += 100
+    assert counter.rate() == 0
+
+
+def test_rolling_counter_window_is_validated():
+    with pytest.raises(ValueError):
+        RollingCounter(0)
+    crawler = get_crawler(settings_dict={"TELEMETRY_WINDOW": 0})
+    with pytest.raises(NotConfigured, match="TELEMETRY_WINDOW"):
+        TelemetryExtension.from_crawler(crawler)
+
+
+def test_prometheus_labels_are_escaped():
+    telemetry = TelemetryExtension.from_crawler(get_crawler())
+    snapshot = {
+        "spider": 'a\\b"c\nd',
+        "pages_per_second": 1.5,
+        "items_per_second": 0,
+        "scheduler_queue_depth": 3,
+        "in_flight": {"plain": 2},
+        "reactor_lag_seconds": 0.001,
+        "memory_rss_bytes": 100,
+    }
+    lines = telemetry.to_prometheus(snapshot).splitlines()
+    assert 'scrapy_pages_per_second{spider="a\\\\b\\"c\\nd"} 1.5' in lines
+    assert (
+        'scrapy_in_flight_requests{spider="a\\\\b\\"c\\nd",mode="plain"} 2' in lines
+    )
+    assert len(lines) == 18
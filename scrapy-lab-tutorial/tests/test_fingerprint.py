@@ -0,0 +1,80 @@
+import pytest
+import scrapy
+from scrapy.utils.test import get_crawler
+from w3lib.url import canonicalize_url
+
+from scrapy_lab_tutorial.fingerprint import (
+    FastRequestFingerprinter,
+    _simple_canonical_url,
+)
+
+
+@pytest.fixture
+def fingerprinter():
+    crawler = get_crawler(settings_dict={"ZYTE_API_TRANSPARENT_MODE": False})
+    return FastRequestFingerprinter.from_crawler(crawler)
+
+
+def _fp(fingerprinter, url="https://example.com/a", **zyte_api):
+    meta = {"zyte_api": zyte_api} if zyte_api else {}
+    return fingerprinter.fingerprint(scrapy.Request(url, meta=meta))
+
+
+def test_parameter_values_of_equal_but_different_types(fingerprinter):
+    fps = {
+        _fp(fingerprinter, geolocation=value) for value in (1, True, 1.0, "1", [1])
+    }
+    assert len(fps) == 5
+    # Also when nested, and whichever is seen first
+    first, second = ([{"action": "wait", "timeout": value}] for value in (True, 1))
+    assert _fp(fingerprinter, actions=first) != _fp(fingerprinter, actions=second)
+    assert _fp(fingerprinter, geolocation=True) == _fp(fingerprinter, geolocation=True)
+
+
+def test_parameters_are_canonical(fingerprinter):
+    a = _fp(fingerprinter, browserHtml=True, geolocation="IE", echoData="a")
+    b = _fp(fingerprinter, geolocation="IE", browserHtml=True, echoData="b")
+    assert a == b
+    assert a != _fp(fingerprinter, browserHtml=True)
+    # Zyte API requests are not duplicates of plain ones
+    assert _fp(fingerprinter, httpResponseBody=True) != _fp(fingerprinter)
+
+
+def test_urls_are_canonical(fingerprinter):
+    url = "https://example.com/a?b=2&a=1"
+    sorted_url = "https://example.com/a?a=1&b=2"
+    assert _fp(fingerprinter, url) == _fp(fingerprinter, sorted_url)
+    # Fragments only matter to browser requests
+    assert _fp(fingerprinter, url + "#x") == _fp(fingerprinter, url)
+    assert _fp(fingerprinter, url + "#x", browserHtml=True) != _fp(
+        fingerprinter, url, browserHtml=True
+    )
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "https://example.com/",
+        "https://example.com/a/b?z=1&a=2&a=1",
+        "http://example.com:8080/a-b_c.~d?x=",
+        "https://example.com/a b",
+        "https://example.com/./a",
+        "https://Example.com/a",
+        "https://example.com/a?q=%41",
+    ],
+)
+def test_simple_canonical_url(url):
+    canonical = _simple_canonical_url(url)
+    assert canonical is None or canonical == canonicalize_url(url)
+
+
+def test_fingerprint_url_matches_requests(fingerprinter):
+    meta = {"zyte_api_automap": {"browserHtml": True}}
+    request = scrapy.Request("https://example.com/a#b", meta=meta)
+    assert fingerprinter.fingerprint_url(request.url, meta) == (
+        fingerprinter.fingerprint(request)
+    )
+    post = scrapy.Request("https://example.com/a", method="POST", body=b"x")
+    assert fingerprinter.fingerprint_url(post.url, method="POST", body=b"x") == (
+        fingerprinter.fingerprint(post)
+    )
@@ -0,0 +1,114 @@
+import logging
+from types import SimpleNamespace
+
+import pytest
+import scrapy
+from scrapy.dupefilters import RFPDupeFilter
+from scrapy.http import HtmlResponse
+from scrapy.utils.request import RequestFingerprinter
+from scrapy.utils.test import get_crawler
+
+from scrapy_lab_tutorial.dupefilters import BloomDupeFilter
+from scrapy_lab_tutorial.fingerprint import FastRequestFingerprinter
+from scrapy_lab_tutorial.links import BatchFollowMixin, LinkResolver
+
+BODY = b"""<html><body>
+<a href="/page/1">1</a> <a href="/page/2">2</a> <a href="page/3">3</a>
+<a href="/page/1">1 again</a> <a href="mailto:a@example.com">mail</a>
+</body></html>"""
+
+
+class _Spider(BatchFollowMixin, scrapy.Spider):
+    name = "links_test"
+
+
+def _spider(dupefilter):
+    crawler = get_crawler(_Spider)
+    spider = _Spider.from_crawler(crawler)
+    crawler.spider = spider
+    scheduler = SimpleNamespace(df=dupefilter)
+    crawler.engine = SimpleNamespace(_slot=SimpleNamespace(scheduler=scheduler))
+    return spider
+
+
+def _response():
+    return HtmlResponse("https://example.com/list/", body=BODY, encoding="utf-8")
+
+
+@pytest.fixture(params=[FastRequestFingerprinter, RequestFingerprinter])
+def bloom_dupefilter(request):
+    dupefilter = BloomDupeFilter(
+        fingerprinter=request.param(get_crawler()), capacity=1000
+    )
+    yield dupefilter
+    dupefilter.close("finished")
+
+
+def test_resolver_caches_per_host_and_page():
+    resolver = LinkResolver()
+    hrefs = ["/a", "b", " /a ", "javascript:void(0)"]
+    assert resolver.resolve("https://example.com/x/", hrefs) == [
+        "https://example.com/a",
+        "https://example.com/x/b",
+        "https://example.com/a",
+    ]
+    assert resolver.resolve("https://example.com/y/", ["/a", "b"]) == [
+        "https://example.com/a",
+        "https://example.com/y/b",
+    ]
+    assert resolver.hits == 2
+
+
+def test_links_seen_by_the_dupefilter_are_dropped(bloom_dupefilter):
+    spider = _spider(bloom_dupefilter)
+    requests = spider.follow_links(_response())
+    assert [request.url for request in requests] == [
+        "https://example.com/page/1",
+        "https://example.com/page/2",
+        "https://example.com/list/page/3",
+    ]
+    assert not bloom_dupefilter.request_seen(requests[0])
+    assert [request.url for request in spider.follow_links(_response())] == [
+        "https://example.com/page/2",
+        "https://example.com/list/page/3",
+    ]
+    stats = spider.crawler.stats
+    assert stats.get_value("links/extracted") == 10
+    assert stats.get_value("links/seen") == 1
+    assert stats.get_value("links/followed") == 5
+
+
+def test_requests_with_a_body_are_checked_as_built(bloom_dupefilter):
+    spider = _spider(bloom_dupefilter)
+    post = spider.follow_links(_response(), method="POST", body="q=1")
+    assert len(post) == 3
+    assert not bloom_dupefilter.request_seen(post[0])
+    # The GET request of the same URL has another fingerprint
+    assert len(spider.follow_links(_response())) == 3
+    assert len(spider.follow_links(_response(), method="POST", body="q=1")) == 2
+
+
+def test_dont_filter_follows_every_distinct_link(bloom_dupefilter):
+    spider = _spider(bloom_dupefilter)
+    for request in spider.follow_links(_response()):
+        bloom_dupefilter.request_seen(request)
+    requests = spider.follow_links(_response(), dont_filter=True)
+    assert len(requests) == 3
+    assert all(request.dont_filter for request in requests)
+
+
+def test_default_dupefilter_only_dedups_within_the_page(caplog):
+    dupefilter = RFPDupeFilter(fingerprinter=RequestFingerprinter(get_crawler()))
+    spider = _spider(dupefilter)
+    with caplog.at_level(logging.INFO, logger="scrapy_lab_tutorial.links"):
+        requests = spider.follow_links(_response())
+        assert not dupefilter.request_seen(requests[0])
+        assert len(spider.follow_links(_response())) == 3
+    assert len(caplog.records) == 1
+    assert "RFPDupeFilter" in caplog.records[0].getMessage()
+    assert spider.crawler.stats.get_value("links/seen") is None
+
+
+def test_outside_a_crawl():
+    spider = _Spider.from_crawler(scrapy.crawler.Crawler(_Spider))
+    assert len(spider.follow_links(_response())) == 3
@@ -0,0 +1,126 @@
+import json
+import logging
+import queue
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+from scrapy_lab_tutorial import log
+from scrapy_lab_tutorial.log import (
+    DeferredQueueHandler,
+    JsonFormatter,
+    QueueLogging,
+    SamplingFilter,
+)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(log, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def _record(level=logging.INFO, lineno=10, args=(1,), exc_info=None, **extra):
+    record = logging.LogRecord(
+        "quotes", level, "spider.py", lineno, "Found %d quotes", args, exc_info
+    )
+    record.__dict__.update(extra)
+    return record
+
+
+def test_sampling_filter_rate(clock):
+    sampling = SamplingFilter(rate=2)
+    passed = [sampling.filter(_record(args=(i,))) for i in range(5)]
+    assert passed == [True, True, False, False, False]
+    # Another line is another message, and warnings always pass
+    assert sampling.filter(_record(lineno=11))
+    assert sampling.filter(_record(level=logging.WARNING))
+    clock.now += 0.5
+    record = _record()
+    assert sampling.filter(record)
+    assert record.sampled_dropped == 3
+    assert not sampling.filter(_record())
+    assert sampling.dropped == 4
+
+
+def test_sampling_filter_forgets_least_recent_messages(clock):
+    sampling = SamplingFilter(rate=1, max_messages=2)
+    for lineno in (1, 2, 1, 3):
+        sampling.filter(_record(lineno=lineno))
+    assert [key[3] for key in sampling.buckets] == [1, 3]
+    # Line 1 is still limited, line 2 starts over
+    assert not sampling.filter(_record(lineno=1))
+    assert sampling.filter(_record(lineno=2))
+
+
+def test_json_formatter():
+    spider = SimpleNamespace(name="quotes")
+    record = _record(spider=spider, page=2, response=object(), sampled_dropped=3)
+    data = json.loads(JsonFormatter().format(record))
+    assert data["message"] == "Found 1 quotes"
+    assert data["level"] == "INFO"
+    assert data["logger"] == "quotes"
+    assert data["spider"] == "quotes"
+    assert data["page"] == 2
+    assert data["response"].startswith("<object object")
+    assert data["sampled_dropped"] == 3
+    assert "exc_info" not in data
+    try:
+        raise ValueError("déjà vu")
+    except ValueError:
+        record = _record(exc_info=sys.exc_info())
+    line = JsonFormatter().format(record)
+    assert "\n" not in line
+    assert "ValueError: déjà vu" in json.loads(line)["exc_info"]
+
+
+def test_deferred_queue_handler_drops_records_when_full():
+    handler = DeferredQueueHandler(queue.Queue(1))
+    first, second = _record(), _record()
+    handler.handle(first)
+    handler.handle(second)
+    assert handler.dropped == 1
+    queued = handler.queue.get_nowait()
+    # Not formatted yet
+    assert queued is first
+    assert queued.args == (1,)
+
+
+class _ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+@pytest.fixture
+def root_handlers():
+    handlers = logging.root.handlers[:]
+    level = logging.root.level
+    logging.root.handlers = [_ListHandler()]
+    logging.root.setLevel(logging.INFO)
+    yield logging.root.handlers[0]
+    logging.root.handlers = handlers
+    logging.root.setLevel(level)
+
+
+def test_queue_logging(root_handlers):
+    logging_queue = QueueLogging(formatter=JsonFormatter())
+    logging_queue.start()
+    logging_queue.start()
+    assert logging_queue.handler in logging.root.handlers
+    assert root_handlers not in logging.root.handlers
+    logging.getLogger("quotes").info("Found %d quotes", 3)
+    logging_queue.stop()
+    assert root_handlers not in logging.root.handlers
+    logging_queue.stop()
+    # Drained, and the output handler is back
+    assert logging_queue.handler not in logging.root.handlers
+    assert root_handlers in logging.root.handlers
+    assert [json.loads(line)["message"] for line in root_handlers.lines] == [
+        "Found 3 quotes"
+    ]
@@ -0,0 +1,299 @@
+import asyncio
+import gzip
+import hashlib
+from types import SimpleNamespace
+
+import pytest
+import scrapy
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http import HtmlResponse, TextResponse
+from scrapy.utils.test import get_crawler
+
+from scrapy_lab_tutorial.middlewares import (
+    BlockCircuitBreakerMiddleware,
+    ZyteBudgetMiddleware,
+)
+
+TEXT = "Déjà vu – “quoted” ✓ " * 40_000
+
+QUOTES = b'<html><div class="quote">' + b"x" * 1000 + b"</div></html>"
+
+
+class _Spider(scrapy.Spider):
+    name = "middlewares_test"
+    circuit_breaker_expect_css = "div.quote"
+
+
+def _spider(spidercls=_Spider, settings=None):
+    crawler = get_crawler(spidercls, settings)
+    spider = spidercls.from_crawler(crawler)
+    crawler.spider = spider
+    return spider
+
+
+def _circuit_breaker(spider, **settings):
+    settings_dict = {"ZYTE_API_TRANSPARENT_MODE": False, "CIRCUIT_BREAKER_THRESHOLD": 2}
+    for name, value in settings.items():
+        settings_dict[f"CIRCUIT_BREAKER_{name.upper()}"] = value
+    crawler = get_crawler(type(spider), settings_dict)
+    return BlockCircuitBreakerMiddleware.from_crawler(crawler)
+
+
+def _response(request, status=200, body=QUOTES):
+    return HtmlResponse(request.url, status=status, body=body, request=request)
+
+
+def _fetch(mw, spider, url="https://example.com/", **kwargs):
+    request = scrapy.Request(url)
+    assert mw.process_request(request, spider) is None
+    return request, mw.process_response(request, _response(request, **kwargs), spider)
+
+
+def test_circuit_opens_after_blocked_responses():
+    spider = _spider()
+    mw = _circuit_breaker(spider)
+    _, response = _fetch(mw, spider, status=403)
+    assert response.status == 403
+    # Not quotes: blocked too, and the second in a row
+    _, retry = _fetch(mw, spider, body=b"<html>Captcha</html>")
+    assert isinstance(retry, scrapy.Request)
+    assert retry.meta["zyte_api_automap"] is True
+    assert retry.dont_filter
+    request = scrapy.Request("https://example.com/next")
+    mw.process_request(request, spider)
+    assert request.meta["zyte_api_automap"] is True
+    # Other domains and Zyte API requests are left alone
+    _, response = _fetch(mw, spider, "https://other.example/", status=403)
+    assert response.status == 403
+    request = scrapy.Request("https://example.com/", meta={"zyte_api": {"a": 1}})
+    mw.process_request(request, spider)
+    assert "zyte_api_automap" not in request.meta
+    stats = mw.stats
+    assert stats.get_value("circuit_breaker/opened") == 1
+    assert stats.get_value("circuit_breaker/rerouted") == 1
+    assert stats.get_value("circuit_breaker/retried") == 1
+
+
+class _SizeSpider(_Spider):
+    circuit_breaker_min_body_size = 512
+
+
+def test_small_bodies_are_blocked_only_when_opted_in():
+    small = b'<html><div class="quote">Short</div></html>'
+    spider = _spider()
+    mw = _circuit_breaker(spider, threshold=1)
+    _fetch(mw, spider, body=small)
+    assert mw.circuits["example.com"].state == "closed"
+
+    spider = _spider(_SizeSpider)
+    mw = _circuit_breaker(spider, threshold=1)
+    _, retry = _fetch(mw, spider, body=small)
+    assert isinstance(retry, scrapy.Request)
+    assert mw.circuits["example.com"].state == "open"
+
+
+def _open_circuit(mw, spider):
+    _fetch(mw, spider, status=503)
+    _fetch(mw, spider, status=503)
+    assert mw.circuits["example.com"].state == "open"
+
+
+def test_probe_closes_circuit():
+    async def run():
+        spider = _spider()
+        mw = _circuit_breaker(spider, cooldown=0, probe_timeout=60)
+        _open_circuit(mw, spider)
+        request, response = _fetch(mw, spider)
+        assert response.status == 200
+        assert request.meta["circuit_breaker_probe"] == "example.com"
+        assert "zyte_api_automap" not in request.meta
+        circuit = mw.circuits["example.com"]
+        assert circuit.state == "closed"
+        assert circuit.probe_timer is None
+
+    asyncio.run(run())
+
+
+def test_lost_probe_reopens_circuit_without_more_requests():
+    async def run():
+        spider = _spider()
+        mw = _circuit_breaker(spider, cooldown=0, probe_timeout=0.05)
+        _open_circuit(mw, spider)
+        probe = scrapy.Request("https://example.com/probe")
+        mw.process_request(probe, spider)
+        circuit = mw.circuits["example.com"]
+        assert circuit.state == "half-open"
+        await asyncio.sleep(0.1)
+        assert circuit.state == "open"
+        assert not circuit.probing
+        assert mw.stats.get_value("circuit_breaker/probes_lost") == 1
+        # The next request probes again
+        request = scrapy.Request("https://example.com/next")
+        mw.process_request(request, spider)
+        assert request.meta["circuit_breaker_probe"] == "example.com"
+        mw.process_exception(request, TimeoutError(), spider)
+        assert circuit.state == "open"
+        assert circuit.probe_timer is None
+        assert mw.stats.get_value("circuit_breaker/probes_failed") == 1
+
+    asyncio.run(run())
+
+
+def test_disabled_in_transparent_mode():
+    crawler = get_crawler(_Spider, {"ZYTE_API_TRANSPARENT_MODE": True})
+    with pytest.raises(NotConfigured):
+        BlockCircuitBreakerMiddleware.from_crawler(crawler)
+
+
+DECODING_PAGES = {
+    "/utf8": (200, {"Content-Type": "text/html; charset=utf-8"}, TEXT.encode()),
+    "/meta": (
+        200,
+        {"Content-Type": "text/html"},
+        b'<meta charset="cp1252">' + TEXT.encode("cp1252", "replace"),
+    ),
+    "/bom": (200, {"Content-Type": "text/html"}, TEXT.encode("utf-16")),
+    "/gzip": (
+        200,
+        {"Content-Type": "text/html; charset=utf-8", "Content-Encoding": "gzip"},
+        gzip.compress(TEXT.encode()),
+    ),
+    "/json": (200, {"Content-Type": "application/json"}, b'{"a": "\xc3\xa9"}'),
+    "/image": (200, {"Content-Type": "image/png"}, b"\x89PNG" + b"\x00" * 1000),
+}
+
+
+class _DecodingSpider(scrapy.Spider):
+    name = "decoding_test"
+
+    async def start(self):
+        for path in DECODING_PAGES:
+            yield scrapy.Request(self.base_url + path)
+
+    def parse(self, response):
+        path = response.url.rsplit("/", 1)[1]
+        item = {"path": path, "class": type(response).__name__}
+        if isinstance(response, TextResponse):
+            item["encoding"] = response.encoding
+            item["text"] = hashlib.sha1(response.text.encode()).hexdigest()
+        yield item
+
+
+def _decoded(crawl, site, settings):
+    server = site(DECODING_PAGES)
+    items, stats = crawl(_DecodingSpider, settings, base_url=server.url)
+    return sorted(items, key=lambda item: item["path"]), stats
+
+
+def test_threaded_decoding_matches_reactor_thread_decoding(crawl, site):
+    expected, _ = _decoded(crawl, site, {})
+    middleware = "scrapy_lab_tutorial.middlewares.ThreadedDecodingMiddleware"
+    items, stats = _decoded(
+        crawl,
+        site,
+        {"DOWNLOADER_MIDDLEWARES": {middleware: 80}, "THREADED_DECODING_MIN_SIZE": 0},
+    )
+    assert items == expected
+    assert len(items) == 6
+    text_responses = [item for item in items if "text" in item]
+    assert stats["threaded_decoding/count"] == len(text_responses)
+    items, stats = _decoded(crawl, site, {"DOWNLOADER_MIDDLEWARES": {middleware: 80}})
+    assert items == expected
+    # Only the bodies of at least 512 KiB, once decompressed
+    assert stats["threaded_decoding/count"] == 4
+
+
+BROWSER = {"browserHtml": True, "actions": [{"action": "scrollBottom"}]}
+
+
+def _budget(spider, **settings):
+    settings_dict = {"ZYTE_API_TRANSPARENT_MODE": False}
+    for name, value in settings.items():
+        settings_dict[f"ZYTE_BUDGET_{name.upper()}"] = value
+    crawler = get_crawler(type(spider), settings_dict)
+    return ZyteBudgetMiddleware.from_crawler(crawler)
+
+
+def _zyte_request(mw, spider, url="https://example.com/", **params):
+    request = scrapy.Request(url, meta={"zyte_api": params or dict(BROWSER)})
+    mw.process_request(request, spider)
+    return request
+
+
+def test_budget_is_a_hard_cap():
+    spider = _spider()
+    mw = _budget(spider, calls=3)
+    for _ in range(3):
+        _zyte_request(mw, spider)
+    with pytest.raises(IgnoreRequest):
+        _zyte_request(mw, spider)
+    # Plain requests do not count
+    assert mw.process_request(scrapy.Request("https://example.com/"), spider) is None
+    assert mw.used["calls"] == 3
+    assert mw.stats.get_value("zyte_budget/calls") == 3
+    assert mw.stats.get_value("zyte_budget/exhausted/calls") == 1
+
+
+def test_domain_budget():
+    spider = _spider()
+    mw = _budget(spider, domain_browser=1)
+    _zyte_request(mw, spider)
+    with pytest.raises(IgnoreRequest):
+        _zyte_request(mw, spider)
+    # HTTP requests do not use the browser budget, nor other domains
+    _zyte_request(mw, spider, httpResponseBody=True)
+    _zyte_request(mw, spider, "https://other.example/")
+    assert mw.used == {"calls": 3, "browser": 2, "screenshots": 0}
+
+
+class _FallbackSpider(_Spider):
+    zyte_budget_http_fallback = True
+
+
+def test_low_budget_degrades_requests():
+    spider = _spider(_FallbackSpider)
+    mw = _budget(spider, browser=5, screenshots=5)
+    shared = {"browserHtml": True, "screenshot": True}
+    for _ in range(4):
+        assert _zyte_request(mw, spider, **shared).meta["zyte_api"] == shared
+    # 80% of both budgets used: no screenshot, and no browser
+    request = _zyte_request(mw, spider, **shared)
+    assert request.meta["zyte_api"] == {
+        "httpResponseBody": True,
+        "httpResponseHeaders": True,
+    }
+    assert shared == {"browserHtml": True, "screenshot": True}
+    # Requests that cannot fall back get what is left
+    request = scrapy.Request(
+        "https://example.com/",
+        meta={"zyte_api": dict(BROWSER), "zyte_budget_http_fallback": False},
+    )
+    mw.process_request(request, spider)
+    assert request.meta["zyte_api"] == BROWSER
+    with pytest.raises(IgnoreRequest):
+        mw.process_request(request.replace(), spider)
+    assert mw.used["browser"] == 5
+    assert mw.stats.get_value("zyte_budget/degraded/screenshot") == 1
+    assert mw.stats.get_value("zyte_budget/degraded/browser") == 1
+
+
+def test_exhausted_budget_closes_the_spider():
+    spider = _spider()
+    mw = _budget(spider, calls=1, on_exhausted="close")
+    closed = []
+    mw.crawler.engine = SimpleNamespace(
+        close_spider=lambda spider, reason: closed.append(reason)
+    )
+    _zyte_request(mw, spider)
+    for _ in range(2):
+        with pytest.raises(IgnoreRequest):
+            _zyte_request(mw, spider)
+    assert closed == ["zyte_budget_exhausted"]
+
+
+def test_budget_settings_are_validated():
+    crawler = get_crawler(_Spider, {"ZYTE_API_TRANSPARENT_MODE": False})
+    with pytest.raises(NotConfigured):
+        ZyteBudgetMiddleware.from_crawler(crawler)
+    with pytest.raises(NotConfigured, match="ZYTE_BUDGET_ON_EXHAUSTED"):
+        _budget(_spider(), calls=1, on_exhausted="stop")
@@ -0,0 +1,80 @@
+import asyncio
+import os
+
+import pytest
+import scrapy
+from scrapy import signals
+from scrapy.http import HtmlResponse
+from scrapy.link import Link
+from scrapy.utils.test import get_crawler
+
+from scrapy_lab_tutorial.parsepool import ProcessPoolParseMixin
+
+PAGES = 12
+
+
+def _page(index):
+    children = [child for child in (index * 2 + 1, index * 2 + 2) if child < PAGES]
+    links = "".join(f'<a href="/{child}">{child}</a>' for child in children)
+    body = f'<html><p class="n">{index}</p>{links}</html>'.encode()
+    return 200, {"Content-Type": "text/html"}, body
+
+
+def extract_page(response):
+    # Module level, so it can be sent to the pool workers
+    yield {
+        "page": int(response.css("p.n::text").get()),
+        "pid": os.getpid(),
+    }
+    for href in response.css("a::attr(href)").getall():
+        yield Link(response.urljoin(href))
+
+
+class _PoolSpider(ProcessPoolParseMixin, scrapy.Spider):
+    name = "parsepool_test"
+
+    async def start(self):
+        yield scrapy.Request(self.base_url + "/0")
+
+    async def parse(self, response):
+        for result in await self.parse_in_pool(response, extract_page):
+            if isinstance(result, dict):
+                result["crawler_pid"] = os.getpid()
+            yield result
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_parse_in_pool(crawl, site, workers):
+    server = site({f"/{i}": _page(i) for i in range(PAGES)})
+    items, stats = crawl(
+        _PoolSpider,
+        {"PARSE_POOL_WORKERS": workers, "PARSE_POOL_MAX_PENDING": 1},
+        base_url=server.url,
+    )
+    assert stats["finish_reason"] == "finished"
+    # Links became requests to the spider's parse method
+    assert sorted(item["page"] for item in items) == list(range(PAGES))
+    in_crawler = {item["pid"] == item["crawler_pid"] for item in items}
+    assert in_crawler == {workers == 0}
+
+
+def test_pool_is_shut_down_when_the_spider_closes():
+    async def run():
+        crawler = get_crawler(_PoolSpider, {"PARSE_POOL_WORKERS": 1})
+        spider = _PoolSpider.from_crawler(crawler)
+        response = HtmlResponse(
+            "https://example.com/0", body=_page(0)[2], encoding="utf-8"
+        )
+        results = await spider.parse_in_pool(response, extract_page)
+        assert results[0]["page"] == 0
+        assert isinstance(results[1], scrapy.Request)
+        assert results[1].callback is None
+        pool = spider._parse_pool
+        await crawler.signals.send_catch_log_async(
+            signals.spider_closed, spider=spider, reason="finished"
+        )
+        assert spider._parse_pool is None
+        with pytest.raises(RuntimeError):
+            pool.submit(os.getpid)
+
+    asyncio.run(run())
@@ -0,0 +1,83 @@
+import json
+
+import pytest
+from scrapy.exceptions import DropItem
+from scrapy.http import HtmlResponse
+from scrapy.utils.test import get_crawler
+
+from scrapy_lab_tutorial.items import QuoteItem
+from scrapy_lab_tutorial.pipelines import ValidationPipeline
+from scrapy_lab_tutorial.spiders.traditional import TraditionalSpider
+from scrapy_lab_tutorial.spiders.zyteapi_solution import extract_quotes
+
+QUOTES = (
+    '<div class="quote"><span class="text">“Café \n  au lait”'
+    '</span><small class="author"> Ada </small><a class="tag"> drinks </a></div>'
+    '<div class="quote"><small class="author">Nobody</small></div>'
+).encode()
+
+
+def _pipeline(settings=None):
+    pipeline = ValidationPipeline.from_crawler(get_crawler(settings_dict=settings))
+    pipeline.open_spider()
+    return pipeline
+
+
+@pytest.fixture
+def rejects_path(tmp_path):
+    return tmp_path / "rejects.jsonl"
+
+
+@pytest.fixture
+def pipeline(rejects_path):
+    pipeline = _pipeline({"ITEM_VALIDATION_REJECTS_FILE": str(rejects_path)})
+    yield pipeline
+    pipeline.close_spider()
+
+
+def test_item_is_normalized_per_field(pipeline):
+    item = QuoteItem(text=" “Café\t au\nlait” ", author=["Ada", "x"])
+    assert pipeline.process_item(item) is item
+    assert item["text"] == "Café au lait"
+    assert item["author"] == "Ada"
+    assert item["tags"] == []
+    assert "url" not in item
+
+
+def test_values_containing_nul_are_normalized(pipeline):
+    item = QuoteItem(text="a\x00b  c", author="A\u0301", tags=("x\x00", 1))
+    pipeline.process_item(item)
+    assert item["text"] == "a\x00b c"
+    assert item["author"] == "\u00c1"
+    assert item["tags"] == ["x\x00", 1]
+
+
+def test_invalid_item_is_dropped_and_logged(pipeline, rejects_path):
+    with pytest.raises(DropItem, match="missing text"):
+        pipeline.process_item(QuoteItem(text="  ", author="Ada"))
+    pipeline.close_spider()
+    reject = json.loads(rejects_path.read_text(encoding="utf-8"))
+    item = {"text": "", "author": "Ada", "tags": []}
+    assert reject == {"reason": "missing text", "item": item}
+    assert pipeline.stats.get_value("item_validation/rejected") == 1
+
+
+def test_dict_items(pipeline):
+    item = {"text": ""}
+    assert pipeline.process_item(item) is item
+    checked = _pipeline({"ITEM_VALIDATION_DICT_ITEM": QuoteItem})
+    with pytest.raises(DropItem):
+        checked.process_item({"text": ""})
+    item = {"text": " a ", "author": "b"}
+    assert checked.process_item(item)["text"] == "a"
+
+
+def test_spider_items_are_validated(pipeline):
+    response = HtmlResponse("https://quotes.example", body=QUOTES, encoding="utf-8")
+    spider = TraditionalSpider.from_crawler(get_crawler(TraditionalSpider))
+    for items in (list(spider.parse(response)), list(extract_quotes(response))):
+        assert all(isinstance(item, QuoteItem) for item in items)
+        assert pipeline.process_item(items[0])["text"] == "Café au lait"
+        assert items[0]["tags"] == ["drinks"]
+        with pytest.raises(DropItem, match="missing text"):
+            pipeline.process_item(items[1])
@@ -0,0 +1,91 @@
+from types import SimpleNamespace
+
+import pytest
+import scrapy
+from scrapy.squeues import FifoMemoryQueue
+from scrapy.utils.test import get_crawler
+
+from scrapy_lab_tutorial import pqueues
+from scrapy_lab_tutorial.pqueues import CostAwarePriorityQueue
+
+BROWSER = {"zyte_api": {"browserHtml": True}}
+HTTP = {"zyte_api": {"httpResponseBody": True}}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(pqueues, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def _queue(**settings):
+    settings_dict = {"ZYTE_API_TRANSPARENT_MODE": False}
+    for name, value in settings.items():
+        settings_dict[f"COST_PRIORITY_{name.upper()}"] = value
+    crawler = get_crawler(settings_dict=settings_dict)
+    return CostAwarePriorityQueue(crawler, FifoMemoryQueue, "")
+
+
+def _request(name, meta=None, priority=0):
+    return scrapy.Request(f"https://example.com/{name}", meta=meta, priority=priority)
+
+
+def _pop_all(queue):
+    urls = []
+    while (request := queue.pop()) is not None:
+        urls.append(request.url.rsplit("/", 1)[1])
+    return urls
+
+
+def test_cheap_requests_go_first(clock):
+    queue = _queue(aging=0)
+    queue.push(_request("browser", BROWSER))
+    queue.push(_request("http", HTTP))
+    queue.push(_request("plain"))
+    # Explicit priorities beyond COST_PRIORITY_MAX_ADJUST still win
+    queue.push(_request("urgent", BROWSER, priority=20))
+    queue.push(_request("low", priority=-20))
+    assert len(queue) == 5
+    assert _pop_all(queue) == ["urgent", "plain", "http", "browser", "low"]
+    assert len(queue) == 0
+
+
+def test_penalties_follow_observed_latency(clock):
+    queue = _queue(aging=0)
+    plain, browser = _request("plain"), _request("browser", BROWSER)
+    assert queue.adjustment(plain) < queue.adjustment(browser)
+    for latency in (30, 30):
+        request = _request("plain", {"download_latency": latency})
+        queue.response_received(None, request, None)
+    assert queue.expected_latency("plain") == 30
+    assert queue.adjustment(plain) == queue.max_adjust
+    queue.response_received(None, _request("plain", {"download_latency": 0}), None)
+    assert queue.expected_latency("plain") == 24
+
+
+def test_expensive_requests_age_into_the_flow(clock):
+    queue = _queue()
+    browser = _request("browser", BROWSER)
+    # browserHtml: 6 seconds and 5 cost units, rounded down to 8
+    assert queue.adjustment(browser) == 8
+    queue.push(browser)
+    for i in range(20):
+        queue.push(_request(f"plain{i}"))
+    order = []
+    for _ in range(12):
+        order.append(queue.pop().url.rsplit("/", 1)[1])
+        clock.now += 1
+    # After 8 seconds of waiting, the penalty is gone
+    assert order.index("browser") == 8
+    assert order[:8] == [f"plain{i}" for i in range(8)]
+
+
+def test_peek_matches_pop(clock):
+    queue = _queue()
+    queue.push(_request("browser", BROWSER))
+    queue.push(_request("plain"))
+    while queue:
+        assert queue.peek() is queue.pop()
+        clock.now += 10
+    assert queue.peek() is None
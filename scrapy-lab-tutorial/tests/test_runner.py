@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+
+import pytest
+from scrapy.settings import Settings
+
+from scrapy_lab_tutorial.extensions import MemoryGovernorExtension
+from scrapy_lab_tutorial.runner import MultiSpiderRunner, fair_shares
+
+
+@pytest.mark.parametrize(
+    ("total", "demands", "shares"),
+    [
+        # Small demands are met, the rest is split evenly
+        (10, {"a": 2, "b": 20, "c": 20}, {"a": 2, "b": 4, "c": 4}),
+        # What is left over is spread evenly, the biggest demands first
+        (10, {"a": 1, "b": 1}, {"a": 5, "b": 5}),
+        (7, {"a": 0, "b": 3}, {"a": 2, "b": 5}),
+        # Every key gets at least 1
+        (2, {"a": 5, "b": 5, "c": 5}, {"a": 1, "b": 1, "c": 1}),
+        (5, {}, {}),
+    ],
+)
+def test_fair_shares(total, demands, shares):
+    assert fair_shares(total, demands) == shares
+
+
+def test_fair_shares_add_up_to_total():
+    demands = {key: key * 7 % 23 for key in range(10)}
+    shares = fair_shares(50, demands)
+    assert sum(shares.values()) == 50
+    assert all(shares[key] >= min(demands[key], 1) for key in demands)
+
+
+class _Governor(MemoryGovernorExtension):
+    def __init__(self):
+        self.adjust_concurrency = True
+        self.bases = []
+
+    def set_base_concurrency(self, concurrency):
+        self.bases.append(concurrency)
+
+
+class _Crawler:
+    def __init__(self, depth, active, governor=None):
+        self.engine = SimpleNamespace(
+            downloader=SimpleNamespace(
+                total_concurrency=0, active=set(range(active))
+            ),
+            slot=SimpleNamespace(scheduler=range(depth)),
+        )
+        self.governor = governor
+
+    def get_extension(self, cls):
+        return self.governor
+
+
+def test_rebalance_goes_through_memory_governor():
+    process = SimpleNamespace(settings=Settings({"CONCURRENT_REQUESTS": 12}))
+    runner = MultiSpiderRunner(process)
+    governor = _Governor()
+    crawlers = [_Crawler(1, 1), _Crawler(30, 2, governor), _Crawler(30, 0)]
+    runner.open_crawlers = crawlers
+    runner.rebalance()
+    concurrency = [crawler.engine.downloader.total_concurrency for crawler in crawlers]
+    assert concurrency == [2, 0, 5]
+    # The governor owns the downloader concurrency of its crawler
+    assert governor.bases == [5]
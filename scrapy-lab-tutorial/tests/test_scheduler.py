@@ -0,0 +1,56 @@
+import scrapy
+
+from scrapy_lab_tutorial.scheduler import CheckpointScheduler
+
+PAGES = 300
+
+
+def _page(index):
+    links = "".join(
+        f'<a href="/page/{target}">{target}</a>'
+        for target in (index * 3 + 1, index * 3 + 2, index * 3 + 3)
+        if target < PAGES
+    )
+    body = f"<html><body><h1>{index}</h1>{links}</body></html>"
+    return (200, {"Content-Type": "text/html; charset=utf-8"}, body.encode())
+
+
+class _PagesSpider(scrapy.Spider):
+    name = "checkpoint_test"
+
+    async def start(self):
+        yield scrapy.Request(f"{self.base_url}/page/0")
+
+    def parse(self, response):
+        yield {"page": response.css("h1::text").get()}
+        yield from response.follow_all(css="a")
+
+
+def test_resume_downloads_every_page_once(crawl, site, tmp_path):
+    server = site({f"/page/{index}": _page(index) for index in range(PAGES)})
+    settings = {
+        "JOBDIR": str(tmp_path / "job"),
+        "SCHEDULER": "scrapy_lab_tutorial.scheduler.CheckpointScheduler",
+        "CLOSESPIDER_PAGECOUNT": 100,
+        "CONCURRENT_REQUESTS": 16,
+    }
+    items, stats = crawl(_PagesSpider, settings, base_url=server.url)
+    assert stats["finish_reason"] == "closespider_pagecount"
+    assert len(server.hits) < PAGES
+    settings["CLOSESPIDER_PAGECOUNT"] = 0
+    resumed_items, resumed_stats = crawl(_PagesSpider, settings, base_url=server.url)
+    assert resumed_stats["finish_reason"] == "finished"
+    assert resumed_stats["checkpoint/restored"] > 0
+    assert len(server.hits) == PAGES
+    assert max(server.hits.values()) == 1
+    pages = [item["page"] for item in items + resumed_items]
+    assert sorted(pages, key=int) == [str(index) for index in range(PAGES)]
+
+
+def test_no_jobdir_behaves_like_the_default_scheduler(crawl, site):
+    server = site({f"/page/{index}": _page(index) for index in range(PAGES)})
+    settings = {"SCHEDULER": "scrapy_lab_tutorial.scheduler.CheckpointScheduler"}
+    items, stats = crawl(_PagesSpider, settings, base_url=server.url)
+    assert len(items) == PAGES
+    assert "checkpoint/restored" not in stats
+    assert CheckpointScheduler.__module__ == "scrapy_lab_tutorial.scheduler"
@@ -0,0 +1,131 @@
+import pytest
+import scrapy
+from scrapy.utils.test import get_crawler
+
+from scrapy_lab_tutorial.squeues import (
+    CompactFifoDiskQueue,
+    CompactFifoMemoryQueue,
+    CompactLifoDiskQueue,
+    CompactLifoMemoryQueue,
+)
+from scrapy_lab_tutorial.zyte import ZyteProfile, zyte_profile
+
+BROWSER = {"browserHtml": True, "actions": [{"action": "scrollBottom"}]}
+
+
+class _Spider(scrapy.Spider):
+    name = "squeues_test"
+
+    def parse_item(self, response):
+        pass
+
+    def handle_error(self, failure):
+        pass
+
+
+def _crawler(jobdir):
+    crawler = get_crawler(_Spider, {"JOBDIR": str(jobdir)})
+    crawler.spider = _Spider.from_crawler(crawler)
+    return crawler
+
+
+def _requests(spider):
+    return [
+        scrapy.Request(
+            "https://example.com/1",
+            callback=spider.parse_item,
+            errback=spider.handle_error,
+            priority=5,
+            meta={"zyte_api": zyte_profile(BROWSER), "depth": 2},
+        ),
+        scrapy.Request(
+            "https://example.com/2",
+            callback=spider.parse_item,
+            dont_filter=True,
+            meta={"zyte_api_automap": {"geolocation": "IE"}},
+        ),
+        # Per-request parameters stay in meta
+        scrapy.Request(
+            "https://example.com/3",
+            meta={"zyte_api": {"httpResponseBody": True, "echoData": "3"}},
+        ),
+        # Not compact: kept as is in memory, pickled on disk
+        scrapy.Request(
+            "https://example.com/4",
+            callback=spider.parse_item,
+            cb_kwargs={"page": 4},
+            meta={"zyte_api_automap": True},
+        ),
+    ]
+
+
+def _check(popped, expected):
+    assert popped.url == expected.url
+    assert popped.callback == expected.callback
+    assert popped.errback == expected.errback
+    assert popped.priority == expected.priority
+    assert popped.dont_filter == expected.dont_filter
+    assert popped.cb_kwargs == expected.cb_kwargs
+    assert popped.meta == expected.meta
+
+
+@pytest.mark.parametrize(
+    ("queue_class", "lifo"),
+    [(CompactLifoMemoryQueue, True), (CompactFifoMemoryQueue, False)],
+    ids=["lifo", "fifo"],
+)
+def test_memory_queue_round_trip(queue_class, lifo, tmp_path):
+    crawler = _crawler(tmp_path)
+    queue = queue_class.from_crawler(crawler)
+    requests = _requests(crawler.spider)
+    for request in requests:
+        queue.push(request)
+    assert len(queue) == len(requests)
+    expected = requests[::-1] if lifo else requests
+    assert queue.peek().url == expected[0].url
+    popped = [queue.pop() for _ in requests]
+    for request, original in zip(popped, expected):
+        _check(request, original)
+    assert queue.pop() is None
+    zyte_api = {request.url: request.meta.get("zyte_api") for request in popped}
+    assert zyte_api["https://example.com/1"] is zyte_profile(BROWSER)
+    automap = {request.url: request.meta.get("zyte_api_automap") for request in popped}
+    assert isinstance(automap["https://example.com/2"], ZyteProfile)
+    assert not isinstance(zyte_api["https://example.com/3"], ZyteProfile)
+
+
+@pytest.mark.parametrize(
+    ("queue_class", "lifo"),
+    [(CompactLifoDiskQueue, True), (CompactFifoDiskQueue, False)],
+    ids=["lifo", "fifo"],
+)
+def test_disk_queue_round_trip_across_runs(queue_class, lifo, tmp_path):
+    crawler = _crawler(tmp_path)
+    path = str(tmp_path / "requests.queue" / "p0")
+    queue = queue_class.from_crawler(crawler, path)
+    requests = _requests(crawler.spider)
+    for request in requests:
+        queue.push(request)
+    queue.close()
+    crawler.signals.send_catch_log(scrapy.signals.spider_closed, spider=crawler.spider)
+
+    # Resumed crawl: new crawler, spider and codec; profiles from JOBDIR
+    resumed = _crawler(tmp_path)
+    queue = queue_class.from_crawler(resumed, path)
+    assert len(queue) == len(requests)
+    expected = _requests(resumed.spider)
+    expected = expected[::-1] if lifo else expected
+    for original in expected:
+        request = queue.pop()
+        _check(request, original)
+        assert request.callback is None or request.callback.__self__ is resumed.spider
+    assert queue.pop() is None
+    queue.close()
+
+
+def test_disk_queue_rejects_unpicklable_requests(tmp_path):
+    crawler = _crawler(tmp_path)
+    queue = CompactFifoDiskQueue.from_crawler(crawler, str(tmp_path / "q"))
+    with pytest.raises(ValueError):
+        queue.push(scrapy.Request("https://example.com", callback=lambda r: None))
+    queue.close()
@@ -0,0 +1,60 @@
+import gzip
+import os
+
+import scrapy
+from itemadapter import ItemAdapter
+
+from scrapy_lab_tutorial.streaming import StreamingParseMixin
+
+QUOTE = (
+    '<div class="quote"><span class="text">Quote {0}</span>'
+    '<small class="author">Author {0}</small><a class="tag">t{0}</a>'
+    "<p>{1}</p></div>"
+)
+PAGE = (
+    "<html><body>"
+    # Incompressible padding, so that the gzip body arrives in several chunks
+    + "".join(QUOTE.format(i, os.urandom(4096).hex()) for i in range(40))
+    + "</body></html>"
+).encode()
+
+
+class _StreamingSpider(StreamingParseMixin, scrapy.Spider):
+    name = "streaming_test"
+    stream_parse = True
+
+    async def start(self):
+        requests = (("/plain", None), ("/gzip", None), ("/gzip-stop", 5))
+        for path, stop_after in requests:
+            yield scrapy.Request(
+                self.base_url + path,
+                callback=self.parse_streamed,
+                meta={"stream_parse_stop_after": stop_after},
+            )
+
+    def parse_streamed(self, response):
+        page = response.url.rsplit("/", 1)[1]
+        for item in super().parse_streamed(response):
+            yield {"page": page, **ItemAdapter(item).asdict()}
+
+
+def _page(request):
+    body = PAGE
+    headers = {"Content-Type": "text/html; charset=utf-8"}
+    if request.path.startswith("/gzip"):
+        body = gzip.compress(body)
+        headers["Content-Encoding"] = "gzip"
+    return 200, headers, body
+
+
+def test_streamed_quotes_plain_and_gzip(crawl, site):
+    server = site(dict.fromkeys(("/plain", "/gzip", "/gzip-stop"), _page))
+    items, stats = crawl(_StreamingSpider, {"DOWNLOAD_MAXSIZE": 0}, base_url=server.url)
+    by_page = {}
+    for item in items:
+        by_page.setdefault(item["page"], []).append(item)
+    assert len(by_page["plain"]) == 40
+    assert len(by_page["gzip"]) == 40
+    assert by_page["gzip"][0]["text"] == "Quote 0"
+    assert 5 <= len(by_page["gzip-stop"]) < 40
+    assert stats["stream_parse/stopped_early"] == 1
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+from scrapy.http import HtmlResponse
+from scrapy.utils.test import get_crawler
+
+from scrapy_lab_tutorial.spiders.traditional import TraditionalSpider
+from scrapy_lab_tutorial.spiders.zyteapi_solution import (
+    ZyteapiSolutionSpider,
+    extract_quotes,
+)
+from scrapy_lab_tutorial.templates import TemplateExtractor
+
+QUOTE = (
+    '<div class="quote"><span class="text">Quote {0}</span>'
+    '<span>by <small class="author">Author {0}</small></span>'
+    '<div class="tags">{1}</div></div>'
+)
+
+
+def _page(url, count, first=0, header_first=True):
+    quotes = "".join(
+        QUOTE.format(i, "".join(f'<a class="tag">t{j}</a>' for j in range(i % 3)))
+        for i in range(first, first + count)
+    )
+    header = '<div class="header"><h1>Quotes</h1></div>'
+    quotes = f'<div class="col-md-8">{quotes}</div>'
+    parts = (header, quotes) if header_first else (quotes, header)
+    body = f"<html><body>{''.join(parts)}</body></html>"
+    return HtmlResponse(url, body=body.encode(), encoding="utf-8")
+
+
+def _values(items):
+    return [
+        {name: value for name, value in item.items() if name != "method"}
+        for item in items
+    ]
+
+
+def test_plan_is_reused_for_pages_of_a_template():
+    extractor = TemplateExtractor()
+    first = _page("https://quotes.example/page/1/", 10)
+    second = _page("https://quotes.example/page/2/", 7, first=10)
+    assert _values(extractor.extract(first)) == _values(extract_quotes(first))
+    assert (extractor.hits, extractor.misses) == (0, 1)
+    items = extractor.extract(second)
+    assert (extractor.hits, extractor.misses) == (1, 1)
+    assert _values(items) == _values(extract_quotes(second))
+    assert items[1]["tags"] == ["t0", "t1"]
+    assert type(items[0]["text"]) is str
+    # Another host is another template
+    extractor.extract(_page("https://other.example/", 3))
+    assert extractor.misses == 2
+
+
+def test_changed_layout_falls_back_and_rebuilds_plan():
+    extractor = TemplateExtractor()
+    extractor.extract(_page("https://quotes.example/1", 5))
+    # Same tags and classes, so the same template, but the plan finds nothing
+    changed = _page("https://quotes.example/2", 5, header_first=False)
+    assert _values(extractor.extract(changed)) == _values(extract_quotes(changed))
+    assert (extractor.hits, extractor.misses) == (0, 2)
+    changed = _page("https://quotes.example/3", 6, header_first=False)
+    assert _values(extractor.extract(changed)) == _values(extract_quotes(changed))
+    assert (extractor.hits, extractor.misses) == (1, 2)
+
+
+@pytest.mark.parametrize("template_extraction", [False, True])
+def test_traditional_spider(template_extraction):
+    crawler = get_crawler(
+        TraditionalSpider, {"TEMPLATE_EXTRACTION": template_extraction}
+    )
+    spider = TraditionalSpider.from_crawler(crawler)
+    response = _page("https://quotes.example/", 4)
+    items = list(spider.parse(response))
+    assert [item["text"] for item in items] == [f"Quote {i}" for i in range(4)]
+    assert all(item["method"] == "traditional_scrapy" for item in items)
+    assert all(item["success"] for item in items)
+
+
+async def _parse(spider, response):
+    return [item async for item in spider.parse(response)]
+
+
+def test_zyteapi_solution_spider_template_extraction():
+    crawler = get_crawler(ZyteapiSolutionSpider, {"TEMPLATE_EXTRACTION": True})
+    spider = ZyteapiSolutionSpider.from_crawler(crawler)
+    response = _page("https://quotes.example/", 4)
+    items = asyncio.run(_parse(spider, response))
+    assert _values(items) == _values(extract_quotes(response))